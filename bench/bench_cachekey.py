@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Microbenchmark of cache key builders: core.hashToString/toupleToString
+against cachekey module
+
+Usage: python bench/bench_cachekey.py [number]
+'''
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 
+                                '..', 'src', 'fast'))
+
+from core import hashToString, toupleToString
+from cachekey import getFunctionKey, getQueryKey
+
+SQL = 'SELECT * FROM monitord_log WHERE server=%s AND node IN (%s) LIMIT %s'
+
+CASES = {
+    'small' : ({'server' : 'srv1', 'node' : 12, 'limit' : 10},
+               ('srv1', 12, 10)),
+    'medium': (dict(('key%s' % i, 'value %s' % i) for i in range(50)),
+               tuple('value %s' % i for i in range(50))),
+    'large' : ({'ids' : range(5000), 'name' : 'x' * 10000},
+               (range(5000), 'x' * 10000)),
+}
+
+#==============================================================================
+def function():
+    pass
+
+#==============================================================================
+def bench(name, stmt, number):
+    best = min(timeit.repeat(stmt, number=number, repeat=3))
+    print '  %-28s %10.2f us/call' % (name, best / number * 1e6)
+
+#==============================================================================
+def main(number):
+    for case in sorted(CASES):
+        hash_args, tuple_args = CASES[case]
+        print '%s:' % case
+        bench('hashToString', lambda: hashToString(hash_args), number)
+        bench('cachekey.getFunctionKey', 
+              lambda: getFunctionKey('bench', function, hash_args), number)
+        bench('toupleToString', lambda: toupleToString(tuple_args), number)
+        bench('cachekey.getQueryKey', 
+              lambda: getQueryKey('bench', SQL, tuple_args), number)
+        print '  key length: old=%s new=%s' % (
+                len('bench---' + hashToString(hash_args)),
+                len(getFunctionKey('bench', function, hash_args)))
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
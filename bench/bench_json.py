@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Microbenchmark of JSON encoder backends against old returnJsonResponse
+encoding (json.dumps with dthandler) on typical response payloads
+
+Usage: python bench/bench_json.py [number]
+'''
+import os
+import sys
+import json
+import timeit
+import decimal
+import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src', 'fast'))
+
+from jsonencoder import getEncoder, getAvailable
+
+dthandler = lambda obj: obj.isoformat() if isinstance(obj, datetime.datetime) else None
+
+NOW = datetime.datetime(2020, 1, 2, 3, 4, 5)
+
+def row(i):
+    return {
+        'id'      : i,
+        'name'    : u'Сервер %s' % i,
+        'host'    : 'srv%s.example.com' % i,
+        'status'  : 'ok' if i % 3 else 'failed',
+        'load'    : i * 0.37,
+        'created' : NOW,
+    }
+
+CASES = {
+    'small' : {'status' : 'ok', 'count' : 12, 'time' : NOW},
+    'rows'  : {'rows' : [row(i) for i in range(1000)], 'total' : 1000},
+    'ascii' : {'rows' : [dict(row(i), name='server %s' % i) for i in range(1000)]},
+    'large' : {'rows' : [row(i) for i in range(20000)]},
+}
+
+#==============================================================================
+def old(data):
+    response = json.dumps(data, ensure_ascii=False, default=dthandler)
+    if isinstance(response, unicode):
+        response = response.encode('utf-8')
+    return response
+
+#==============================================================================
+def bench(name, function, data, number):
+    best = min(timeit.repeat(lambda: function(data), number=number, repeat=3))
+    print '  %-24s %10.1f us/call %8s bytes' % (name, best / number * 1e6,
+                                                len(function(data)))
+
+#==============================================================================
+def main(number):
+    print 'backends: %s' % ', '.join(getAvailable())
+    for case in ('small', 'rows', 'ascii', 'large'):
+        data  = CASES[case]
+        count = max(1, number / len(json.dumps(data, default=dthandler)) * 100)
+        print '%s:' % case
+        bench('json.dumps + dthandler', old, data, count)
+        for name in getAvailable():
+            bench(name, getEncoder(name).encode, data, count)
+
+    # payloads the old path fails on
+    decimals = {'sum' : decimal.Decimal('10.25'), 'day' : NOW.date()}
+    mixed    = {'utf8' : 'Сервер', 'unicode' : u'Сервер'}
+    for name in getAvailable():
+        encoder = getEncoder(name)
+        print '%-12s %s %s' % (name, encoder.encode(decimals), encoder.encode(mixed))
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Startup benchmark: import cost of fast modules and wall time from
+script start to the first served request of FastServer and
+WorkerMultiprocessServer
+
+Every run is a fresh interpreter. Import cost is reported per module
+as self/cumulative time like python -X importtime (Python 2 has no
+such option). Worker request is one job done by a forked worker and
+reported to the supervisor - Gearman is not involved.
+
+Usage: python bench/bench_startup.py [runs]
+'''
+import os
+import sys
+import time
+import json
+import shutil
+import tempfile
+import subprocess
+
+STARTED = time.time()
+
+FAST_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         '..', 'src', 'fast')
+
+CONFIG = '''[daemon]
+port = 0
+
+[main]
+gearman_server = 127.0.0.1:4730
+'''
+
+#==============================================================================
+class ImportTimer:
+    '''
+    __import__ wrapper recording self and cumulative time of every module
+    loaded for the first time
+    '''
+    #--------------------------------------------------------------------------
+    def __init__(self):
+        self.times = {}
+        self._stack = []
+        self._import = None
+
+    #--------------------------------------------------------------------------
+    def install(self):
+        import __builtin__
+        self._import = __builtin__.__import__
+        __builtin__.__import__ = self
+
+    #--------------------------------------------------------------------------
+    def uninstall(self):
+        import __builtin__
+        __builtin__.__import__ = self._import
+
+    #--------------------------------------------------------------------------
+    def __call__(self, name, globals=None, locals=None, fromlist=None, level=-1):
+        before = set(sys.modules)
+        self._stack.append(0.0)
+        started = time.time()
+        try:
+            return self._import(name, globals, locals, fromlist, level)
+        finally:
+            spent  = time.time() - started
+            nested = self._stack.pop()
+            if self._stack:
+                self._stack[-1] += spent
+            loaded = [module for module in set(sys.modules) - before
+                      if sys.modules[module] is not None]
+            if loaded:
+                key = name if name in loaded else min(loaded, key=len)
+                self.times[key] = (spent - nested, spent)
+
+#==============================================================================
+def makeConfig(name):
+    directory = tempfile.mkdtemp(prefix='bench-startup-')
+    os.mkdir(os.path.join(directory, 'config'))
+    with open(os.path.join(directory, 'config', name + '-defaults.ini'), 'w') as f:
+        f.write(CONFIG)
+    return directory
+
+#==============================================================================
+def runImport():
+    timer = ImportTimer()
+    timer.install()
+    import core
+    timer.uninstall()
+    return {
+        'total'   : time.time() - STARTED,
+        'modules' : timer.times,
+        'logger'  : core.logger._log is not None,
+    }
+
+#==============================================================================
+def runServer():
+    from core import FastServer
+    from fasttwisted import FastJsonServerResource
+    from twisted.internet import reactor
+    from twisted.web import server
+    from twisted.web.client import Agent, readBody
+
+    class BenchResource(FastJsonServerResource):
+        def render_GET(self, request):
+            return self.returnJsonResponse(request, {'status' : 'ok'})
+
+    class BenchServer(FastServer):
+        config_file = 'bench'
+
+    directory = makeConfig(BenchServer.config_file)
+    result = {}
+    try:
+        bench = BenchServer(dir=directory)
+        bench.loadConfig()
+        port = bench.listen(server.Site(BenchResource(bench)), '127.0.0.1')
+        result['listen'] = time.time() - STARTED
+
+        def served(body):
+            result['request'] = time.time() - STARTED
+            reactor.stop()
+
+        def failed(reason):
+            result['error'] = reason.getErrorMessage()
+            reactor.stop()
+
+        url = 'http://127.0.0.1:%s/' % port.getHost().port
+        deferred = Agent(reactor).request('GET', url)
+        deferred.addCallback(readBody)
+        deferred.addCallbacks(served, failed)
+        reactor.run()
+    finally:
+        shutil.rmtree(directory)
+    return result
+
+#==============================================================================
+def runWorker():
+    from core import FastObject
+    from multi import WorkerMultiprocessServer
+
+    class BenchProcessor(FastObject):
+        logging = True
+        def run(self, params):
+            self._log('Bench job [%s]' % params)
+            return params
+
+    class BenchWorkerServer(WorkerMultiprocessServer):
+        config_file = 'bench'
+        def _validatedConfig(self):
+            self.dir = directory
+            return WorkerMultiprocessServer._validatedConfig(self)
+        def start(self):
+            read, write = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                os.close(read)
+                os.write(write, json.dumps(BenchProcessor().run({'job' : 1})))
+                os._exit(0)
+            os.close(write)
+            data = os.read(read, 4096)
+            os.waitpid(pid, 0)
+            return data
+
+    directory = makeConfig(BenchWorkerServer.config_file)
+    result = {}
+    try:
+        worker = BenchWorkerServer()
+        result['config'] = time.time() - STARTED
+        worker.start()
+        result['request'] = time.time() - STARTED
+    finally:
+        shutil.rmtree(directory)
+    return result
+
+#==============================================================================
+def child(mode):
+    sys.path.insert(0, FAST_PATH)
+    result = {'import' : runImport, 'server' : runServer,
+              'worker' : runWorker}[mode]()
+    sys.stdout.write(json.dumps(result))
+
+#==============================================================================
+def spawn(mode):
+    output = subprocess.check_output([sys.executable, __file__, '--child', mode])
+    return json.loads(output.splitlines()[-1])
+
+#==============================================================================
+def main(runs):
+    results = [spawn('import') for i in range(runs)]
+    best = min(results, key=lambda result: result['total'])
+    print 'import core: %.1f ms (best of %s), logger created: %s' % (
+            best['total'] * 1000, runs, best['logger'])
+    print '  %10s %10s  module' % ('self us', 'cumul us')
+    modules = sorted(best['modules'].items(), key=lambda item: item[1][1],
+                     reverse=True)
+    for name, (own, cumulative) in modules[:25]:
+        print '  %10d %10d  %s' % (own * 1e6, cumulative * 1e6, name)
+
+    for mode, stages in (('server', ('listen', 'request')),
+                         ('worker', ('config', 'request'))):
+        results = [spawn(mode) for i in range(runs)]
+        errors  = [result['error'] for result in results if 'error' in result]
+        if errors:
+            print '%s: failed [%s]' % (mode, errors[0])
+            continue
+        print '%s:' % mode
+        for stage in stages:
+            times = sorted(result[stage] for result in results)
+            print '  %-8s best %7.1f ms  median %7.1f ms' % (stage,
+                    times[0] * 1000, times[len(times) / 2] * 1000)
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2 and sys.argv[1] == '--child':
+        child(sys.argv[2])
+    else:
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -3,10 +3,10 @@
 '''Daemon class'''
  
 import sys, os, time, atexit
-from signal import SIGTERM
+from signal import SIGTERM, SIGHUP
  
 class Daemon:
-    actions = ['start', 'stop', 'restart']
+    actions = ['start', 'stop', 'restart', 'reload']
     name    = ''
     port    = 0
             
@@ -149,6 +149,21 @@ class Daemon:
         self.stop()
         self.start()
 
+    #----------------------------------------------------------------------------
+    def reload(self):
+        """
+        Reload config of running daemon - server reloads on SIGHUP
+        (FastConfigObject.installReloadHandler)
+        """
+        pid = self.get_pid()
+
+        if not pid:
+            message = "pidfile %s does not exist. Daemon not running?\n"
+            sys.stderr.write(message % self.pidfile)
+            sys.exit(1)
+
+        os.kill(pid, SIGHUP)
+
     #----------------------------------------------------------------------------
     def run(self):
         """
@@ -171,10 +186,10 @@ class Daemon:
                         eval('self.'+action+'()')
                         print '\t\t\t[Ok]'
                         return
-                print 'Unknown action\n' + ( self.name + ' usage: %s '+"|".join(self.actions) ) % argv[0] # |reload
+                print 'Unknown action\n' + ( self.name + ' usage: %s '+"|".join(self.actions) ) % argv[0]
                 sys.exit(2)
             else:
-                print ( self.name + ' usage: %s '+"|".join(self.actions) ) % argv[0] # |reload
+                print ( self.name + ' usage: %s '+"|".join(self.actions) ) % argv[0]
                 sys.exit(2)
         except Exception, ex:
             print '\t\t\t[Error]', (ex)            
\ No newline at end of file
@@ -0,0 +1,459 @@
+# -*- coding: utf-8 -*-
+'''
+Non-blocking memcache client for reactor thread
+'''
+import time
+import zlib
+import pickle
+
+from twisted.internet import defer, protocol
+from twisted.python import failure
+from twisted.internet.error import ConnectionDone, ConnectionLost, TimeoutError
+from twisted.protocols.memcache import MemCacheProtocol
+
+from ketama import ClusterNode, HashRing, parseServers, DEFAULT_RETRY
+
+# value flags of python-memcache - both clients read values of each other
+FLAG_PICKLE     = 1 << 0
+FLAG_INTEGER    = 1 << 1
+FLAG_LONG       = 1 << 2
+FLAG_COMPRESSED = 1 << 3
+FLAG_TEXT       = 1 << 4
+
+GET_BATCH_SIZE = 100
+
+#==============================================================================
+def encodeValue(value):
+    '''
+    Value to (flags, bytes)
+    '''
+    if isinstance(value, str):
+        return 0, value
+    if isinstance(value, unicode):
+        return FLAG_TEXT, value.encode('utf-8')
+    if isinstance(value, int):
+        return FLAG_INTEGER, '%d' % value
+    if isinstance(value, long):
+        return FLAG_LONG, '%d' % value
+    return FLAG_PICKLE, pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+#==============================================================================
+def decodeValue(flags, data):
+    '''
+    (flags, bytes) to value
+    '''
+    if flags & FLAG_COMPRESSED:
+        data = zlib.decompress(data)
+    if flags & FLAG_TEXT:
+        return data.decode('utf-8')
+    if flags & FLAG_INTEGER:
+        return int(data)
+    if flags & FLAG_LONG:
+        return long(data)
+    if flags & FLAG_PICKLE:
+        return pickle.loads(data)
+    return data
+
+#==============================================================================
+def _key(key):
+    if isinstance(key, unicode):
+        return key.encode('utf-8')
+    return key
+
+#==============================================================================
+class MemcacheUnavailable(Exception):
+    '''
+    No connection to memcache server
+    '''
+
+#==============================================================================
+class _MemcacheConnection(MemCacheProtocol):
+    #--------------------------------------------------------------------------
+    def connectionMade(self):
+        self.factory.pool._connected(self)
+
+    #--------------------------------------------------------------------------
+    def connectionLost(self, reason):
+        self.factory.pool._lost(self)
+        MemCacheProtocol.connectionLost(self, reason)
+
+#==============================================================================
+class _MemcacheFactory(protocol.ReconnectingClientFactory):
+    protocol = _MemcacheConnection
+    noisy    = False
+
+    #--------------------------------------------------------------------------
+    def __init__(self, pool):
+        self.pool     = pool
+        self.maxDelay = pool.maxDelay
+
+    #--------------------------------------------------------------------------
+    def buildProtocol(self, addr):
+        self.resetDelay()
+        connection = self.protocol(self.pool.timeout)
+        connection.factory = self
+        return connection
+
+#==============================================================================
+class MemcachePool:
+    '''
+    size connections to one memcache server, reconnected with backoff up
+    to maxDelay seconds. Commands are pipelined on connections (round
+    robin), gets issued in one reactor iteration are sent as one get_multi.
+    Values are compatible with python-memcache. Use from reactor thread only
+    '''
+    #--------------------------------------------------------------------------
+    def __init__(self, host, port=11211, size=2, timeout=5, maxDelay=30):
+        self.host     = host
+        self.port     = port
+        self.size     = size
+        self.timeout  = timeout
+        self.maxDelay = maxDelay
+
+        self.gets     = 0
+        self.batches  = 0
+        self.hits     = 0
+        self.misses   = 0
+        self.errors   = 0
+        self.disconnects = 0
+
+        self._factories   = []
+        self._connections = []
+        self._next        = 0
+        self._pendingGets = {}
+        self._flushCall   = None
+        self._reactor     = None
+
+    #--------------------------------------------------------------------------
+    @classmethod
+    def fromAddress(cls, address, **kwargs):
+        '''
+        Pool for host:port
+        '''
+        host, port = address, 11211
+        if ':' in address:
+            host, port = address.rsplit(':', 1)
+            port = int(port)
+        return cls(host, port, **kwargs)
+
+    #--------------------------------------------------------------------------
+    @property
+    def address(self):
+        return '%s:%s' % (self.host, self.port)
+
+    #--------------------------------------------------------------------------
+    def start(self, reactor=None):
+        if reactor is None:
+            from twisted.internet import reactor
+        self._reactor = reactor
+        for i in range(self.size - len(self._factories)):
+            factory = _MemcacheFactory(self)
+            self._factories.append(factory)
+            reactor.connectTCP(self.host, self.port, factory, self.timeout)
+
+    #--------------------------------------------------------------------------
+    def stop(self):
+        for factory in self._factories:
+            factory.stopTrying()
+        for connection in self._connections:
+            connection.transport.loseConnection()
+        self._factories = []
+
+    #--------------------------------------------------------------------------
+    def isConnected(self):
+        return bool(self._connections)
+
+    #--------------------------------------------------------------------------
+    def _connected(self, connection):
+        self._connections.append(connection)
+
+    #--------------------------------------------------------------------------
+    def _lost(self, connection):
+        if connection in self._connections:
+            self._connections.remove(connection)
+            self.disconnects += 1
+
+    #--------------------------------------------------------------------------
+    def _call(self, method, *args):
+        '''
+        Run protocol command on next connection
+        '''
+        if not self._connections:
+            self.errors += 1
+            return defer.fail(MemcacheUnavailable(
+                        'No connection to memcache [%s]' % self.address))
+        self._next = (self._next + 1) % len(self._connections)
+        deferred = getattr(self._connections[self._next], method)(*args)
+        deferred.addErrback(self._failed)
+        return deferred
+
+    #--------------------------------------------------------------------------
+    def _failed(self, reason):
+        self.errors += 1
+        return reason
+
+    #--------------------------------------------------------------------------
+    def get(self, key):
+        '''
+        Deferred value, None if key is absent
+        '''
+        key = _key(key)
+        self.gets += 1
+        deferred = defer.Deferred()
+        waiting  = self._pendingGets.get(key)
+        if waiting is None:
+            self._pendingGets[key] = [deferred]
+            if self._flushCall is None:
+                self._flushCall = self._reactor.callLater(0, self._flushGets)
+        else:
+            waiting.append(deferred)
+        return deferred
+
+    #--------------------------------------------------------------------------
+    def _flushGets(self):
+        self._flushCall = None
+        pending, self._pendingGets = self._pendingGets, {}
+        keys = pending.keys()
+        for i in range(0, len(keys), GET_BATCH_SIZE):
+            batch = keys[i:i + GET_BATCH_SIZE]
+            deferred = self.getMulti(batch)
+            deferred.addCallbacks(self._dispatchGets, self._failGets,
+                                  callbackArgs=(batch, pending),
+                                  errbackArgs=(batch, pending))
+
+    #--------------------------------------------------------------------------
+    def _dispatchGets(self, values, keys, pending):
+        for key in keys:
+            value = values.get(key)
+            for deferred in pending[key]:
+                deferred.callback(value)
+
+    #--------------------------------------------------------------------------
+    def _failGets(self, reason, keys, pending):
+        for key in keys:
+            for deferred in pending[key]:
+                deferred.errback(reason)
+
+    #--------------------------------------------------------------------------
+    def getMulti(self, keys):
+        '''
+        Deferred dict of found keys
+        '''
+        keys = [_key(key) for key in keys]
+        if not keys:
+            return defer.succeed({})
+        self.batches += 1
+        deferred = self._call('getMultiple', keys)
+        deferred.addCallback(self._decodeMulti)
+        return deferred
+
+    #--------------------------------------------------------------------------
+    def _decodeMulti(self, values):
+        result = {}
+        for key, (flags, data) in values.iteritems():
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                result[key] = decodeValue(flags, data)
+        return result
+
+    #--------------------------------------------------------------------------
+    def set(self, key, value, expire=0):
+        flags, data = encodeValue(value)
+        return self._call('set', _key(key), data, flags, expire)
+
+    #--------------------------------------------------------------------------
+    def add(self, key, value, expire=0):
+        flags, data = encodeValue(value)
+        return self._call('add', _key(key), data, flags, expire)
+
+    #--------------------------------------------------------------------------
+    def replace(self, key, value, expire=0):
+        flags, data = encodeValue(value)
+        return self._call('replace', _key(key), data, flags, expire)
+
+    #--------------------------------------------------------------------------
+    def delete(self, key):
+        return self._call('delete', _key(key))
+
+    #--------------------------------------------------------------------------
+    def incr(self, key, delta=1):
+        '''
+        Deferred new value, None if key is absent
+        '''
+        deferred = self._call('increment', _key(key), delta)
+        deferred.addCallback(lambda value: None if value is False else value)
+        return deferred
+
+    #--------------------------------------------------------------------------
+    def getStats(self):
+        return {
+            'address'     : self.address,
+            'connections' : len(self._connections),
+            'gets'        : self.gets,
+            'batches'     : self.batches,
+            'hits'        : self.hits,
+            'misses'      : self.misses,
+            'errors'      : self.errors,
+            'disconnects' : self.disconnects,
+        }
+
+#==============================================================================
+class AsyncMemcacheNode(ClusterNode):
+    '''
+    One server of AsyncMemcacheCluster with its connection pool
+    '''
+    #--------------------------------------------------------------------------
+    def __init__(self, name, retry=DEFAULT_RETRY, **kwargs):
+        ClusterNode.__init__(self, name, retry)
+        self.pool = MemcachePool.fromAddress(name, **kwargs)
+
+    #--------------------------------------------------------------------------
+    def isAvailable(self):
+        if not self.pool.isConnected():
+            return False
+        return ClusterNode.isAvailable(self)
+
+    #--------------------------------------------------------------------------
+    def call(self, method, *args):
+        started  = time.time()
+        deferred = getattr(self.pool, method)(*args)
+        deferred.addBoth(self._done, started)
+        return deferred
+
+    #--------------------------------------------------------------------------
+    def _done(self, result, started):
+        self.record(time.time() - started)
+        if isinstance(result, failure.Failure) and result.check(
+                MemcacheUnavailable, ConnectionDone, ConnectionLost, TimeoutError):
+            self.eject()
+        return result
+
+    #--------------------------------------------------------------------------
+    def getStats(self):
+        stats = ClusterNode.getStats(self)
+        stats['pool'] = self.pool.getStats()
+        return stats
+
+#==============================================================================
+class AsyncMemcacheCluster:
+    '''
+    MemcachePool interface over comma separated servers with ketama hashing.
+    Node is ejected for retry seconds when it fails or has no connection
+    '''
+    #--------------------------------------------------------------------------
+    def __init__(self, servers, retry=DEFAULT_RETRY, **kwargs):
+        self.address = servers
+        self.nodes   = [AsyncMemcacheNode(server, retry, **kwargs)
+                        for server in parseServers(servers)]
+        self.ring    = HashRing(self.nodes)
+
+    #--------------------------------------------------------------------------
+    def start(self, reactor=None):
+        for node in self.nodes:
+            node.pool.start(reactor)
+
+    #--------------------------------------------------------------------------
+    def stop(self):
+        for node in self.nodes:
+            node.pool.stop()
+
+    #--------------------------------------------------------------------------
+    def isConnected(self):
+        for node in self.nodes:
+            if node.pool.isConnected():
+                return True
+        return False
+
+    #--------------------------------------------------------------------------
+    def _node(self, key):
+        return self.ring.getNode(_key(key))
+
+    #--------------------------------------------------------------------------
+    def _call(self, method, key, *args):
+        node = self._node(key)
+        if node is None:
+            return defer.fail(MemcacheUnavailable(
+                        'No live memcache server of [%s]' % self.address))
+        return node.call(method, key, *args)
+
+    #--------------------------------------------------------------------------
+    def get(self, key):
+        node = self._node(key)
+        if node is None:
+            return defer.fail(MemcacheUnavailable(
+                        'No live memcache server of [%s]' % self.address))
+        deferred = node.call('get', key)
+        deferred.addCallback(self._counted, node)
+        return deferred
+
+    #--------------------------------------------------------------------------
+    def _counted(self, value, node):
+        if value is None:
+            node.misses += 1
+        else:
+            node.hits += 1
+        return value
+
+    #--------------------------------------------------------------------------
+    def getMulti(self, keys):
+        '''
+        Deferred dict of found keys - keys of failed nodes are missed
+        '''
+        byNode = {}
+        for key in keys:
+            node = self._node(key)
+            if node is not None:
+                byNode.setdefault(node, []).append(key)
+
+        results = []
+        for node, nodeKeys in byNode.items():
+            deferred = node.call('getMulti', nodeKeys)
+            deferred.addCallback(self._countedMulti, node, len(nodeKeys))
+            deferred.addErrback(lambda reason: {})
+            results.append(deferred)
+
+        deferred = defer.gatherResults(results)
+        deferred.addCallback(self._merge)
+        return deferred
+
+    #--------------------------------------------------------------------------
+    def _countedMulti(self, found, node, count):
+        node.hits   += len(found)
+        node.misses += count - len(found)
+        return found
+
+    #--------------------------------------------------------------------------
+    def _merge(self, results):
+        merged = {}
+        for found in results:
+            merged.update(found)
+        return merged
+
+    #--------------------------------------------------------------------------
+    def set(self, key, value, expire=0):
+        return self._call('set', key, value, expire)
+
+    #--------------------------------------------------------------------------
+    def add(self, key, value, expire=0):
+        return self._call('add', key, value, expire)
+
+    #--------------------------------------------------------------------------
+    def replace(self, key, value, expire=0):
+        return self._call('replace', key, value, expire)
+
+    #--------------------------------------------------------------------------
+    def delete(self, key):
+        return self._call('delete', key)
+
+    #--------------------------------------------------------------------------
+    def incr(self, key, delta=1):
+        return self._call('incr', key, delta)
+
+    #--------------------------------------------------------------------------
+    def getStats(self):
+        '''
+        Hit/miss, latency and ejection counters per node
+        '''
+        return dict((node.name, node.getStats()) for node in self.nodes)
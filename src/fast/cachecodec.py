@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+'''
+Codec of cached values
+
+Stored value is a string: 4 byte header (magic, version, codec, flags)
+and payload. Payload is marshal of simple values or pickle of anything
+else, zlib compressed when it is longer than compress threshold. Value
+longer than memcache item limit is split into chunks stored under own
+keys - main key keeps header with chunk count, total length and token
+of the write, so chunks of different writes are never mixed.
+'''
+import os
+import zlib
+import struct
+import marshal
+import pickle
+import binascii
+
+from cachekey import makeKey, KEY_MAX_LENGTH
+
+MAGIC          = '\xfa'
+CODEC_VERSION  = 1
+
+CODEC_MARSHAL  = 'm'
+CODEC_PICKLE   = 'p'
+
+FLAG_ZLIB      = 1
+FLAG_CHUNKED   = 2
+
+COMPRESS_THRESHOLD = 1024
+COMPRESS_LEVEL     = 1
+ITEM_LIMIT         = 1000 * 1000   # memcache item is 1 MB with overhead
+
+_HEADER = struct.Struct('<cBcB')
+_CHUNKS = struct.Struct('<II8s')
+
+#==============================================================================
+def dumps(value, compressThreshold=COMPRESS_THRESHOLD, level=COMPRESS_LEVEL):
+    '''
+    Value to string with header
+    '''
+    try:
+        codec, payload = CODEC_MARSHAL, marshal.dumps(value, 2)
+    except ValueError:
+        # datetime, Decimal, objects
+        codec, payload = CODEC_PICKLE, pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    flags = 0
+    if compressThreshold and len(payload) > compressThreshold:
+        compressed = zlib.compress(payload, level)
+        if len(compressed) < len(payload):
+            flags, payload = FLAG_ZLIB, compressed
+
+    return _HEADER.pack(MAGIC, CODEC_VERSION, codec, flags) + payload
+
+#==============================================================================
+def isEncoded(data):
+    return isinstance(data, str) and data[:1] == MAGIC
+
+#==============================================================================
+def loads(data, legacy=None):
+    '''
+    String with header to value. Data written before codec (without
+    header) is returned as is or converted by legacy function
+    '''
+    if not isEncoded(data):
+        if legacy is not None and data is not None:
+            return legacy(data)
+        return data
+
+    magic, version, codec, flags = _HEADER.unpack_from(data)
+    if version != CODEC_VERSION:
+        raise ValueError('Unknown cached value version [%s]' % version)
+    if flags & FLAG_CHUNKED:
+        raise ValueError('Chunked value must be joined before loads')
+
+    payload = data[_HEADER.size:]
+    if flags & FLAG_ZLIB:
+        payload = zlib.decompress(payload)
+    if codec == CODEC_MARSHAL:
+        return marshal.loads(payload)
+    if codec == CODEC_PICKLE:
+        return pickle.loads(payload)
+    raise ValueError('Unknown cached value codec [%s]' % codec)
+
+#==============================================================================
+def _chunkKey(key, token, index):
+    chunkKey = '%s:%s:%d' % (key, token, index)
+    if len(chunkKey) > KEY_MAX_LENGTH:
+        chunkKey = makeKey('chunk', key, token, index)
+    return chunkKey
+
+#==============================================================================
+def split(key, data, itemLimit=ITEM_LIMIT):
+    '''
+    Encoded data to (head for key, {chunk key : chunk}). Head is data
+    itself if it fits in one item
+    '''
+    if len(data) <= itemLimit:
+        return data, {}
+
+    token  = binascii.hexlify(os.urandom(4))
+    count  = (len(data) + itemLimit - 1) / itemLimit
+    chunks = {}
+    for index in range(count):
+        chunks[_chunkKey(key, token, index)] = \
+            data[index * itemLimit:(index + 1) * itemLimit]
+
+    head = _HEADER.pack(MAGIC, CODEC_VERSION, CODEC_PICKLE, FLAG_CHUNKED) + \
+           _CHUNKS.pack(count, len(data), token)
+    return head, chunks
+
+#==============================================================================
+def isChunked(data):
+    return isEncoded(data) and bool(ord(data[3]) & FLAG_CHUNKED)
+
+#==============================================================================
+def chunkKeys(key, head):
+    '''
+    Keys of chunks of value stored under key
+    '''
+    count, length, token = _CHUNKS.unpack_from(head, _HEADER.size)
+    return [_chunkKey(key, token, index) for index in range(count)]
+
+#==============================================================================
+def join(key, head, chunks):
+    '''
+    Encoded data from chunks fetched by chunkKeys, None if any is missed
+    '''
+    count, length, token = _CHUNKS.unpack_from(head, _HEADER.size)
+    parts = []
+    for chunkKey in chunkKeys(key, head):
+        part = chunks.get(chunkKey)
+        if part is None:
+            return None
+        parts.append(part)
+    data = ''.join(parts)
+    if len(data) != length:
+        return None
+    return data
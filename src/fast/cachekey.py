@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+'''
+Cache key derivation
+
+Arguments are serialized to a canonical type-tagged string and hashed,
+so keys are deterministic, collision free for different arguments and
+never longer than memcache key limit.
+'''
+import hashlib
+import marshal
+from datetime import datetime, date
+from decimal import Decimal
+
+# memcache key length limit
+KEY_MAX_LENGTH = 250
+
+# namespace and digest separator
+KEY_SEPARATOR = ':'
+
+_NAMESPACE_MAX = KEY_MAX_LENGTH - len(KEY_SEPARATOR) - 40
+
+# marshal format without interned strings - versions 1+ write interned
+# and runtime built equal strings differently
+_MARSHAL_VERSION = 0
+
+# types marshal serializes deterministically
+_SIMPLE = frozenset([type(None), bool, int, long, float, str, unicode])
+_SIMPLE_BASES = (bool, int, long, float, str, unicode)
+
+#==============================================================================
+def _serialize(value, out):
+    '''
+    Append canonical representation of value to out list. Every chunk is
+    self-delimiting: marshal output or tag + length header
+    '''
+    kind = type(value)
+    if kind in _SIMPLE:
+        out.append(marshal.dumps(value, _MARSHAL_VERSION))
+    elif kind is list or kind is tuple:
+        if _SIMPLE.issuperset(map(type, value)):
+            out.append(marshal.dumps(value, _MARSHAL_VERSION))
+        else:
+            out.append('%s%d:' % ('L' if kind is list else 'P', len(value)))
+            for item in value:
+                _serialize(item, out)
+    elif isinstance(value, dict):
+        items = [(marshal.dumps(key, _MARSHAL_VERSION) if type(key) in _SIMPLE 
+                  else serializeArgs(key), item) 
+                 for key, item in value.iteritems()]
+        items.sort()
+        out.append('D%d:' % len(items))
+        for key, item in items:
+            out.append(key)
+            _serialize(item, out)
+    elif isinstance(value, (set, frozenset)):
+        items = sorted(serializeArgs(item) for item in value)
+        out.append('E%d:' % len(items))
+        out.extend(items)
+    elif isinstance(value, (datetime, date)):
+        out.append('W')
+        _serialize(value.isoformat(), out)
+    elif isinstance(value, Decimal):
+        out.append('Q')
+        _serialize(str(value), out)
+    elif isinstance(value, tuple):
+        _serialize(tuple(value), out)
+    elif isinstance(value, list):
+        _serialize(list(value), out)
+    elif isinstance(value, _SIMPLE_BASES):
+        for base in _SIMPLE_BASES:
+            if isinstance(value, base):
+                _serialize(base(value), out)
+                break
+    else:
+        name = '%s.%s' % (kind.__module__, kind.__name__)
+        out.append('O%d:%s' % (len(name), name))
+        _serialize(str(value), out)
+
+#==============================================================================
+def serializeArgs(value):
+    '''
+    Deterministic string for any combination of basic python types
+    '''
+    out = []
+    _serialize(value, out)
+    return ''.join(out)
+
+#==============================================================================
+def hashArgs(*parts):
+    '''
+    Fixed length hex digest of arguments
+    '''
+    return hashlib.sha1(serializeArgs(parts)).hexdigest()
+
+#==============================================================================
+def makeKey(namespace, *parts):
+    '''
+    Namespaced fixed length cache key: <namespace>:<sha1 of parts>
+    '''
+    if isinstance(namespace, unicode):
+        namespace = namespace.encode('utf-8')
+    namespace = ''.join(c for c in namespace if ' ' < c < '\x7f')
+    return namespace[:_NAMESPACE_MAX] + KEY_SEPARATOR + hashArgs(*parts)
+
+#==============================================================================
+def getFunctionKey(namespace, function, args):
+    '''
+    Key for function result - args is a hash of call arguments
+    '''
+    if isinstance(args, dict) and 'self' in args:
+        args = dict(args)
+        del args['self']
+    return makeKey(namespace, function.__name__, args)
+
+#==============================================================================
+def getQueryKey(namespace, sql, args):
+    '''
+    Key for SQL query result
+    '''
+    return makeKey(namespace, sql, args)
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+'''
+Cache tags of SQL queries
+
+Every table is a tag. Cached reads depend on the tags of tables they
+read, writes bump generation of tags of tables they change.
+'''
+import re
+import time
+
+from cachekey import makeKey, KEY_MAX_LENGTH
+
+_READ_TABLES  = re.compile(r'\b(?:FROM|JOIN)\s+`?([\w.]+)`?', re.I)
+_WRITE_TABLES = re.compile(
+    r'^\s*(?:INSERT(?:\s+IGNORE)?\s+INTO|REPLACE\s+INTO|UPDATE(?:\s+IGNORE)?'
+    r'|DELETE\s+FROM|TRUNCATE(?:\s+TABLE)?)\s+`?([\w.]+)`?', re.I)
+_WRITE_QUERY  = re.compile(
+    r'^\s*(?:INSERT|REPLACE|UPDATE|DELETE|TRUNCATE|ALTER|DROP)\b', re.I)
+
+#==============================================================================
+def isWriteQuery(sql):
+    return _WRITE_QUERY.match(sql) is not None
+
+#==============================================================================
+def getReadTags(sql):
+    '''
+    Tables the query reads from
+    '''
+    return sorted(set(name.lower() for name in _READ_TABLES.findall(sql)))
+
+#==============================================================================
+def getWriteTags(sql):
+    '''
+    Tables the query changes
+    '''
+    return sorted(set(name.lower() for name in _WRITE_TABLES.findall(sql)))
+
+#==============================================================================
+def getTagKey(tag, namespace='tag'):
+    '''
+    Memcache key of tag generation - shared by all servers and workers
+    using the same memcache
+    '''
+    key = '%s:%s' % (namespace, tag)
+    if len(key) > KEY_MAX_LENGTH:
+        key = makeKey(namespace, tag)
+    return key
+
+#==============================================================================
+def bumpTag(mc, key):
+    '''
+    Next generation of tag - time based if tag is missed, so evicted tag
+    never returns to old generation
+    '''
+    version = mc.incr(key)
+    if version is None:
+        version = int(time.time() * 1000)
+        if not mc.add(key, version, 0):
+            version = mc.incr(key) or version
+    return version
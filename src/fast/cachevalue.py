@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+'''
+Cached value format
+
+Values are stored wrapped as (version, empty flag, value, refresh time),
+so cached None / [] / {} differ from absent key and values of an unknown
+format are treated as a miss. Version 1 values (without refresh time)
+are still read.
+'''
+
+CACHED_VALUE_VERSION = 2
+
+#==============================================================================
+class _Miss:
+    '''
+    Absent value sentinel - never stored
+    '''
+    def __nonzero__(self):
+        return False
+
+    def __repr__(self):
+        return 'MISS'
+
+MISS = _Miss()
+
+#==============================================================================
+def isEmpty(value):
+    '''
+    Negative (None) or empty result - cached with negative expire
+    '''
+    if value is None:
+        return True
+    if isinstance(value, (list, tuple, dict, set, frozenset, basestring)):
+        return len(value) == 0
+    return False
+
+#==============================================================================
+def wrapValue(value, refreshAt=0):
+    '''
+    refreshAt - time after which value should be recomputed ahead of
+    expiration, 0 - never
+    '''
+    return (CACHED_VALUE_VERSION, isEmpty(value), value, refreshAt)
+
+#==============================================================================
+def unwrapValue(raw):
+    '''
+    Value stored by wrapValue or MISS for absent/unknown format
+    '''
+    if isinstance(raw, tuple):
+        if len(raw) == 4 and raw[0] == CACHED_VALUE_VERSION:
+            return raw[2]
+        if len(raw) == 3 and raw[0] == 1:
+            return raw[2]
+    return MISS
+
+#==============================================================================
+def getRefreshAt(raw):
+    '''
+    Refresh time of value stored by wrapValue, 0 - none
+    '''
+    if isinstance(raw, tuple) and len(raw) == 4:
+        return raw[3]
+    return 0
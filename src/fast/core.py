@@ -8,30 +8,53 @@ Created on 25.01.2011
 import platform
 
 import time
+import atexit
+import threading
+from contextlib import contextmanager
+from functools import partial
 import os, sys
+import signal
 #import logging
 #import logging.handlers
 
-import ConfigParser, os, sys, MySQLdb, MySQLdb.cursors
+# MySQLdb, syslog and memcache clients are imported on first use - import
+# of core must not connect, open files or start threads
+import ConfigParser, os, sys
 import hashlib
+import binascii
+import ast
 from func import method_exists
+from cachekey import getFunctionKey, getQueryKey, makeKey, KEY_MAX_LENGTH
+from lrucache import LRUCache
+from dbpool import ConnectionPool, PoolTimeout
+from replicas import Replica, ReplicaSet
+from singleflight import SingleFlight
+from cachevalue import MISS, isEmpty, wrapValue, unwrapValue, getRefreshAt
+import cachecodec
+from cachetags import isWriteQuery, getReadTags, getWriteTags, getTagKey
+from health import CircuitBreaker, CircuitOpen, LivenessChecker, OPEN
+from limiter import RequestLimiter
+from querystats import QueryStats, formatArgs
 
-from twisted.python.logfile import DailyLogFile
-from twisted.python import log
+from twisted.python import log, failure
+from twisted.internet import defer, task, threads
 
 import logging
-import logging.handlers
+
+from logwriter import QueuedLogWriter
 
 CURRENT_PATH = os.path.realpath(os.path.dirname(__file__))
 
 LOG_DIR = os.path.join(CURRENT_PATH, '../../../logs')
 #@todo нормальное имя лога
 LOG_FILE = os.path.join(LOG_DIR, 'monitord.log')
+LOG_MAX_BYTES    = 100 * 1024 * 1024
+LOG_BACKUP_COUNT = 10
 
 FILTERNAME='twistedfilter'
-from syslog import syslog, openlog, LOG_MAIL
 
 def trace_dump():
+    from syslog import syslog, openlog, LOG_MAIL
     t,v,tb = sys.exc_info()
     openlog(FILTERNAME, 0, LOG_MAIL)
     syslog('Unhandled exception: %s - %s' % (v, t))
@@ -83,12 +106,11 @@ def toupleToString(args):
     
 
 #==============================================================================
-def getCacheKey(function, args):
+def getCacheKey(function, args, namespace='fast'):
     '''
     Translate arguments array to unique key
     '''
-    string = function.__name__ + '---'+hashToString(args)
-    return string  
+    return getFunctionKey(namespace, function, args)
 
 #==============================================================================        
 def getMD5Hash(textToHash=None):
@@ -99,6 +121,51 @@ def getMD5Hash(textToHash=None):
 
 
 
+#==============================================================================
+class LogSampler:
+    '''
+    Per call site sampling and rate limiting of log messages:
+        every=N - write 1 of N messages
+        rate=R  - write at most R messages per second
+    '''
+    #--------------------------------------------------------------------------
+    def __init__(self):
+        self._sites = {}
+
+    #--------------------------------------------------------------------------
+    def allow(self, frame, every=None, rate=None):
+        '''
+        Return None if message should be skipped, otherwise number of
+        messages skipped since the last written one
+        '''
+        site  = (frame.f_code, frame.f_lineno)
+        state = self._sites.get(site)
+        if state is None:
+            # [calls, suppressed, tokens, last check]
+            state = self._sites[site] = [0, 0, float(rate or 0), time.time()]
+
+        state[0] += 1
+        allowed = True
+        if every and (state[0] - 1) % every:
+            allowed = False
+
+        if rate and allowed:
+            now = time.time()
+            state[2] = min(float(rate), state[2] + (now - state[3]) * rate)
+            state[3] = now
+            if state[2] < 1:
+                allowed = False
+            else:
+                state[2] -= 1
+
+        if not allowed:
+            state[1] += 1
+            return None
+
+        suppressed, state[1] = state[1], 0
+        return suppressed
+
+
 #==============================================================================
 class Log():
     """Logging class"""
@@ -107,35 +174,38 @@ class Log():
     _log = None
     
     logging_twisted = True
+    _sampler = LogSampler()
 
     #--------------------------------------------------------------------------
-    def __init__(self, pname='fastbilling', logname=LOG_FILE, loglevel=logging.DEBUG):
+    def __init__(self, pname='fastbilling', logname=LOG_FILE, loglevel=logging.DEBUG,
+                 maxBytes=LOG_MAX_BYTES, when=None, backupCount=LOG_BACKUP_COUNT):
         # создатим папку, если не существует
         if not os.path.exists(LOG_DIR):
             os.mkdir(LOG_DIR)
         
-        self.__fname = open(logname, 'a')
         self.__pname = pname
         FORMAT = ('%(asctime)-15s %(levelname)s %(message)s')
+
+        # basicConfig() ignores handler argument - attach writer ourselves
+        self._writer = QueuedLogWriter(logname, maxBytes=maxBytes, when=when,
+                                       backupCount=backupCount)
+        self._writer.setFormatter(logging.Formatter(FORMAT))
+        root = logging.getLogger()
+        root.addHandler(self._writer)
+        atexit.register(self._writer.close)
         
         if self.logging_twisted:
-            #from twisted.application.service import Application
-            #application = Application("foo")
-            #(maxRotatedFiles=1)
-            logging.basicConfig(format=FORMAT, filename=logname, handler=logging.handlers.RotatingFileHandler)
             observer = log.PythonLoggingObserver(loggerName='twisted')
             observer.start()
             observer.logger.setLevel(loglevel)
-
-            #log.startLogging(DailyLogFile.fromFullPath(logname))
         else:
-            self.__fname = open(logname, 'a')
-            logging.basicConfig(format=FORMAT, filename=logname, handler=logging.handlers.RotatingFileHandler)
             self._log = logging.getLogger(self.__pname)
             self._log.setLevel(loglevel)
-        
-        
-        
+
+    #--------------------------------------------------------------------------
+    def getStats(self):
+        """Queue, dropped and written records counters"""
+        return self._writer.getStats()
 
     #--------------------------------------------------------------------------
     def ustr(self, string):
@@ -149,59 +219,141 @@ class Log():
         return value
 
     #--------------------------------------------------------------------------
-    def __write(self, msg, logLevel):
-        """Writing data to file"""
-        log.msg(msg, logLevel=logLevel)
+    def isEnabledFor(self, logLevel):
+        """Check message of the level will be written"""
+        if self.logging_twisted:
+            return logging.getLogger('twisted').isEnabledFor(logLevel)
+        return self._log.isEnabledFor(logLevel)
 
     #--------------------------------------------------------------------------
-    def Error(self, msg):
-        """Error log level"""
+    def __write(self, msg, logLevel, args, kwargs):
+        """Writing data to file - message is formatted only if it is written"""
+        if not self.isEnabledFor(logLevel):
+            return
+
+        if 'every' in kwargs or 'rate' in kwargs:
+            site = kwargs.get('site') or sys._getframe(2)
+            suppressed = self._sampler.allow(site, kwargs.get('every'), 
+                                             kwargs.get('rate'))
+            if suppressed is None:
+                return
+        else:
+            suppressed = 0
+
+        if args:
+            try:
+                msg = msg % args
+            except (TypeError, ValueError):
+                msg = '%s %s' % (msg, args)
+        if suppressed:
+            msg = '%s (+%s suppressed)' % (msg, suppressed)
+
         if self.logging_twisted:
-            self.__write(msg, logging.ERROR)
+            log.msg(msg, logLevel=logLevel)
         else:
-            logging.error(msg)
+            self._log.log(logLevel, msg)
+
+    #--------------------------------------------------------------------------
+    def Error(self, msg, *args, **kwargs):
+        """Error log level"""
+        self.__write(msg, logging.ERROR, args, kwargs)
 
     #--------------------------------------------------------------------------
-    def Warn(self, msg):
+    def Warn(self, msg, *args, **kwargs):
         """Warning log level"""
-        self.__write(msg, logging.WARNING)
+        self.__write(msg, logging.WARNING, args, kwargs)
 
     #--------------------------------------------------------------------------
-    def Info(self, msg):
+    def Info(self, msg, *args, **kwargs):
         """Info log level"""
-        if self.logging_twisted:
-            self.__write(msg, logging.INFO)
-        else:
-            self._log.info(msg)
+        self.__write(msg, logging.INFO, args, kwargs)
 
     #--------------------------------------------------------------------------
-    def ExtInfo(self, msg):
+    def ExtInfo(self, msg, *args, **kwargs):
         """ExtInfo log level"""
-        if self.logging_twisted:
-            self.__write(msg, logging.INFO)
-        else:
-            self._log.info(msg)
+        self.__write(msg, logging.INFO, args, kwargs)
 
     #--------------------------------------------------------------------------
-    def Note(self, msg):
+    def Note(self, msg, *args, **kwargs):
         """ExtInfo log level"""
-        if self.logging_twisted:
-            self.__write(msg, logging.INFO)
-        else:
-            self._log.info("\033[1;34m" + msg)
+        if not self.logging_twisted:
+            msg = "\033[1;34m" + msg
+        self.__write(msg, logging.INFO, args, kwargs)
             
     #--------------------------------------------------------------------------
-    def Debug(self, msg):
+    def Debug(self, msg, *args, **kwargs):
         """Debug log level"""
-        if self.logging_twisted:
-            self.__write(msg, logging.DEBUG)
-        else:
-            self._log.debug(msg)
+        self.__write(msg, logging.DEBUG, args, kwargs)
+
+#==============================================================================
+class LazyLog:
+    '''
+    Module logger - Log is created on first message, so import of core
+    does not create log directory, open log file or start observer.
+    Methods of created Log are bound to the proxy, next calls are direct
+    '''
+    _log  = None
+    _lock = threading.Lock()
+
+    #--------------------------------------------------------------------------
+    def getLog(self):
+        if self._log is None:
+            self._lock.acquire()
+            try:
+                if self._log is None:
+                    self._log = Log()
+            finally:
+                self._lock.release()
+        return self._log
+
+    #--------------------------------------------------------------------------
+    def __getattr__(self, name):
+        value = getattr(self.getLog(), name)
+        if callable(value):
+            setattr(self, name, value)
+        return value
 
 # @todo сделать конфиг для уровня логгирования
-logger = Log()
+logger = LazyLog()
+
+
+
+
+#==============================================================================
+def _sectionItems(config, section):
+    if not config.has_section(section):
+        return None
+    return dict(config.items(section, raw=True))
 
+#==============================================================================
+def _inReactorThread():
+    '''
+    Called from running reactor - blocking here stops the whole server
+    '''
+    from twisted.internet import reactor
+    from twisted.python import threadable
+    return reactor.running and threadable.isInIOThread()
+
+#==============================================================================
+def _leaseToken():
+    '''
+    Unique value of memcache lease - only its holder releases it
+    '''
+    return '%s:%s' % (os.getpid(), binascii.hexlify(os.urandom(8)))
 
+#==============================================================================
+def getChangedSections(old, new):
+    '''
+    Names of sections added, removed or changed in new config, all
+    sections of new config if there is no old one
+    '''
+    if old is None:
+        return set(new.sections())
+    changed = set()
+    for section in set(old.sections()) | set(new.sections()):
+        if _sectionItems(old, section) != _sectionItems(new, section):
+            changed.add(section)
+    return changed
 
 
 #==============================================================================
@@ -221,12 +373,23 @@ class FastObject:
         '''
         Logging messages of object level
         '''
-        if self.logging:
+        if self.logging and self.logger.isEnabledFor(logging.DEBUG):
             msg = ' %s : %s' %  (self.__class__.__name__, string)
             if args:
                 msg = '%s [%s]' % (msg, args)
             self.logger.Debug(msg)
     
+    #--------------------------------------------------------------------------
+    def _logf(self, fmt, *args, **kwargs):
+        '''
+        Lazy logging of object level - fmt % args is done only if message
+        is written. Accepts every=N and rate=R for sampling of call site
+        '''
+        if self.logging:
+            kwargs['site'] = sys._getframe(1 + kwargs.pop('depth', 0))
+            self.logger.Debug(' %s : ' + fmt, self.__class__.__name__, 
+                              *args, **kwargs)
+    
     #--------------------------------------------------------------------------
     def _error(self, string, args=None):
         '''
@@ -238,6 +401,24 @@ class FastObject:
             msg = '%s [%s]' % (msg, args)
         self.logger.Error(msg)
 
+    #--------------------------------------------------------------------------
+    def _errorf(self, fmt, *args, **kwargs):
+        '''
+        Lazy logging of errors - see _logf
+        '''
+        kwargs['site'] = sys._getframe(1 + kwargs.pop('depth', 0))
+        self.logger.Error(' %s : ' + fmt, self.__class__.__name__, 
+                          *args, **kwargs)
+
+    #--------------------------------------------------------------------------
+    def _warnf(self, fmt, *args, **kwargs):
+        '''
+        Lazy logging of warnings - log always, see _logf
+        '''
+        kwargs['site'] = sys._getframe(1 + kwargs.pop('depth', 0))
+        self.logger.Warn(' %s : ' + fmt, self.__class__.__name__, 
+                         *args, **kwargs)
+
     #--------------------------------------------------------------------------
     def getHTML(self):
         '''
@@ -255,6 +436,8 @@ class FastDbObject(FastObject):
     _db       = False
     _cursor   = False
     _encoding = 'utf8'
+    slow_query  = 1.0   # seconds, statements longer are logged
+    _queryStats = None
     
     #--------------------------------------------------------------------------
     def __init__(self, db=None):
@@ -265,13 +448,55 @@ class FastDbObject(FastObject):
             
 
     #--------------------------------------------------------------------------
-    def _query(self, sql, args = None):
+    def _query(self, sql, args = None, tags = None):
         '''
-        One query with commit
+        One query with commit. Write query invalidates cache tags - 
+        changed tables or tags given
         '''
+        started = time.time()
         result = self._cursor.execute(sql, args)
+        self._recordQuery(sql, args, started, result)
         self._db.commit()
+        self._invalidateQueryTags(sql, tags)
         return result
+
+    #--------------------------------------------------------------------------
+    def getQueryStats(self):
+        '''
+        Timing of statements aggregated by fingerprint
+        '''
+        if self._queryStats is None:
+            self._queryStats = QueryStats(self.slow_query)
+        return self._queryStats
+
+    #--------------------------------------------------------------------------
+    def _recordQuery(self, sql, args, started, rows):
+        '''
+        Add statement timing to stats, log it with args if it is slow
+        '''
+        spent = time.time() - started
+        if self.getQueryStats().record(sql, spent, rows):
+            self._warnf('Slow query [%.3f sec, %s rows]: %s args %s', 
+                        spent, rows, sql, formatArgs(args), rate=10)
+
+    #--------------------------------------------------------------------------
+    def getLastInsertId(self):
+        '''
+        ID of row inserted by last _query
+        '''
+        return self._cursor.lastrowid
+
+    #--------------------------------------------------------------------------
+    def _invalidateQueryTags(self, sql, tags=None):
+        '''
+        Bump cache tags after write if object has a cache
+        '''
+        if not method_exists(self, 'invalidateTags'):
+            return
+        if tags is None and isWriteQuery(sql):
+            tags = getWriteTags(sql)
+        if tags:
+            self.invalidateTags(tags)
     
     #--------------------------------------------------------------------------
     def _connectToDb(self):
@@ -309,6 +534,16 @@ class FastConfigObject(FastObject):
     config_file = 'config'
     log_file    = 'log.log'
     config      = None
+    # config section and method re-initialising its subsystem, in order
+    reload_sections = (
+        ('db'            , '_connectToDb'),
+        ('daemon'        , 'initPort'),
+        ('main'          , 'initGearman'),
+        ('memcache'      , 'initMemcache'),
+        ('http'          , 'initHttp'),
+        ('response_cache', 'initResponseCache'),
+        ('health'        , 'initHealth'),
+    )
     
     #--------------------------------------------------------------------------
     def __init__(self, dir=None):
@@ -356,21 +591,21 @@ class FastConfigObject(FastObject):
     #--------------------------------------------------------------------------
     def loadConfig(self):
         '''
-        Load config - using for 'reload' option from daemon
+        Load config - using for 'reload' option from daemon. On reload only
+        subsystems of changed sections are re-initialised (reload_sections)
         '''
         try:
             new_config = self._validatedConfig()
-            self._log('Apply config...')
+            old_config = self.config
+            changed    = getChangedSections(old_config, new_config)
+            self._log('Apply config - changed sections %s' % sorted(changed))
             self.config = new_config
             
-            if method_exists(self, '_connectToDb'):
-                self._connectToDb()
-            
-            self.port = self.config.getint('daemon'  , 'port') 
-            self.gearman_server = self.config.get('main'  , 'gearman_server') 
-
-            if method_exists(self, 'initMemcache'):
-                self.initMemcache()
+            for section, method in self.reload_sections:
+                if old_config is not None and section not in changed:
+                    continue
+                if method_exists(self, method):
+                    getattr(self, method)()
              
         except Exception, ex:
             self._error('Unable to load config: ', (ex,))
@@ -381,6 +616,53 @@ class FastConfigObject(FastObject):
             raise
     
     
+    #--------------------------------------------------------------------------
+    def initPort(self):
+        self.port = self.config.getint('daemon', 'port') 
+
+    #--------------------------------------------------------------------------
+    def initGearman(self):
+        self.gearman_server = self.config.get('main', 'gearman_server') 
+
+    #--------------------------------------------------------------------------
+    def reloadConfig(self):
+        '''
+        loadConfig for running server - errors are logged, old config of
+        failed subsystem is kept
+        '''
+        try:
+            self.loadConfig()
+        except Exception, ex:
+            self._error('Reload failed [%s]' % ex)
+
+    #--------------------------------------------------------------------------
+    def installReloadHandler(self):
+        '''
+        Reload config on SIGHUP (daemon 'reload' action). Under running
+        reactor reload is done in reactor thread between requests
+        '''
+        signal.signal(signal.SIGHUP, self._reloadSignal)
+
+    #--------------------------------------------------------------------------
+    def _reloadSignal(self, signum, frame):
+        if 'twisted.internet.reactor' in sys.modules:
+            from twisted.internet import reactor
+            if reactor.running:
+                reactor.callFromThread(self.reloadConfig)
+                return
+        self.reloadConfig()
+
+    #--------------------------------------------------------------------------
+    def getConfigOption(self, section, option, default=None, type=str):
+        '''
+        Get optional config value - default if option is missed
+        '''
+        if self.config is None or not self.config.has_option(section, option):
+            return default
+        if type is bool:
+            return self.config.getboolean(section, option)
+        return type(self.config.get(section, option))
+    
     #--------------------------------------------------------------------------
     def _validatedConfig(self):
         '''
@@ -403,6 +685,18 @@ class FastServer(FastConfigObject):
     name         = None
     version      = None
     _user_agent  = None
+    _breakers    = None
+    _healthChecks = None
+    _memcache     = None
+    _blockingMemcache = None
+    _listener     = None
+    _responseCache = None
+    _limiters      = None
+    _requestPool   = None
+    _processPool   = None
+    _processPoolRequired = False
+    # incremented when [http] is reloaded - resources re-read their options
+    httpGeneration = 0
     
     
     def __del__(self):
@@ -418,140 +712,1679 @@ class FastServer(FastConfigObject):
                     platform.system(), platform.release())
             self._user_agent = '%s %s (%s %s)' % data 
         return self._user_agent
-    
 
-#==============================================================================
-class FastDbServer(FastServer, FastDbObject):
     #--------------------------------------------------------------------------
-    def _connectToDb(self):
+    def getBreaker(self, name):
         '''
-        Try to connect to database using config
+        Circuit breaker of external service - [health] options
         '''
-        try:
-            self._db = MySQLdb.Connect(
-                                   db     = self.config.get('db','name'),
-                                   host   = self.config.get('db','host'),
-                                   user   = self.config.get('db','user'),
-                                   passwd = self.config.get('db','password'),
-                                   cursorclass = MySQLdb.cursors.DictCursor )
-            self._db.set_character_set(self._encoding)
-            self._cursor = self._db.cursor()
-            self._cursor.execute('SET NAMES '+self._encoding+';')
-            self._cursor.execute('SET CHARACTER SET '+self._encoding+';')
-            sql = 'SET character_set_connection='+self._encoding+';'
-            self._cursor.execute(sql)
-            
-            self._log('Connected to DB :', self._db)
-            if self._db == False:
-                raise
-        except Exception, ex:
-            self._error('Unable connect to database', (ex, ex.args))    
+        if self._breakers is None:
+            self._breakers = {}
+        breaker = self._breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(name,
+                failureThreshold = self.getConfigOption('health', 'failures', 3, int),
+                retryTimeout     = self.getConfigOption('health', 'retry', 1.0, float),
+                maxRetryTimeout  = self.getConfigOption('health', 'max_retry', 60.0, float))
+            self._breakers[name] = breaker
+        return breaker
 
-    
     #--------------------------------------------------------------------------
-    def checkDbConnection(self, db=None):
+    def addHealthCheck(self, name, ping):
         '''
-        Check connection and try to reconnect if it is broken
+        Ping service in background every [health] interval seconds once
+        reactor is running. Call from reactor thread only
+        '''
+        if self.getConfigOption('health', 'enabled', 1, int) != 1:
+            return
+        if self._healthChecks is None:
+            self._healthChecks = {}
+        check = self._healthChecks.get(name)
+        if check is not None:
+            check.ping = ping
+            return
+
+        from twisted.internet import reactor
+        check = LivenessChecker(name, ping,
+                    interval = self.getConfigOption('health', 'interval', 5, int),
+                    breaker  = self.getBreaker(name))
+        self._healthChecks[name] = check
+        reactor.callWhenRunning(check.start)
+
+    #--------------------------------------------------------------------------
+    def isHealthy(self, name):
+        '''
+        Last known state of service - no probing
+        '''
+        check = (self._healthChecks or {}).get(name)
+        if check is not None and check.isRunning():
+            return check.healthy
+        return self.getBreaker(name).state != OPEN
+
+    #--------------------------------------------------------------------------
+    def checkHealth(self, name):
+        '''
+        Fail fast if service is known to be down
+        '''
+        if not self.isHealthy(name):
+            raise CircuitOpen('Service [%s] is down' % name)
+
+    #--------------------------------------------------------------------------
+    @contextmanager
+    def guarded(self, name, errors=(Exception,)):
         '''
+        with server.guarded('gearman'): ... - call through circuit breaker,
+        errors are failures of the service, other exceptions mean it works
+        '''
+        breaker = self.getBreaker(name)
+        if not breaker.allow():
+            raise CircuitOpen('Service [%s] is down' % name)
         try:
-            if not db:
-                db = self._db
-            cursor = db.cursor()
-            cursor.execute('SET NAMES '+self._encoding+';')
-        except Exception, e:
-            self._log('Re-connect to database', (e, e.args))
-            self._connectToDb()
-            
+            yield
+        except errors:
+            breaker.failure()
+            raise
+        except:
+            breaker.success()
+            raise
+        breaker.success()
+
     #--------------------------------------------------------------------------
-    def queryFetchAll(self, sql, args):
+    def checkGearman(self):
         '''
-        Get fetched result of SQL query 
-        '''  
-        self._cursor.execute(sql, args)
-        return self._cursor.fetchall()      
+        Start Gearman health check on first use, fail fast if it is down
+        '''
+        if 'gearman' not in (self._healthChecks or {}):
+            self.addHealthCheck('gearman', self._pingGearman)
+        self.checkHealth('gearman')
 
+    #--------------------------------------------------------------------------
+    def _pingGearman(self):
+        import gearman
+        client = gearman.GearmanAdminClient([self.gearman_server], 
+                    poll_timeout=self.getConfigOption('health', 'timeout', 2, int))
+        client.ping_server()
 
+    #--------------------------------------------------------------------------
+    def getMemcache(self):
+        '''
+        Shared non-blocking memcache client of the process for [memcache]
+        servers - recreated when config changes the servers
+        '''
+        address = self.config.get('memcache', 'server')
+        if self._memcache is not None and self._memcache.address != address:
+            self._memcache.stop()
+            self._memcache = None
+        if self._memcache is None:
+            from asyncmemcache import AsyncMemcacheCluster
+            self._memcache = AsyncMemcacheCluster(address, 
+                    retry    = self.getConfigOption('memcache', 'retry', 30, int),
+                    size     = self.getConfigOption('memcache', 'pool_size', 2, int),
+                    timeout  = self.getConfigOption('memcache', 'timeout', 5, int),
+                    maxDelay = self.getConfigOption('memcache', 'reconnect_max', 30, int))
+            self._memcache.start()
+            self._log('Memcache client [%s]' % address)
+        return self._memcache
 
-#===============================================================================
-class FastMemcachedServer(FastServer):
-    isMemcache   = True
-    mc           = None
-    cache_expire = 3600 # 1 hour
-    
     #--------------------------------------------------------------------------
-    def initMemcache(self):
-        memcacheEnabled       = self.config.getint('memcache', 'enabled')
-        
-        if memcacheEnabled == 1:
-            self.isMemcache = True
-            import memcache
-            memserver = self.config.get('memcache', 'server')
-            self.cache_expire = self.config.getint('memcache', 'expire') * 60
-            #if self.cache_expire == 0:
-            #    self.cache_expire = 60*60 # default value 1 hour 
+    def getBlockingMemcache(self):
+        '''
+        Shared blocking memcache client of the process for [memcache]
+        servers - for code which can not use Deferred
+        '''
+        address = self.config.get('memcache', 'server')
+        client  = self._blockingMemcache
+        if client is None or client[0] != address:
+            from memcachecluster import MemcacheCluster
+            client = self._blockingMemcache = (address, MemcacheCluster(address, 
+                        debug=1, retry=self.getConfigOption('memcache', 'retry', 30, int)))
+        return client[1]
 
-            self._log('Try connect to memcache [%s]' % memserver)
-            self.mc = memcache.Client( [ memserver ], debug=1)
-            self._log('Enabling Memcache [%s]' % self.mc)
-        else:
-            self.isMemcache = False
-            
-            
     #--------------------------------------------------------------------------
-    def getCacheKey(self, function, args):
+    def getResponseCache(self):
         '''
-        Get cache key for server function calling
+        Store of encoded responses of resources with response_cache -
+        bounded by [response_cache] size entries and memory KB
+        '''
+        if self._responseCache is None:
+            self._responseCache = LRUCache(
+                maxEntries = self.getConfigOption('response_cache', 'size', 1000, int),
+                maxBytes   = self.getConfigOption('response_cache', 'memory', 65536, int) * 1024,
+                expire     = self.getConfigOption('response_cache', 'max_expire', 3600, int),
+                sizeof     = lambda entry: len(entry[0]))
+        return self._responseCache
+
+    #--------------------------------------------------------------------------
+    def getLimiter(self, name, limit, queueSize):
         '''
-        return self.config_file+'---'+getCacheKey(function, args)
+        Concurrency limiter of resource - created on first use, resized
+        when reload changes its limits
+        '''
+        if self._limiters is None:
+            self._limiters = {}
+        limiter = self._limiters.get(name)
+        if limiter is None:
+            limiter = self._limiters[name] = RequestLimiter(name, limit, queueSize)
+        elif (limiter.limit, limiter.queueSize) != (limit, queueSize):
+            limiter.resize(limit, queueSize)
+        return limiter
+
+    #--------------------------------------------------------------------------
+    def getRequestThreadPool(self):
+        '''
+        Threads for blocking request handlers - [http] threads_min and
+        threads_max, started on first use
+        '''
+        if self._requestPool is None:
+            from twisted.internet import reactor
+            from twisted.python.threadpool import ThreadPool
 
+            self._requestPool = ThreadPool(
+                    self.getConfigOption('http', 'threads_min', 1, int),
+                    self.getConfigOption('http', 'threads_max', 10, int), 'requests')
+            self._requestPool.start()
+            reactor.addSystemEventTrigger('during', 'shutdown', 
+                                          self._requestPool.stop)
+        return self._requestPool
 
     #--------------------------------------------------------------------------
-    def cachedResult(self, function, args):
+    def getRequestStats(self):
         '''
-        Get function result directly or from cache
+        Request threads and limiters of resources: queue depth, rejects
         '''
-        if self.isMemcache:
-            key  = self.getCacheKey(function, args)
+        stats = {}
+        if self._requestPool is not None:
+            stats['threads'] = {
+                'working' : len(self._requestPool.working),
+                'waiting' : len(self._requestPool.waiters),
+                'queued'  : self._requestPool.q.qsize(),
+            }
+        if self._limiters:
+            stats['resources'] = dict((name, limiter.getStats()) 
+                                      for name, limiter in self._limiters.items())
+        if self._processPool is not None:
+            stats['processes'] = self._processPool.getStats()
+        return stats
 
-            self._log('Try memcache for key [%s]' % key)
-            
-            data = self.mc.get(key)
+    #--------------------------------------------------------------------------
+    def requireProcessPool(self):
+        '''
+        Resource with process handler is bound - listen starts the pool.
+        ProcessError after listen without pool - it is not forked later
+        '''
+        if self._listener is not None and self._processPool is None:
+            from processpool import ProcessError
+            raise ProcessError('Process pool is not started - bind resources '
+                               'with process_handler before listen')
+        self._processPoolRequired = True
 
-            if not data:
-                self._log('Missed cache for [%s] - direct run' % key)
-                data = function(args)
-                self.mc.set(key, data, self.cache_expire)
-            else:
-                self._log('Memcache hit')
-        else:
-            data = function(args)
-            
-        return data
-    
     #--------------------------------------------------------------------------
-    def queryFetchAllCached(self, sql, args):
+    def startProcessPool(self):
         '''
-        Get cache SQL query
+        Fork processes for CPU-bound request handlers - [http] processes
+        (0 - one per CPU), process_shared_min bytes of payload passed in
+        tmpfs, process_timeout seconds to wait for job
         '''
-        if self.isMemcache:
-            m = hashlib.md5()
-            m.update(sql % args)
-            
-            key  = m.hexdigest()+'---'+toupleToString(args)
+        if self._processPool is None:
+            from twisted.internet import reactor
+            from processpool import ProcessPool, SHARED_MIN, TIMEOUT
 
-            self._log('Try memcache for sql [%s]' % key)
-            data = self.mc.get(key)
+            self._processPool = ProcessPool(
+                    self.getConfigOption('http', 'processes', 0, int),
+                    self.getConfigOption('http', 'process_shared_min', SHARED_MIN, int),
+                    self.getConfigOption('http', 'process_timeout', TIMEOUT, int))
+            reactor.addSystemEventTrigger('during', 'shutdown', 
+                                          self._processPool.stop)
+        return self._processPool
 
-            if not data:
-                self._log('Missed cache for [%s] - direct run' % key)
-                self.queryFetchAll(sql, args)
-                self.mc.set(key, data, self.cache_expire)
-            else:
-                self._log('Memcache hit')
-        else:
-            data = self.queryFetchAll(sql, args)
-            
-        return data
+    #--------------------------------------------------------------------------
+    def getProcessPool(self):
+        '''
+        Pool started by listen - it is never forked later, from running
+        reactor with live threads
+        '''
+        if self._processPool is None:
+            from processpool import ProcessError
+            raise ProcessError('Process pool is not started - bind resources '
+                               'with process_handler before listen')
+        return self._processPool
+
+    #--------------------------------------------------------------------------
+    def listen(self, factory, interface=''):
+        '''
+        Open [daemon] port for factory. Cache is warmed up before port is
+        open, so first requests do not hit cold cache
+        '''
+        from twisted.internet import reactor
+        # pool is forked before warm-up and reactor start threads
+        if self._processPoolRequired or \
+           self.getConfigOption('http', 'processes', None) is not None:
+            self.startProcessPool()
+        if method_exists(self, 'warmUp'):
+            self.warmUp()
+        port = reactor.listenTCP(self.port, factory, interface=interface)
+        self._listener = (factory, interface, port)
+        self.installReloadHandler()
+        return port
+
+    #--------------------------------------------------------------------------
+    def initPort(self):
+        '''
+        Move listening port on reload - connections accepted by old port
+        are served to the end
+        '''
+        old_port = getattr(self, 'port', None)
+        FastConfigObject.initPort(self)
+        if self._listener is None or self.port == old_port:
+            return
 
+        from twisted.internet import reactor
+        from twisted.internet.error import CannotListenError
+        factory, interface, listening = self._listener
+        try:
+            port = reactor.listenTCP(self.port, factory, interface=interface)
+        except CannotListenError, ex:
+            self._error('Unable to move to port [%s] - keep [%s]: %s' % 
+                        (self.port, old_port, ex))
+            self.port = old_port
+            return
+        self._listener = (factory, interface, port)
+        listening.stopListening()
+        self._log('Listening port moved [%s] -> [%s]' % (old_port, self.port))
+
+    #--------------------------------------------------------------------------
+    def initHttp(self):
+        '''
+        Apply [http] on reload - resources re-read compression and limits,
+        request threads are resized, limiters are resized on next request.
+        Count of processes in pool needs restart
+        '''
+        self.httpGeneration += 1
+        if self._requestPool is not None:
+            self._requestPool.adjustPoolsize(
+                    self.getConfigOption('http', 'threads_min', 1, int),
+                    self.getConfigOption('http', 'threads_max', 10, int))
+        if self._processPool is not None:
+            import multiprocessing
+            from processpool import SHARED_MIN, TIMEOUT
+
+            pool = self._processPool
+            pool.sharedMin = self.getConfigOption('http', 'process_shared_min', SHARED_MIN, int)
+            pool.timeout   = self.getConfigOption('http', 'process_timeout', TIMEOUT, int)
+            processes = self.getConfigOption('http', 'processes', 0, int) or \
+                            multiprocessing.cpu_count()
+            if processes != pool.processes:
+                self._error('[http] processes needs restart - keep [%s]' % 
+                            pool.processes)
+
+    #--------------------------------------------------------------------------
+    def initResponseCache(self):
+        '''
+        New [response_cache] limits on reload - cached responses are dropped
+        '''
+        if self._responseCache is not None:
+            self._responseCache = None
+            self._log('Response cache is cleared - [response_cache] changed')
+
+    #--------------------------------------------------------------------------
+    def initHealth(self):
+        '''
+        Apply [health] on reload to breakers and running checks. Checks
+        are not started by reload - enabling them needs restart
+        '''
+        for breaker in (self._breakers or {}).values():
+            breaker.failureThreshold = self.getConfigOption('health', 'failures', 3, int)
+            breaker.retryTimeout     = self.getConfigOption('health', 'retry', 1.0, float)
+            breaker.maxRetryTimeout  = self.getConfigOption('health', 'max_retry', 60.0, float)
+        if not self._healthChecks:
+            return
+        if self.getConfigOption('health', 'enabled', 1, int) != 1:
+            for check in self._healthChecks.values():
+                check.stop()
+            self._healthChecks = None
+            self._log('Health checks are stopped')
+            return
+        interval = self.getConfigOption('health', 'interval', 5, int)
+        for check in self._healthChecks.values():
+            if check.interval != interval and check.isRunning():
+                check.stop()
+                check.interval = interval
+                check.start()
+            check.interval = interval
+
+    #--------------------------------------------------------------------------
+    def getHealthStats(self):
+        '''
+        State of health checks and circuit breakers
+        '''
+        stats = {}
+        for name, breaker in (self._breakers or {}).items():
+            stats[name] = breaker.getStats()
+        for name, check in (self._healthChecks or {}).items():
+            stats[name] = check.getStats()
+        return stats
+    
+
+#==============================================================================
+class FastDbServer(FastServer, FastDbObject):
+    _pool  = None
+    _local = None
+    _threadPool = None
+    _writeStats = None
+    _replicas   = None
+    _poolLock   = threading.Lock()
+
+    #--------------------------------------------------------------------------
+    def _newConnection(self, host=None):
+        '''
+        Open new connection using config - to primary host by default.
+        Host may be given as host:port
+        '''
+        import MySQLdb, MySQLdb.cursors
+        if host is None:
+            host = self.config.get('db','host')
+        port = 3306
+        if ':' in host:
+            host, port = host.rsplit(':', 1)
+            port = int(port)
+        db = MySQLdb.Connect(
+                               db     = self.config.get('db','name'),
+                               host   = host,
+                               port   = port,
+                               user   = self.config.get('db','user'),
+                               passwd = self.config.get('db','password'),
+                               cursorclass = MySQLdb.cursors.DictCursor )
+        db.set_character_set(self._encoding)
+        # pooled connection must not keep read snapshot between requests
+        db.autocommit(True)
+        cursor = db.cursor()
+        cursor.execute('SET NAMES '+self._encoding+';')
+        cursor.execute('SET CHARACTER SET '+self._encoding+';')
+        sql = 'SET character_set_connection='+self._encoding+';'
+        cursor.execute(sql)
+        cursor.close()
+        return db
 
+    #--------------------------------------------------------------------------
+    def _connectToDb(self):
+        '''
+        Try to connect to database using config - (re)create connection pool.
+        On reload in reactor thread new pool connects in reactor thread
+        pool, requests use the old one until it is swapped
+        '''
+        self.addHealthCheck('db', self._pingDb)
+        if _inReactorThread():
+            threads.deferToThread(self._createPool)
+        else:
+            self._createPool()
 
+    #--------------------------------------------------------------------------
+    def _createPool(self):
+        '''
+        (Re)create connection pools of primary and replicas - may be called
+        from any thread, one at a time
+        '''
+        with self._poolLock:
+            self._swapPools()
+
+    #--------------------------------------------------------------------------
+    def _swapPools(self):
+        try:
+            old_pool = self._pool
+            self._pool = ConnectionPool(self._newConnection,
+                    minSize       = self.getConfigOption('db', 'pool_min', 1, int),
+                    maxSize       = self.getConfigOption('db', 'pool_max', 5, int),
+                    timeout       = self.getConfigOption('db', 'pool_timeout', 10, int),
+                    checkInterval = self.getConfigOption('db', 'pool_check', 30, int),
+                    name          = self.config.get('db', 'host'))
+            self.slow_query = self.getConfigOption('db', 'slow_query', 1000, int) / 1000.0
+            self.getQueryStats().slowThreshold = self.slow_query
+            if self._local is None:
+                self._local = threading.local()
+                self._writeStats = {'commits' : 0, 'rows' : 0, 
+                                    'statements' : 0, 'commit_time' : 0.0}
+                self._statsLock = threading.Lock()
+            if old_pool is not None:
+                old_pool.closeAll()
+
+            old_replicas   = self._replicas
+            self._replicas = self._createReplicas()
+            if old_replicas is not None:
+                old_replicas.closeAll()
+            
+            self._log('Connected to DB :', self._pool.name)
+        except Exception, ex:
+            self.getBreaker('db').failure()
+            self._error('Unable connect to database', (ex, ex.args))    
+
+    
+    #--------------------------------------------------------------------------
+    def _createReplicas(self):
+        '''
+        Read replicas from [db] replicas = host1, host2:port
+        '''
+        hosts = self.getConfigOption('db', 'replicas', '')
+        hosts = [host.strip() for host in hosts.split(',') if host.strip()]
+        if not hosts:
+            return None
+
+        replicas = []
+        for host in hosts:
+            # replica may be down at start - do not open connections now
+            pool = ConnectionPool(partial(self._newConnection, host),
+                    minSize       = 0,
+                    maxSize       = self.getConfigOption('db', 'pool_max', 5, int),
+                    timeout       = self.getConfigOption('db', 'pool_timeout', 10, int),
+                    checkInterval = self.getConfigOption('db', 'pool_check', 30, int),
+                    name          = host)
+            replicas.append(Replica(host, pool))
+
+        self._log('Read replicas [%s]' % ', '.join(hosts))
+        return ReplicaSet(replicas,
+                maxLag        = self.getConfigOption('db', 'replica_max_lag', 30, int),
+                checkInterval = self.getConfigOption('db', 'replica_check', 10, int),
+                onError       = self._replicaCheckFailed)
+
+    #--------------------------------------------------------------------------
+    def _replicaCheckFailed(self, replica, ex):
+        self._error('Unable to check lag of replica [%s] - not used: %s' % 
+                    (replica.host, ex))
+
+    #--------------------------------------------------------------------------
+    def _chooseReplica(self):
+        '''
+        Replica for read outside of transaction, None - use primary
+        '''
+        if self._replicas is None or getattr(self._local, 'db', None) is not None \
+           or getattr(self._local, 'primary', 0):
+            return None
+        return self._replicas.choose()
+
+    #--------------------------------------------------------------------------
+    @contextmanager
+    def primaryReads(self):
+        '''
+        Reads of this thread inside go to primary - result stored in cache
+        must not come from replica which lacks the write that invalidated
+        it. runInteraction called inside keeps it for its thread
+        '''
+        if self._local is None:
+            yield
+            return
+        self._local.primary = getattr(self._local, 'primary', 0) + 1
+        try:
+            yield
+        finally:
+            self._local.primary -= 1
+
+    #--------------------------------------------------------------------------
+    def _runOnPrimary(self, function, *args, **kwargs):
+        with self.primaryReads():
+            return function(*args, **kwargs)
+
+    #--------------------------------------------------------------------------
+    def checkDbConnection(self, db=None):
+        '''
+        Check connection and try to reconnect if it is broken - CircuitOpen
+        is raised if database is down. When health check is running, and
+        always in reactor thread, only cached state is used - database is
+        not queried. See checkDbConnectionDeferred for the real check
+        '''
+        if db is None and 'db' in (self._healthChecks or {}):
+            self.checkHealth('db')
+        elif _inReactorThread():
+            if not self.getBreaker('db').allow():
+                raise CircuitOpen('Database is down')
+        else:
+            self._checkDbConnection(db)
+
+    #--------------------------------------------------------------------------
+    def checkDbConnectionDeferred(self, db=None):
+        '''
+        Deferred checkDbConnection for reactor thread - without health check
+        database is pinged in DB thread
+        '''
+        if db is None and 'db' in (self._healthChecks or {}):
+            return defer.maybeDeferred(self.checkHealth, 'db')
+        from twisted.internet import reactor
+        if reactor.running:
+            return self.runInteraction(self._checkDbConnection, db)
+        return defer.maybeDeferred(self._checkDbConnection, db)
+
+    #--------------------------------------------------------------------------
+    def _checkDbConnection(self, db=None):
+        breaker = self.getBreaker('db')
+        if not breaker.allow():
+            raise CircuitOpen('Database is down')
+        try:
+            if db:
+                cursor = db.cursor()
+                cursor.execute('SET NAMES '+self._encoding+';')
+            else:
+                self._pingDb()
+            breaker.success()
+        except Exception, e:
+            breaker.failure()
+            self._log('Re-connect to database', (e, e.args))
+            self._createPool()
+
+    #--------------------------------------------------------------------------
+    def _pingDb(self):
+        '''
+        Liveness probe of primary database - runs in checker thread
+        '''
+        if self._pool is None:
+            # database was down at start
+            self._createPool()
+            if self._pool is None:
+                import MySQLdb
+                raise MySQLdb.OperationalError('No connection to database')
+        with self._pool.connection(timeout=1) as db:
+            db.ping()
+
+    #--------------------------------------------------------------------------
+    def _execute(self, sql, args=None, fetch=False, commit=False, many=False):
+        '''
+        Run statement on connection of current transaction or on connection
+        checked out from the pool
+        '''
+        db = getattr(self._local, 'db', None)
+        if db is not None:
+            result = self._executeOn(db, sql, args, fetch, False, many)
+            if commit:
+                self._local.rows += result or 0
+                self._local.statements += 1
+            return result
+
+        if fetch and not commit:
+            replica = self._chooseReplica()
+            if replica is not None:
+                try:
+                    with replica.pool.connection() as db:
+                        return self._executeOn(db, sql, args, fetch, False, many)
+                except replica.pool.connectionErrors() + (PoolTimeout,), ex:
+                    self._replicas.markFailed(replica)
+                    self._logf('Replica [%s] failed [%s] - read from primary', 
+                               replica.host, ex, rate=1)
+
+        with self.guarded('db', self._pool.connectionErrors()):
+            with self._pool.connection() as db:
+                return self._executeOn(db, sql, args, fetch, commit, many)
+
+    #--------------------------------------------------------------------------
+    def _executeOn(self, db, sql, args, fetch, commit, many):
+        cursor = db.cursor()
+        try:
+            started = time.time()
+            if many:
+                result = cursor.executemany(sql, args)
+            else:
+                result = cursor.execute(sql, args)
+            if fetch:
+                result = cursor.fetchall()
+            self._recordQuery(sql, args, started, 
+                              len(result) if fetch else result)
+            if commit:
+                self._commit(db, result)
+            self._local.lastrowid = cursor.lastrowid
+        finally:
+            cursor.close()
+        return result
+
+    #--------------------------------------------------------------------------
+    def _commit(self, db, rows, statements=1):
+        '''
+        Commit and count rows per commit
+        '''
+        started = time.time()
+        db.commit()
+        spent = time.time() - started
+
+        self._statsLock.acquire()
+        stats = self._writeStats
+        stats['commits']     += 1
+        stats['rows']        += rows or 0
+        stats['statements']  += statements
+        stats['commit_time'] += spent
+        self._statsLock.release()
+
+    #--------------------------------------------------------------------------
+    def _afterWrite(self, sql, tags):
+        '''
+        Invalidate cache tags now or after commit of current transaction
+        '''
+        pending = getattr(self._local, 'tags', None)
+        if pending is None:
+            self._invalidateQueryTags(sql, tags)
+            return
+        if tags is None and isWriteQuery(sql):
+            tags = getWriteTags(sql)
+        if tags:
+            pending.update(tags)
+
+    #--------------------------------------------------------------------------
+    def _query(self, sql, args = None, tags = None):
+        '''
+        One query with commit (inside transaction - commit is done by it)
+        '''
+        result = self._execute(sql, args, commit=True)
+        self._afterWrite(sql, tags)
+        return result
+
+    #--------------------------------------------------------------------------
+    def executeMany(self, sql, rows, tags = None):
+        '''
+        Same statement for many rows with one commit - INSERT ... VALUES
+        is sent as one multi-row INSERT
+        '''
+        if not rows:
+            return 0
+        result = self._execute(sql, rows, commit=True, many=True)
+        self._afterWrite(sql, tags)
+        return result
+
+    #--------------------------------------------------------------------------
+    @contextmanager
+    def transaction(self):
+        '''
+        Unit of work: statements of current thread inside 
+            with server.transaction(): ...
+        use one connection and are committed once (rolled back on error).
+        Cache tags are invalidated after commit. Nested blocks join the
+        outer transaction
+        '''
+        if getattr(self._local, 'db', None) is not None:
+            yield
+            return
+
+        errors = self._pool.connectionErrors()
+        with self.guarded('db', errors):
+            db = self._pool.getConnection()
+            # connection of failed rollback or autocommit reset is closed,
+            # their errors do not mask the error of transaction
+            broken = False
+            self._local.db   = db
+            self._local.tags = set()
+            self._local.rows = 0
+            self._local.statements = 0
+            try:
+                db.autocommit(False)
+                yield
+                self._commit(db, self._local.rows, self._local.statements)
+            except:
+                error = sys.exc_info()
+                broken = isinstance(error[1], errors)
+                try:
+                    db.rollback()
+                except Exception, ex:
+                    broken = True
+                    self._logf('Rollback failed [%s]', ex, rate=1)
+                raise error[0], error[1], error[2]
+            finally:
+                tags = self._local.tags
+                self._local.db   = None
+                self._local.tags = None
+                try:
+                    db.autocommit(True)
+                except Exception, ex:
+                    broken = True
+                    self._logf('Unable to restore autocommit [%s]', ex, rate=1)
+                self._pool.putConnection(db, broken)
+        if tags:
+            self._invalidateQueryTags(None, tags)
+            
+    #--------------------------------------------------------------------------
+    def queryFetchAll(self, sql, args):
+        '''
+        Get fetched result of SQL query 
+        '''  
+        return self._execute(sql, args, fetch=True)
+
+    #--------------------------------------------------------------------------
+    def queryIterate(self, sql, args=None, batchSize=1000):
+        '''
+        Generator of result batches (lists of rows) read with server side
+        cursor - result is never loaded in memory at once. Connection is
+        held until generator is exhausted or closed
+        '''
+        replica = self._chooseReplica()
+        pool = replica.pool if replica is not None else self._pool
+        db = pool.getConnection()
+        broken = True
+        started = time.time()
+        count   = 0
+        try:
+            import MySQLdb.cursors
+            cursor = db.cursor(MySQLdb.cursors.SSDictCursor)
+            cursor.execute(sql, args)
+            while True:
+                rows = cursor.fetchmany(batchSize)
+                if not rows:
+                    break
+                count += len(rows)
+                yield rows
+            cursor.close()
+            broken = False
+            # time includes consumer work between batches
+            self._recordQuery(sql, args, started, count)
+        finally:
+            # unread rows of server side cursor make connection unusable
+            pool.putConnection(db, broken)
+
+    #--------------------------------------------------------------------------
+    def getLastInsertId(self):
+        '''
+        ID of row inserted by last _query of current thread
+        '''
+        return getattr(self._local, 'lastrowid', None)
+
+    #--------------------------------------------------------------------------
+    def getDbThreadPool(self):
+        '''
+        Threads for blocking DB calls - started on first use, one thread
+        per pooled connection
+        '''
+        if self._threadPool is None:
+            from twisted.internet import reactor
+            from twisted.python.threadpool import ThreadPool
+
+            self._threadPool = ThreadPool(
+                    self.getConfigOption('db', 'pool_min', 1, int),
+                    self.getConfigOption('db', 'pool_max', 5, int), 'db')
+            self._threadPool.start()
+            reactor.addSystemEventTrigger('during', 'shutdown', 
+                                          self._threadPool.stop)
+        return self._threadPool
+
+    #--------------------------------------------------------------------------
+    def runInteraction(self, function, *args, **kwargs):
+        '''
+        Run blocking function in DB thread, return Deferred of its result
+        '''
+        from twisted.internet import reactor
+        if self._local is not None and getattr(self._local, 'primary', 0):
+            function = partial(self._runOnPrimary, function)
+        return threads.deferToThreadPool(reactor, self.getDbThreadPool(), 
+                                         function, *args, **kwargs)
+
+    #--------------------------------------------------------------------------
+    def runQuery(self, sql, args=None):
+        '''
+        Deferred version of queryFetchAll
+        '''
+        return self.runInteraction(self.queryFetchAll, sql, args)
+
+    #--------------------------------------------------------------------------
+    def runOperation(self, sql, args=None, tags=None):
+        '''
+        Deferred version of _query - fires with affected rows count
+        '''
+        return self.runInteraction(self._query, sql, args, tags)
+
+    #--------------------------------------------------------------------------
+    def runInsert(self, sql, args=None, tags=None):
+        '''
+        Deferred version of _query - fires with ID of inserted row
+        '''
+        def insert():
+            self._query(sql, args, tags)
+            return self.getLastInsertId()
+        return self.runInteraction(insert)
+
+    #--------------------------------------------------------------------------
+    def getDbStats(self):
+        '''
+        Connection pool and write counters
+        '''
+        stats = {}
+        if self._pool is not None:
+            stats['pool'] = self._pool.getStats()
+        if self._replicas is not None:
+            stats['replicas'] = self._replicas.getStats()
+        if self._writeStats is not None:
+            writes  = dict(self._writeStats)
+            commits = writes['commits'] or 1
+            writes['rows_per_commit'] = float(writes['rows']) / commits
+            writes['avg_commit_time'] = writes['commit_time'] / commits
+            stats['writes'] = writes
+        if self._threadPool is not None:
+            stats['threads'] = {
+                'working' : len(self._threadPool.working),
+                'waiting' : len(self._threadPool.waiters),
+            }
+        stats['health']  = self.getHealthStats().get('db')
+        stats['queries'] = self.getQueryStats().getStats(top=20)
+        return stats
+
+
+
+#===============================================================================
+class FastMemcachedServer(FastServer):
+    isMemcache   = True
+    mc           = None
+    cache_expire = 3600 # 1 hour
+    localCache   = None
+    lease_expire = 30   # seconds
+    lease_wait   = 1.0  # seconds, 0 - compute without waiting for lease holder
+    lease_poll   = 0.05 # seconds between checks while waiting
+    stale_expire = 0    # seconds, 0 - do not keep stale copies
+    negative_expire = 60 # seconds, for None and empty results, 0 - do not cache them
+    tag_namespace   = 'tag'
+    compress_threshold = cachecodec.COMPRESS_THRESHOLD # bytes
+    compress_level     = cachecodec.COMPRESS_LEVEL
+    item_limit         = cachecodec.ITEM_LIMIT         # bytes
+    refresh_ahead      = 10 # percent of expire, 0 - refresh on expiration only
+    _singleFlight = None
+    _refreshing   = None
+    _refreshLock  = None
+    _refreshStats = None
+    _warmUp       = None
+    # highest generation of tag seen by the process
+    _tagFloor     = None
+    
+    #--------------------------------------------------------------------------
+    def initMemcache(self):
+        memcacheEnabled       = self.config.getint('memcache', 'enabled')
+        
+        if memcacheEnabled == 1:
+            self.isMemcache = True
+            from memcachecluster import MemcacheCluster
+            memserver = self.config.get('memcache', 'server')
+            self.cache_expire = self.config.getint('memcache', 'expire') * 60
+            #if self.cache_expire == 0:
+            #    self.cache_expire = 60*60 # default value 1 hour 
+
+            self._log('Try connect to memcache [%s]' % memserver)
+            self.mc = MemcacheCluster(memserver, debug=1,
+                        retry = self.getConfigOption('memcache', 'retry', 30, int))
+            self._log('Enabling Memcache [%s]' % self.mc)
+            self.addHealthCheck('memcache', self._pingMemcache)
+        else:
+            self.isMemcache = False
+
+        self.lease_expire = self.getConfigOption('memcache', 'lease_expire', 30, int)
+        # lease and stale options are in seconds
+        self.lease_wait   = self.getConfigOption('memcache', 'lease_wait', 1.0, float)
+        self.stale_expire = self.getConfigOption('memcache', 'stale_expire', 0, int)
+        self.negative_expire = self.getConfigOption('memcache', 'negative_expire', 60, int)
+        self.tag_namespace   = self.getConfigOption('memcache', 'tag_namespace', 'tag')
+        self.compress_threshold = self.getConfigOption('memcache', 'compress_threshold', 
+                                        cachecodec.COMPRESS_THRESHOLD, int)
+        self.compress_level  = self.getConfigOption('memcache', 'compress_level', 
+                                        cachecodec.COMPRESS_LEVEL, int)
+        self.item_limit      = self.getConfigOption('memcache', 'item_limit', 
+                                        cachecodec.ITEM_LIMIT, int)
+        self.refresh_ahead   = self.getConfigOption('memcache', 'refresh_ahead', 10, int)
+        if self._singleFlight is None:
+            self._singleFlight = SingleFlight()
+        if self._refreshing is None:
+            self._refreshing   = set()
+            self._refreshLock  = threading.Lock()
+            self._refreshStats = {'started' : 0, 'skipped' : 0, 'errors' : 0}
+
+        self.initLocalCache()
+            
+    #--------------------------------------------------------------------------
+    def initLocalCache(self):
+        '''
+        In-process cache in front of memcache - [memcache] local_* options
+        '''
+        if self.getConfigOption('memcache', 'local_enabled', 0, int) != 1:
+            self.localCache = None
+            return
+
+        expire = self.getConfigOption('memcache', 'local_expire', 60, int)
+        self.localCache = LRUCache(
+            maxEntries = self.getConfigOption('memcache', 'local_size', 10000, int),
+            maxBytes   = self.getConfigOption('memcache', 'local_memory', 0, int) * 1024,
+            expire     = min(expire, self.cache_expire))
+        self._log('Enabling local cache [%s entries, %s sec]' % 
+                  (self.localCache.maxEntries, self.localCache.expire))
+            
+    #--------------------------------------------------------------------------
+    def _pingMemcache(self):
+        '''
+        Liveness probe - memcache client does not raise on dead server
+        '''
+        if not self.mc.get_stats():
+            raise Exception('Memcache [%s] is down' % ', '.join(self.mc.servers))
+
+    #--------------------------------------------------------------------------
+    def _memcacheUp(self):
+        '''
+        Memcache is enabled and not known to be down - while it is down
+        cache calls are skipped instead of waiting for socket errors
+        '''
+        return self.isMemcache and self.isHealthy('memcache')
+
+    #--------------------------------------------------------------------------
+    def getCacheStats(self):
+        '''
+        Counters of local cache
+        '''
+        stats = {}
+        if self.localCache is not None:
+            stats['local'] = self.localCache.getStats()
+        if self._singleFlight is not None:
+            stats['singleflight'] = self._singleFlight.getStats()
+        if self._refreshStats is not None:
+            stats['refresh'] = dict(self._refreshStats, 
+                                    running=len(self._refreshing))
+        health = self.getHealthStats().get('memcache')
+        if health is not None:
+            stats['health'] = health
+        if self.mc is not None:
+            stats['nodes'] = self.mc.getStats()
+        if self._memcache is not None:
+            stats['async_nodes'] = self._memcache.getStats()
+        if self._responseCache is not None:
+            stats['responses'] = self._responseCache.getStats()
+        return stats
+            
+    #--------------------------------------------------------------------------
+    def getCacheKey(self, function, args):
+        '''
+        Get cache key for server function calling
+        '''
+        return getFunctionKey(self.config_file, function, args)
+
+    #--------------------------------------------------------------------------
+    def _cacheGet(self, key, refresh=None):
+        '''
+        Get value from local cache, then from memcache. Returns MISS
+        if key is absent - cached None and empty values are hits.
+        refresh(key) is called for value close to expiration
+        '''
+        data = self._localGet(key, refresh)
+        if data is not MISS:
+            return data
+
+        if not self._memcacheUp():
+            return MISS
+
+        return self._cacheGot(self._loadValue(key), key, refresh)
+
+    #--------------------------------------------------------------------------
+    def _encodeValue(self, value):
+        return cachecodec.dumps(value, self.compress_threshold, 
+                                self.compress_level)
+
+    #--------------------------------------------------------------------------
+    def _decodeValue(self, key, data):
+        '''
+        Value of encoded data, None if it can not be decoded
+        '''
+        try:
+            return cachecodec.loads(data)
+        except Exception, ex:
+            self._errorf('Unable to decode cached value of [%s]: %s', key, ex, rate=1)
+            return None
+
+    #--------------------------------------------------------------------------
+    def _loadValue(self, key):
+        '''
+        Read and decode value - chunks of large value are read with
+        one get_multi
+        '''
+        data = self.mc.get(key)
+        if cachecodec.isChunked(data):
+            chunks = self.mc.get_multi(cachecodec.chunkKeys(key, data))
+            data   = cachecodec.join(key, data, chunks)
+        return self._decodeValue(key, data)
+
+    #--------------------------------------------------------------------------
+    def _storeEncoded(self, key, data, expire):
+        '''
+        Write encoded value - in chunks if it is over item limit
+        '''
+        head, chunks = cachecodec.split(key, data, self.item_limit)
+        for chunkKey, chunk in chunks.items():
+            self.mc.set(chunkKey, chunk, expire)
+        self.mc.set(key, head, expire)
+
+    #--------------------------------------------------------------------------
+    @defer.inlineCallbacks
+    def _loadValueDeferred(self, key):
+        mc   = self.getMemcache()
+        data = yield mc.get(key)
+        if cachecodec.isChunked(data):
+            chunks = yield mc.getMulti(cachecodec.chunkKeys(key, data))
+            data   = cachecodec.join(key, data, chunks)
+        defer.returnValue(self._decodeValue(key, data))
+
+    #--------------------------------------------------------------------------
+    def _storeEncodedDeferred(self, key, data, expire):
+        '''
+        Non-blocking _storeEncoded - head is written after all chunks
+        '''
+        mc = self.getMemcache()
+        head, chunks = cachecodec.split(key, data, self.item_limit)
+        if not chunks:
+            return mc.set(key, head, expire)
+        stored = [mc.set(chunkKey, chunk, expire) 
+                  for chunkKey, chunk in chunks.items()]
+        deferred = defer.gatherResults(stored, consumeErrors=True)
+        deferred.addCallback(lambda result: mc.set(key, head, expire))
+        return deferred
+
+    #--------------------------------------------------------------------------
+    def _cacheGot(self, raw, key, refresh=None):
+        '''
+        Unwrap value read from memcache and keep it in local cache. Value
+        in last refresh_ahead percent of its expire is refreshed ahead
+        '''
+        data = unwrapValue(raw)
+        if data is MISS:
+            return data
+        refreshAt = getRefreshAt(raw)
+        if refresh is not None and refreshAt and refreshAt <= time.time():
+            refresh(key)
+            refreshAt = 0
+        if not raw[1]:
+            self._localSet(key, data, None, refreshAt)
+        elif self.negative_expire > 0:
+            self._localSet(key, data, self.negative_expire, refreshAt)
+        return data
+
+    #--------------------------------------------------------------------------
+    def _localGet(self, key, refresh=None):
+        '''
+        Value from local cache - hot keys are served from it, so refresh
+        ahead is checked here too. Refresh is started once per entry
+        '''
+        if self.localCache is None:
+            return MISS
+        entry = self.localCache.get(key, MISS)
+        if entry is MISS:
+            return MISS
+        if refresh is not None and entry[1] and entry[1] <= time.time():
+            entry[1] = 0
+            refresh(key)
+        return entry[0]
+
+    #--------------------------------------------------------------------------
+    def _localSet(self, key, data, expire=None, refreshAt=0):
+        if self.localCache is not None:
+            self.localCache.set(key, [data, refreshAt], expire)
+
+    #--------------------------------------------------------------------------
+    def _cacheGetDeferred(self, key, refresh=None):
+        '''
+        Non-blocking _cacheGet with shared client - errors are misses
+        '''
+        data = self._localGet(key, refresh)
+        if data is not MISS:
+            return defer.succeed(data)
+
+        if not self._memcacheUp():
+            return defer.succeed(MISS)
+
+        deferred = self._loadValueDeferred(key)
+        deferred.addCallbacks(self._cacheGot, self._memcacheFailed,
+                              callbackArgs=(key, refresh), errbackArgs=(MISS,))
+        return deferred
+
+    #--------------------------------------------------------------------------
+    def _memcacheFailed(self, reason, default=None):
+        self._logf('Memcache call failed [%s]', reason.getErrorMessage(), rate=1)
+        return default
+
+    #--------------------------------------------------------------------------
+    def _cacheSet(self, key, data, expire=None):
+        '''
+        Store value in both cache levels, None and empty values are stored
+        for at most negative_expire seconds
+        '''
+        expire    = self._cacheExpire(data, expire)
+        if expire is None:
+            return
+        refreshAt = self._refreshAt(expire)
+        self._localSet(key, data, expire, refreshAt)
+        if self._memcacheUp():
+            raw = self._encodeValue(wrapValue(data, refreshAt))
+            self._storeEncoded(key, raw, expire)
+            if self.stale_expire:
+                self._storeEncoded(self._derivedKey(key, 'stale'), raw, 
+                                   expire + self.stale_expire)
+
+    #--------------------------------------------------------------------------
+    def _cacheSetDeferred(self, key, data, expire=None):
+        '''
+        Non-blocking _cacheSet - fires when memcache stored the value
+        '''
+        expire    = self._cacheExpire(data, expire)
+        if expire is None:
+            return defer.succeed(None)
+        refreshAt = self._refreshAt(expire)
+        self._localSet(key, data, expire, refreshAt)
+        if not self._memcacheUp():
+            return defer.succeed(None)
+
+        raw = self._encodeValue(wrapValue(data, refreshAt))
+        stored = [self._storeEncodedDeferred(key, raw, expire)]
+        if self.stale_expire:
+            stored.append(self._storeEncodedDeferred(
+                            self._derivedKey(key, 'stale'), raw, 
+                            expire + self.stale_expire))
+        deferred = defer.gatherResults(stored, consumeErrors=True)
+        deferred.addErrback(self._memcacheFailed)
+        return deferred
+
+    #--------------------------------------------------------------------------
+    def _cacheExpire(self, data, expire=None):
+        '''
+        Seconds to store value for. None and empty values are stored for
+        at most negative_expire seconds, None - they are not stored (0 is
+        "never expire" for memcache)
+        '''
+        if expire is None:
+            expire = self.cache_expire
+        if isEmpty(data):
+            if self.negative_expire <= 0:
+                return None
+            if not expire:
+                return self.negative_expire
+            return min(expire, self.negative_expire)
+        return expire
+
+    #--------------------------------------------------------------------------
+    def _refreshAt(self, expire):
+        '''
+        Time to start refresh of value stored for expire seconds, 0 - none
+        '''
+        if not self.refresh_ahead or not expire:
+            return 0
+        return time.time() + expire * (100 - self.refresh_ahead) / 100.0
+
+    #--------------------------------------------------------------------------
+    def _startRefresh(self, key):
+        '''
+        Mark key as refreshing by this process - False if it already is
+        '''
+        self._refreshLock.acquire()
+        try:
+            if key in self._refreshing:
+                self._refreshStats['skipped'] += 1
+                return False
+            self._refreshing.add(key)
+            self._refreshStats['started'] += 1
+            return True
+        finally:
+            self._refreshLock.release()
+
+    #--------------------------------------------------------------------------
+    def _endRefresh(self, key):
+        self._refreshLock.acquire()
+        self._refreshing.discard(key)
+        self._refreshLock.release()
+
+    #--------------------------------------------------------------------------
+    def _refreshInThread(self, key, function, args):
+        '''
+        Recompute value in reactor thread pool - caller gets current value.
+        Without running reactor (workers, scripts) it is done right here
+        '''
+        if self._startRefresh(key):
+            from twisted.internet import reactor
+            if reactor.running:
+                reactor.callInThread(self._refresh, key, function, args)
+            else:
+                self._refresh(key, function, args)
+
+    #--------------------------------------------------------------------------
+    def _refresh(self, key, function, args):
+        '''
+        Recompute and store value under lease - other processes keep
+        serving current value meanwhile
+        '''
+        try:
+            try:
+                leased = self._acquireLease(key)
+                if leased:
+                    try:
+                        self._cacheSet(key, self._computeFill(function, args))
+                    finally:
+                        if self._memcacheUp():
+                            self._releaseLease(key, leased)
+            except Exception, ex:
+                self._refreshStats['errors'] += 1
+                self._errorf('Unable to refresh [%s]: %s', key, ex, rate=1)
+        finally:
+            self._endRefresh(key)
+
+    #--------------------------------------------------------------------------
+    def _refreshDeferred(self, key, function, args):
+        '''
+        Recompute value without waiting for it - function may return
+        Deferred
+        '''
+        if self._startRefresh(key):
+            deferred = self._refreshAheadDeferred(key, function, args)
+            deferred.addBoth(self._refreshDone, key)
+
+    #--------------------------------------------------------------------------
+    @defer.inlineCallbacks
+    def _refreshAheadDeferred(self, key, function, args):
+        leased = yield self._acquireLeaseDeferred(key)
+        if leased:
+            try:
+                data = yield defer.maybeDeferred(self._computeFill, function, args)
+                yield self._cacheSetDeferred(key, data)
+            finally:
+                if self._memcacheUp():
+                    self._releaseLeaseDeferred(key, leased)
+
+    #--------------------------------------------------------------------------
+    def _refreshDone(self, result, key):
+        self._endRefresh(key)
+        if isinstance(result, failure.Failure):
+            self._refreshStats['errors'] += 1
+            self._errorf('Unable to refresh [%s]: %s', key, 
+                         result.getErrorMessage(), rate=1)
+
+    #--------------------------------------------------------------------------
+    def _computeFill(self, function, args):
+        '''
+        Value to be cached - DB reads go to primary, replica may return
+        rows older than the write which bumped tags (see primaryReads)
+        '''
+        if method_exists(self, 'primaryReads'):
+            with self.primaryReads():
+                return function(args)
+        return function(args)
+
+    #--------------------------------------------------------------------------
+    def _isCaching(self):
+        return self.isMemcache or self.localCache is not None
+
+    #--------------------------------------------------------------------------
+    def _derivedKey(self, key, kind):
+        '''
+        Key of service record for key - lease, stale copy etc.
+        '''
+        derived = '%s:%s' % (kind, key)
+        if len(derived) > KEY_MAX_LENGTH:
+            derived = makeKey(kind, key)
+        return derived
+
+    #--------------------------------------------------------------------------
+    def _initTag(self, key):
+        '''
+        Start generation of tag - time based, so evicted tag never
+        returns to old generation
+        '''
+        version = int(time.time() * 1000)
+        if self._memcacheUp() and not self.mc.add(key, version, 0):
+            version = self.mc.get(key) or version
+        return version
+
+    #--------------------------------------------------------------------------
+    def getTagVersions(self, tags):
+        '''
+        Current generations of tags. Generations are kept in local cache
+        too - other processes see invalidation after local_expire seconds
+        '''
+        keys     = [getTagKey(tag, self.tag_namespace) for tag in tags]
+        versions = {}
+        missed   = []
+        for key in keys:
+            version = MISS
+            if self.localCache is not None:
+                version = self.localCache.get(key, MISS)
+            if version is MISS:
+                missed.append(key)
+            else:
+                versions[key] = version
+
+        if missed:
+            found = {}
+            if self._memcacheUp():
+                found = self.mc.get_multi(missed)
+            for key in missed:
+                version = found.get(key)
+                if version is None:
+                    version = self._initTag(key)
+                version = self._checkTagFloor(key, version)
+                versions[key] = version
+                if self.localCache is not None:
+                    self.localCache.set(key, version)
+
+        return tuple(versions[key] for key in keys)
+
+    #--------------------------------------------------------------------------
+    def invalidateTags(self, tags):
+        '''
+        Bump generation of tags - all keys depending on them become
+        invalid without enumerating them
+        '''
+        for tag in tags:
+            key = getTagKey(tag, self.tag_namespace)
+            version = None
+            if self._memcacheUp():
+                version = self.mc.incr(key)
+            if version is None:
+                if self.localCache is not None:
+                    self.localCache.delete(key)
+                version = self._initTag(key)
+            version = self._checkTagFloor(key, version)
+            if self.localCache is not None:
+                self.localCache.set(key, version)
+        self._logf('Invalidated tags %s', tags, rate=10)
+
+    #--------------------------------------------------------------------------
+    def _checkTagFloor(self, key, version):
+        '''
+        Generation lower than seen before comes from memcache node which
+        was ejected and returned with old data - move tag past both, so
+        values cached under old generations are not served again
+        '''
+        if self._tagFloor is None:
+            self._tagFloor = {}
+        version = int(version)
+        floor   = self._tagFloor.get(key, 0)
+        if version < floor:
+            version = max(floor + 1, int(time.time() * 1000))
+            if self._memcacheUp():
+                self.mc.set(key, version, 0)
+            self._errorf('Tag [%s] went back from [%s] - moved to [%s]', 
+                         key, floor, version, rate=1)
+        self._tagFloor[key] = version
+        return version
+
+    #--------------------------------------------------------------------------
+    def _taggedKey(self, key, tags):
+        '''
+        Key depending on current generations of tags
+        '''
+        if not tags:
+            return key
+        tags = sorted(set(tags))
+        return makeKey(self.config_file, key, tags, self.getTagVersions(tags))
+
+    #--------------------------------------------------------------------------
+    def _acquireLease(self, key):
+        '''
+        Take short memcache lease on key computation - only one process
+        recomputes expired value. Token of the lease, True if no lease is
+        needed, False if other process holds it
+        '''
+        if not self._memcacheUp() or not self.lease_expire:
+            return True
+        token = _leaseToken()
+        if self.mc.add(self._derivedKey(key, 'lease'), token, self.lease_expire):
+            return token
+        return False
+
+    #--------------------------------------------------------------------------
+    def _releaseLease(self, key, token):
+        '''
+        Delete lease if it is still ours - lease of computation longer than
+        lease_expire may be taken by other process already. Clients have
+        no cas, so lease expiring between get and delete is not detected
+        '''
+        if not isinstance(token, str):
+            return
+        leaseKey = self._derivedKey(key, 'lease')
+        if self.mc.get(leaseKey) == token:
+            self.mc.delete(leaseKey)
+
+    #--------------------------------------------------------------------------
+    def _acquireLeaseDeferred(self, key):
+        '''
+        Non-blocking _acquireLease - computes on memcache error
+        '''
+        if not self._memcacheUp() or not self.lease_expire:
+            return defer.succeed(True)
+        token = _leaseToken()
+        deferred = self.getMemcache().add(self._derivedKey(key, 'lease'),
+                                          token, self.lease_expire)
+        deferred.addCallback(lambda added: token if added else False)
+        deferred.addErrback(self._memcacheFailed, True)
+        return deferred
+
+    #--------------------------------------------------------------------------
+    @defer.inlineCallbacks
+    def _releaseLeaseDeferred(self, key, token):
+        if not isinstance(token, str):
+            return
+        mc = self.getMemcache()
+        leaseKey = self._derivedKey(key, 'lease')
+        try:
+            current = yield mc.get(leaseKey)
+            if current == token:
+                yield mc.delete(leaseKey)
+        except Exception, ex:
+            self._logf('Memcache call failed [%s]', ex, rate=1)
+
+    #--------------------------------------------------------------------------
+    def _getStale(self, key):
+        if not self._memcacheUp() or not self.stale_expire:
+            return MISS
+        return unwrapValue(self._loadValue(self._derivedKey(key, 'stale')))
+
+    #--------------------------------------------------------------------------
+    def _getStaleDeferred(self, key):
+        if not self._memcacheUp() or not self.stale_expire:
+            return defer.succeed(MISS)
+        deferred = self._loadValueDeferred(self._derivedKey(key, 'stale'))
+        deferred.addCallbacks(unwrapValue, self._memcacheFailed, 
+                              errbackArgs=(MISS,))
+        return deferred
+
+    #--------------------------------------------------------------------------
+    def _fillCache(self, key, function, args):
+        '''
+        Compute value and store it in cache. If other process holds the
+        lease - serve stale value or wait lease_wait seconds for its result.
+        Reactor thread is not blocked by waiting - Deferred is returned
+        '''
+        leased = self._acquireLease(key)
+        if not leased:
+            data = self._getStale(key)
+            if data is not MISS:
+                self._logf('Serve stale value for [%s]', key, rate=10)
+                return data
+
+            if self.lease_wait > 0 and _inReactorThread():
+                return self._waitLeaseDeferred(key, function, args)
+
+            deadline = time.time() + self.lease_wait
+            while time.time() < deadline:
+                time.sleep(self.lease_poll)
+                data = self._cacheGet(key)
+                if data is not MISS:
+                    return data
+
+        return self._computeValue(key, function, args, leased)
+
+    #--------------------------------------------------------------------------
+    @defer.inlineCallbacks
+    def _waitLeaseDeferred(self, key, function, args):
+        '''
+        Poll cache for result of lease holder from reactor, compute value
+        if it does not come in lease_wait seconds
+        '''
+        from twisted.internet import reactor
+
+        deadline = time.time() + self.lease_wait
+        while time.time() < deadline:
+            yield task.deferLater(reactor, self.lease_poll, lambda: None)
+            data = self._cacheGet(key)
+            if data is not MISS:
+                defer.returnValue(data)
+        data = yield defer.maybeDeferred(self._computeValue, key, function, 
+                                         args, False)
+        defer.returnValue(data)
+
+    #--------------------------------------------------------------------------
+    def _computeValue(self, key, function, args, leased):
+        try:
+            data = self._computeFill(function, args)
+            self._cacheSet(key, data)
+        finally:
+            if leased and self._memcacheUp():
+                self._releaseLease(key, leased)
+        return data
+
+    #--------------------------------------------------------------------------
+    @defer.inlineCallbacks
+    def _fillCacheDeferred(self, key, function, args):
+        '''
+        Same as _fillCache but memcache calls and waiting for other process
+        do not block reactor, function may return Deferred
+        '''
+        from twisted.internet import reactor
+
+        leased = yield self._acquireLeaseDeferred(key)
+        if not leased:
+            data = yield self._getStaleDeferred(key)
+            if data is not MISS:
+                self._logf('Serve stale value for [%s]', key, rate=10)
+                defer.returnValue(data)
+
+            deadline = time.time() + self.lease_wait
+            while time.time() < deadline:
+                yield task.deferLater(reactor, self.lease_poll, lambda: None)
+                data = yield self._cacheGetDeferred(key)
+                if data is not MISS:
+                    defer.returnValue(data)
+
+        try:
+            data = yield defer.maybeDeferred(self._computeFill, function, args)
+            yield self._cacheSetDeferred(key, data)
+        finally:
+            if leased and self._memcacheUp():
+                self._releaseLeaseDeferred(key, leased)
+        defer.returnValue(data)
+
+    #--------------------------------------------------------------------------
+    def cachedResult(self, function, args, tags=None):
+        '''
+        Get function result directly or from cache. Result is invalidated
+        when any of tags (tables) is changed. Called from reactor it may
+        return Deferred while other process computes the value
+        '''
+        if self._isCaching():
+            key  = self._taggedKey(self.getCacheKey(function, args), tags)
+
+            self._logf('Try memcache for key [%s]', key, rate=10)
+            
+            data = self._cacheGet(key, partial(self._refreshInThread, 
+                                               function=function, args=args))
+
+            if data is MISS:
+                self._logf('Missed cache for [%s] - direct run', key, rate=10)
+                data = self._singleFlight.do(key, self._fillCache, 
+                                             key, function, args)
+            else:
+                self._logf('Memcache hit for [%s]', key, every=100)
+        else:
+            data = function(args)
+            
+        return data
+    
+    #--------------------------------------------------------------------------
+    def cachedResultDeferred(self, function, args, tags=None):
+        '''
+        Deferred version of cachedResult: function may return Deferred,
+        concurrent misses of the same key share one computation
+        '''
+        if not self._isCaching():
+            return defer.maybeDeferred(function, args)
+
+        key = self._taggedKey(self.getCacheKey(function, args), tags)
+        deferred = self._cacheGetDeferred(key, partial(self._refreshDeferred,
+                                            function=function, args=args))
+        deferred.addCallback(self._cachedOrFill, key, function, args)
+        return deferred
+
+    #--------------------------------------------------------------------------
+    def _cachedOrFill(self, data, key, function, args):
+        if data is not MISS:
+            self._logf('Memcache hit for [%s]', key, every=100)
+            return data
+
+        self._logf('Missed cache for [%s] - deferred run', key, rate=10)
+        return self._singleFlight.doDeferred(key, self._fillCacheDeferred,
+                                             key, function, args)
+    
+    #--------------------------------------------------------------------------
+    def queryFetchAllCached(self, sql, args, tags=None):
+        '''
+        Get cache SQL query. Result depends on tables it reads or on tags
+        given - writes to them through _query invalidate it. Called from
+        reactor it may return Deferred, as cachedResult
+        '''
+        if self._isCaching():
+            if tags is None:
+                tags = getReadTags(sql)
+            key  = getQueryKey(self.config_file + ':sql', sql, args)
+            key  = self._taggedKey(key, tags)
+
+            self._logf('Try memcache for sql [%s]', key, rate=10)
+            function = lambda args: self.queryFetchAll(sql, args)
+            data = self._cacheGet(key, partial(self._refreshInThread, 
+                                               function=function, args=args))
+
+            if data is MISS:
+                self._logf('Missed cache for [%s] - direct run', key, rate=10)
+                data = self._singleFlight.do(key, self._fillCache, key, 
+                                             function, args)
+            else:
+                self._logf('Memcache hit for [%s]', key, every=100)
+        else:
+            data = self.queryFetchAll(sql, args)
+            
+        return data
+
+    #--------------------------------------------------------------------------
+    def addWarmUp(self, function, args=None, tags=None):
+        '''
+        Add function result to be primed by warmUp
+        '''
+        if self._warmUp is None:
+            self._warmUp = []
+        self._warmUp.append((function, args, tags))
+
+    #--------------------------------------------------------------------------
+    def _getWarmUp(self):
+        '''
+        Functions added by addWarmUp and [warmup] section. Option value is
+        server method name and python literal of its args:
+            rules = getRules {'type' : 'mail'}
+        '''
+        items = list(self._warmUp or [])
+        if self.config is None or not self.config.has_section('warmup'):
+            return items
+        for name, value in sorted(self.config.items('warmup')):
+            parts = value.split(None, 1)
+            try:
+                function = getattr(self, parts[0])
+                args = ast.literal_eval(parts[1]) if len(parts) > 1 else None
+            except Exception, ex:
+                self._error('Invalid warm-up [%s = %s]: %s' % (name, value, ex))
+                continue
+            items.append((function, args, None))
+        return items
+
+    #--------------------------------------------------------------------------
+    def warmUp(self):
+        '''
+        Prime cache with warm-up functions - call before listening port
+        is open (listen does it). Failed function is logged and skipped
+        '''
+        items = self._getWarmUp()
+        if not items or not self._isCaching():
+            return 0
+        started = time.time()
+        primed  = 0
+        for function, args, tags in items:
+            try:
+                self.cachedResult(function, args, tags)
+                primed += 1
+            except Exception, ex:
+                self._error('Unable to warm up [%s %r]: %s' % 
+                            (getattr(function, '__name__', function), args, ex))
+        self._log('Warmed up [%s of %s] keys in [%.3f] sec' % 
+                  (primed, len(items), time.time() - started))
+        return primed
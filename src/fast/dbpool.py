@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+'''
+Thread safe pool of database connections
+'''
+import time
+import threading
+from contextlib import contextmanager
+
+#==============================================================================
+class PoolTimeout(Exception):
+    '''
+    No free connection during timeout
+    '''
+
+#==============================================================================
+class ConnectionPool:
+    '''
+    Pool of connections created by connect() callable
+
+    - keeps at least minSize connections open, never more than maxSize
+    - connection idle longer than checkInterval is pinged on checkout and
+      replaced if it is dead
+    - collects checkout wait time and utilisation stats
+    '''
+    #--------------------------------------------------------------------------
+    def __init__(self, connect, minSize=1, maxSize=5, timeout=10,
+                 checkInterval=30, name='db'):
+        self.connect       = connect
+        self.minSize       = minSize
+        self.maxSize       = max(minSize, maxSize)
+        self.timeout       = timeout
+        self.checkInterval = checkInterval
+        self.name          = name
+
+        self.checkouts = 0
+        self.waits     = 0
+        self.timeouts  = 0
+        self.broken    = 0
+        self.waitTime  = 0.0
+        self.maxWait   = 0.0
+
+        self._idle  = []    # [(connection, last used time)]
+        self._size  = 0
+        self._used  = 0
+        self._cond  = threading.Condition(threading.Lock())
+        self._closed = False
+
+        for i in range(self.minSize):
+            self._idle.append((self.connect(), time.time()))
+            self._size += 1
+
+    #--------------------------------------------------------------------------
+    def _close(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    #--------------------------------------------------------------------------
+    def _isAlive(self, connection):
+        try:
+            connection.ping()
+            return True
+        except Exception:
+            return False
+
+    #--------------------------------------------------------------------------
+    def getConnection(self, timeout=None):
+        '''
+        Check out connection - wait for free one if pool is exhausted
+        '''
+        if timeout is None:
+            timeout = self.timeout
+        started = time.time()
+        waited  = False
+
+        self._cond.acquire()
+        try:
+            while True:
+                if self._closed:
+                    raise PoolTimeout('Pool [%s] is closed' % self.name)
+                if self._idle:
+                    connection, used = self._idle.pop()
+                    break
+                if self._size < self.maxSize:
+                    # reserve place, connect outside of the lock
+                    self._size += 1
+                    connection, used = None, None
+                    break
+
+                left = started + timeout - time.time()
+                if left <= 0:
+                    self.timeouts += 1
+                    raise PoolTimeout('No free connection in pool [%s] for %s sec'
+                                      % (self.name, timeout))
+                waited = True
+                self._cond.wait(left)
+            self._used += 1
+        finally:
+            self._cond.release()
+
+        try:
+            if connection is None:
+                connection = self.connect()
+            elif time.time() - used > self.checkInterval and not self._isAlive(connection):
+                self.broken += 1
+                self._close(connection)
+                connection = self.connect()
+        except:
+            # place reserved for the connection is free again
+            self._cond.acquire()
+            self._used -= 1
+            self._size -= 1
+            self._cond.notify()
+            self._cond.release()
+            raise
+
+        wait = time.time() - started
+        self.checkouts += 1
+        self.waitTime  += wait
+        if waited:
+            self.waits += 1
+        if wait > self.maxWait:
+            self.maxWait = wait
+        return connection
+
+    #--------------------------------------------------------------------------
+    def putConnection(self, connection, broken=False):
+        '''
+        Return connection to the pool, broken one is closed
+        '''
+        self._cond.acquire()
+        try:
+            self._used -= 1
+            if broken or self._closed:
+                if broken:
+                    self.broken += 1
+                self._size -= 1
+                self._close(connection)
+            else:
+                self._idle.append((connection, time.time()))
+            self._cond.notify()
+        finally:
+            self._cond.release()
+
+    #--------------------------------------------------------------------------
+    @contextmanager
+    def connection(self, timeout=None):
+        '''
+        with pool.connection() as db: ...
+        '''
+        connection = self.getConnection(timeout)
+        broken = False
+        try:
+            yield connection
+        except self.connectionErrors():
+            broken = True
+            raise
+        finally:
+            self.putConnection(connection, broken)
+
+    #--------------------------------------------------------------------------
+    def connectionErrors(self):
+        '''
+        Exceptions meaning connection is not usable any more
+        '''
+        import MySQLdb
+        return (MySQLdb.OperationalError, MySQLdb.InterfaceError)
+
+    #--------------------------------------------------------------------------
+    def closeAll(self):
+        '''
+        Close idle connections, busy ones are closed on return
+        '''
+        self._cond.acquire()
+        try:
+            self._closed = True
+            while self._idle:
+                connection, used = self._idle.pop()
+                self._size -= 1
+                self._close(connection)
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+
+    #--------------------------------------------------------------------------
+    def getStats(self):
+        '''
+        Pool counters
+        '''
+        checkouts = self.checkouts or 1
+        return {
+            'size'        : self._size,
+            'idle'        : len(self._idle),
+            'used'        : self._used,
+            'utilisation' : float(self._used) / self.maxSize,
+            'checkouts'   : self.checkouts,
+            'waits'       : self.waits,
+            'timeouts'    : self.timeouts,
+            'broken'      : self.broken,
+            'avg_wait'    : self.waitTime / checkouts,
+            'max_wait'    : self.maxWait,
+        }
@@ -13,6 +13,10 @@ from datetime import datetime, timedelta
 from time import strptime, mktime
 
 from src.libs.fast.core import logger, FastObject, FastDbObject, FastConfigObject, getMD5Hash
+from src.libs.fast.memcachecluster import MemcacheCluster
+from src.libs.fast import cachecodec
+from src.libs.fast.cachetags import getTagKey, bumpTag
+from src.libs.fast.sharedcache import getSharedCache
 
 #TIME_FORMAT = '%a, %d %b %Y %H:%M:%S +0000'
 TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
@@ -54,17 +58,17 @@ def check_request_status(job_request):
 #==============================================================================   
 class CustomGearmanWorker(gearman.GearmanWorker):
     def on_job_execute(self, current_job):
-        logger.Info('Job [%s] started' % current_job.unique)
+        logger.Info('Job [%s] started', current_job.unique)
         return super(CustomGearmanWorker, self).on_job_execute(current_job)
 
     def on_job_exception(self, current_job, exc_info):
         #params = PickleDataEncoder.decode(current_job.data)
         
-        logger.Error('Job [%s] failed, CAN stop last gasp GEARMAN_COMMAND_WORK_FAIL [%s]' % (current_job.unique, exc_info))
+        logger.Error('Job [%s] failed, CAN stop last gasp GEARMAN_COMMAND_WORK_FAIL [%s]', current_job.unique, exc_info)
         return super(CustomGearmanWorker, self).on_job_exception(current_job, exc_info)
 
     def on_job_complete(self, current_job, job_result):
-        logger.Info('Job [%s] successfully complete with [%s] result' % (current_job.unique, job_result))
+        logger.Info('Job [%s] successfully complete with [%s] result', current_job.unique, job_result)
         return super(CustomGearmanWorker, self).send_job_complete(current_job, job_result)
 
     def after_poll(self, any_activity):
@@ -77,7 +81,7 @@ def child(gearman_server, func):
     '''
     Порождаем процесс-потомок
     '''
-    logger.Info('A new child [%s]' %  os.getpid( ))
+    logger.Info('A new child [%s]', os.getpid( ))
     func(gearman_server)
     os._exit(0)
     
@@ -86,6 +90,36 @@ def get_time_now():
     return datetime.now().strftime(TIME_FORMAT)      
 
 
+#==============================================================================
+class _Pid:
+    '''
+    Current PID for lazy log formatting - os.getpid() is called only
+    when message is written
+    '''
+    def __str__(self):
+        return str(os.getpid())
+
+_PID = _Pid()
+
+_memcacheClients = {}
+
+#==============================================================================
+def getMemcacheClient(memserver):
+    '''
+    One memcache client per process and server list - child process does
+    not share sockets of the parent
+    '''
+    key    = (os.getpid(), memserver)
+    client = _memcacheClients.get(key)
+    if client is None:
+        for other in _memcacheClients.keys():
+            if other[0] != key[0]:
+                del _memcacheClients[other]
+        client = _memcacheClients[key] = MemcacheCluster(memserver, debug=1)
+        logger.Info('PID: [%s] Memcache client [%s]', _PID, memserver)
+    return client
+
+
 
     
     
@@ -98,14 +132,43 @@ class WorkerProcessor(FastObject):
         self.config = config
 
     #--------------------------------------------------------------------------
-    def _log(self, msg):
-        msg = 'PID: [%s] %s' % (os.getpid( ), msg)
-        FastObject._log(self, msg)  
+    def getShared(self, key, default=None):
+        '''
+        Lookup data published by supervisor in shared memory
+        '''
+        cache = getSharedCache()
+        if cache is None:
+            return default
+        return cache.get(key, default)
+
+    #--------------------------------------------------------------------------
+    def _log(self, msg, *args, **kwargs):
+        if not args:
+            msg = msg.replace('%', '%%')
+        kwargs['depth'] = kwargs.get('depth', 0) + 1
+        self._logf(msg, *args, **kwargs)
+
+    #--------------------------------------------------------------------------
+    def _error(self, msg, *args, **kwargs):
+        if not args:
+            msg = msg.replace('%', '%%')
+        kwargs['depth'] = kwargs.get('depth', 0) + 1
+        self._errorf(msg, *args, **kwargs)
+
+    #--------------------------------------------------------------------------
+    def _logf(self, fmt, *args, **kwargs):
+        kwargs['depth'] = kwargs.get('depth', 0) + 1
+        FastObject._logf(self, 'PID: [%s] ' + fmt, _PID, *args, **kwargs)
+
+    #--------------------------------------------------------------------------
+    def _errorf(self, fmt, *args, **kwargs):
+        kwargs['depth'] = kwargs.get('depth', 0) + 1
+        FastObject._errorf(self, 'PID: [%s] ' + fmt, _PID, *args, **kwargs)
 
     #--------------------------------------------------------------------------
-    def _error(self, msg):
-        msg = 'PID: [%s] %s' % (os.getpid( ),  msg)
-        FastObject._error(self, msg)
+    def _warnf(self, fmt, *args, **kwargs):
+        kwargs['depth'] = kwargs.get('depth', 0) + 1
+        FastObject._warnf(self, 'PID: [%s] ' + fmt, _PID, *args, **kwargs)
         
     #--------------------------------------------------------------------------
     def getRunningTime(self, start_time):
@@ -163,17 +226,9 @@ class WorkerMemcacheProcessor(WorkerProcessor):
     #--------------------------------------------------------------------------
     def initMemcache(self):
         '''
-        Reconnect to memcache
+        Use memcache client of the process - connection is kept between jobs
         '''
-        memserver = self.config.get('memcache', 'server')
-        
-        self._log('Try connect to memcache [%s]' % memserver)
-        self.mc = memcache.Client( [ memserver ], debug=1)
-
-        if not self.mc:
-            raise Exception('Unable to connect to memcache at [%s]' % memserver)
-        
-        self._log('Enabling Memcache [%s]' % self.mc)
+        self.mc = getMemcacheClient(self.config.get('memcache', 'server'))
         
         
     #--------------------------------------------------------------------------
@@ -186,8 +241,8 @@ class WorkerMemcacheProcessor(WorkerProcessor):
         
         task_key = 'task-%s' % uid
         
-        task_data = pickle.loads(self.mc.get(task_key))
-        self._log('old data [%s]' % task_data)
+        task_data = cachecodec.loads(self.mc.get(task_key), legacy=pickle.loads)
+        self._log('old data [%s]', task_data)
         
         
         time_data = self.getRunningTime(start_time)
@@ -195,8 +250,8 @@ class WorkerMemcacheProcessor(WorkerProcessor):
         for key, value in time_data:
             task_data[key] = value
         
-        self.mc.replace(task_key, pickle.dumps(task_data))
-        self._log('Update job=[%s] data=[%s]' % (uid, task_data)) 
+        self.mc.replace(task_key, cachecodec.dumps(task_data))
+        self._log('Update job=[%s] data=[%s]', uid, task_data)
 
     #--------------------------------------------------------------------------
     def run(self, params):
@@ -212,7 +267,29 @@ class WorkerDbProcessor(WorkerProcessor, FastDbObject):
     def __init__(self, config):
         WorkerProcessor.__init__(self, config)
         FastDbObject.__init__(self)
+        if self.config.has_option('db', 'slow_query'):
+            self.slow_query = self.config.getint('db', 'slow_query') / 1000.0
         
+    #--------------------------------------------------------------------------
+    def invalidateTags(self, tags):
+        '''
+        Bump cache tags changed by _query - readers in servers sharing
+        [memcache] server do not get stale results. Error is logged only,
+        write is already committed
+        '''
+        if not self.config.has_option('memcache', 'enabled') or \
+           not self.config.getint('memcache', 'enabled'):
+            return
+        namespace = 'tag'
+        if self.config.has_option('memcache', 'tag_namespace'):
+            namespace = self.config.get('memcache', 'tag_namespace')
+        try:
+            mc = getMemcacheClient(self.config.get('memcache', 'server'))
+            for tag in tags:
+                bumpTag(mc, getTagKey(tag, namespace))
+        except Exception, ex:
+            self._error('Unable to invalidate tags %s: %s', tags, ex)
+
     #--------------------------------------------------------------------------
     def updateJob(self, uid, start_time, data=None):
         '''
@@ -231,7 +308,7 @@ class WorkerDbProcessor(WorkerProcessor, FastDbObject):
 
         run_time = timedelta(seconds=end_time-start_time)
         
-        self._log('start_time=[%s], end_time=[%s], run_time=[%s])' %  (start_time, end_time, run_time))
+        self._log('start_time=[%s], end_time=[%s], run_time=[%s])', start_time, end_time, run_time)
         
         self._query('UPDATE monitord_log SET (start_time, end_time, run_time) VALUES (%s, %s, %s) WHERE uid=%s' % (start_time, end_time, run_time, uid))
 
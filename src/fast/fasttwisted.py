@@ -3,30 +3,37 @@
 import sys
 sys.path.append("/usr/share/pyshared")
 
-import memcache
+import time
 import pickle
-from datetime import datetime
+import hashlib
 
 import twisted.web
 #import twisted.python.log
 import twisted.web.resource
 
-from twisted.internet import defer                                                                                                                              
-from twisted.web import server                                                                                                                                  
+from twisted.internet import defer, threads
+from twisted.web import server, http
 from twisted.internet import reactor                                                                                                                            
-from twisted.python import failure 
-
-
-try:
-    import json
-except:
-# @todo - don't understood what happens with remarked code
-    import simplejson as json
+from twisted.python import failure, log
+from twisted.internet.interfaces import IPushProducer
+from zope.interface import implementer
 
 from core import FastObject, getMD5Hash
+from jsonencoder import getEncoder
+import httpcompress
 
 is_array = lambda var: isinstance(var, (list, tuple))
 
+JSON_CONTENT_TYPE = 'text/javascript; charset=UTF-8'
+JSON_CONTENT_TYPE_HEADER = [JSON_CONTENT_TYPE]
+
+#===============================================================================
+def encodeInProcess(handler, encoder, data):
+    '''
+    Run in pool process - result of handler is encoded there too
+    '''
+    return getEncoder(encoder).encode(handler(data))
+
 #===============================================================================
 class FastServerResource(FastObject, twisted.web.resource.Resource):
     '''
@@ -70,6 +77,18 @@ class FastJsonServerResource(FastServerResource):
     allowedMethods = ('GET', 'POST')
 
     _isHtml = False
+    # jsonencoder backend, None - [main] json_encoder or auto
+    json_encoder = None
+    _jsonEncoder = None
+    # seconds to keep encoded GET response with ETag, 0 - not cached
+    response_cache = 0
+    # gzip/deflate of responses, None - [http] compress* options; off
+    # unless resource or [http] compress = 1 turns it on
+    compress        = None
+    compress_level  = None
+    compress_min    = None
+    compress_thread = None
+    _compression    = None
     _htmlHeader  = '''<html><head>
         <meta http-equiv="Content-Type" 
             content="text/response; charset=utf-8" />
@@ -78,10 +97,181 @@ class FastJsonServerResource(FastServerResource):
         'ERROR_PARAM_MISSED': 'Missed required param [%s]',
         'ERROR_PARAM_SHORT' : 
             'Search query param [%s] too short - minimum length is [%s]',
-        'ERROR_INTERNAL'    : 'Unable to process request [%s]'        
+        'ERROR_INTERNAL'    : 'Unable to process request [%s]',
+        'ERROR_OVERLOADED'  : 'Server is busy - retry in [%s] sec',
     }
     #logging = True
 
+    #--------------------------------------------------------------------------
+    def render(self, request):
+        self._negotiateEncoding(request)
+        body = self._renderCached(request)
+        if body is None:
+            body = twisted.web.resource.Resource.render(self, request)
+        if not isinstance(body, str):
+            return body
+        return self._renderBody(request, body)
+
+    #--------------------------------------------------------------------------
+    def _renderBody(self, request, body):
+        '''
+        Compressed body or NOT_DONE_YET if it is compressed in thread
+        '''
+        body = self._compressBody(body, request)
+        if isinstance(body, defer.Deferred):
+            body.addCallbacks(self._writeBody, self._compressFailed,
+                              callbackArgs=(request,), errbackArgs=(request,))
+            return server.NOT_DONE_YET
+        return body
+
+    #--------------------------------------------------------------------------
+    def getCompression(self):
+        '''
+        (enabled, level, min size, thread size) of the resource - re-read
+        when [http] is reloaded
+        '''
+        generation = self._server.httpGeneration
+        if self._compression is None or self._compression[0] != generation:
+            option = self._server.getConfigOption
+            self._compression = generation, (
+                self.compress if self.compress is not None else 
+                    option('http', 'compress', 0, int) == 1,
+                self.compress_level or 
+                    option('http', 'compress_level', httpcompress.COMPRESS_LEVEL, int),
+                self.compress_min if self.compress_min is not None else
+                    option('http', 'compress_min', httpcompress.COMPRESS_MIN, int),
+                self.compress_thread if self.compress_thread is not None else
+                    option('http', 'compress_thread', httpcompress.COMPRESS_THREAD, int))
+        return self._compression[1]
+
+    #--------------------------------------------------------------------------
+    def _negotiateEncoding(self, request):
+        '''
+        Choose Content-Encoding of response by Accept-Encoding
+        '''
+        request.fastEncoding = None
+        if self.getCompression()[0]:
+            request.responseHeaders.setRawHeaders('Vary', ['Accept-Encoding'])
+            request.fastEncoding = httpcompress.negotiate(
+                                        request.getHeader('accept-encoding'))
+
+    #--------------------------------------------------------------------------
+    def _getEncoding(self, request, body):
+        '''
+        Content-Encoding for body, None - send as is
+        '''
+        encoding = getattr(request, 'fastEncoding', None)
+        if encoding is None or request.code != http.OK or \
+                len(body) < self.getCompression()[2]:
+            return None
+        return encoding
+
+    #--------------------------------------------------------------------------
+    def _compressBody(self, body, request):
+        '''
+        Body compressed for the request - str or Deferred for body over
+        compress_thread size, which is compressed in thread. Compressed
+        variant of cached response is cached too
+        '''
+        encoding = self._getEncoding(request, body)
+        if encoding is None:
+            return body
+
+        # variant of cached response - key includes its ETag
+        key  = getattr(request, 'fastResponseKey', None)
+        etag = getattr(request, 'fastResponseETag', None)
+        if key is not None and etag is not None:
+            key   = key + (etag, encoding)
+            entry = self._server.getResponseCache().get(key)
+            if entry is not None:
+                return self._compressed(entry[0], request, encoding)
+        else:
+            key = None
+
+        enabled, level, minSize, threadSize = self.getCompression()
+        if len(body) < threadSize:
+            compressed = httpcompress.compress(body, encoding, level)
+            return self._compressed(compressed, request, encoding, key)
+        deferred = threads.deferToThread(httpcompress.compress, body, encoding, level)
+        deferred.addCallback(self._compressed, request, encoding, key)
+        return deferred
+
+    #--------------------------------------------------------------------------
+    def _compressed(self, compressed, request, encoding, key=None):
+        request.responseHeaders.setRawHeaders('Content-Encoding', [encoding])
+        if key is not None:
+            self._server.getResponseCache().set(key, (compressed,), 
+                                                self.response_cache)
+        return compressed
+
+    #--------------------------------------------------------------------------
+    def _writeBody(self, body, request):
+        if not request.finished and not getattr(request, '_disconnected', False):
+            request.write(body)
+            request.finish()
+
+    #--------------------------------------------------------------------------
+    def _compressFailed(self, reason, request):
+        self._error('Unable to compress response [%s]' % reason.getErrorMessage())
+        if not request.finished and not getattr(request, '_disconnected', False):
+            request.setResponseCode(http.INTERNAL_SERVER_ERROR)
+            request.finish()
+
+    #--------------------------------------------------------------------------
+    def _getResponseKey(self, request):
+        '''
+        Path and args - order of args does not matter
+        '''
+        args = tuple(sorted((name, tuple(values)) 
+                            for name, values in request.args.items()))
+        return (request.path, args)
+
+    #--------------------------------------------------------------------------
+    def _renderCached(self, request):
+        '''
+        Cached response of GET request or None. Request is marked with
+        key - on miss response made by returnJsonResponse is stored
+        '''
+        if not self.response_cache or request.method not in ('GET', 'HEAD') \
+                or 'html' in request.args:
+            return None
+        key   = self._getResponseKey(request)
+        entry = self._server.getResponseCache().get(key)
+        request.fastResponseKey = key
+        if entry is None:
+            return None
+        request.responseHeaders.setRawHeaders('Content-Type', JSON_CONTENT_TYPE_HEADER)
+        return self._cachedResponse(request, *entry)
+
+    #--------------------------------------------------------------------------
+    def _storeResponse(self, request, key, body):
+        '''
+        Keep successful response with strong ETag
+        '''
+        if request.code != http.OK:
+            return body
+        etag    = '"%s"' % hashlib.md5(body).hexdigest()
+        expires = time.time() + self.response_cache
+        self._server.getResponseCache().set(key, (body, etag, expires), 
+                                            self.response_cache)
+        return self._cachedResponse(request, body, etag, expires)
+
+    #--------------------------------------------------------------------------
+    def _cachedResponse(self, request, body, etag, expires):
+        '''
+        Body with ETag and Cache-Control, empty 304 if client has it.
+        Compressed variant has own ETag
+        '''
+        request.responseHeaders.setRawHeaders('Cache-Control', 
+                ['max-age=%d' % max(0, expires - time.time())])
+        request.fastResponseETag = etag
+        encoding = self._getEncoding(request, body)
+        if encoding is not None:
+            etag = '%s-%s"' % (etag[:-1], encoding)
+        if request.setETag(etag) == http.CACHED:
+            return ''
+        return body
+
     #--------------------------------------------------------------------------
     def checkHtmlMode(self, request):
         '''
@@ -92,22 +282,39 @@ class FastJsonServerResource(FastServerResource):
             if request.args['html'] == '1':
                 self._isHtml = True
         
+    #--------------------------------------------------------------------------
+    def getJsonEncoder(self):
+        '''
+        Encoder of the resource - chosen once
+        '''
+        if self._jsonEncoder is None:
+            name = self.json_encoder or \
+                   self._server.getConfigOption('main', 'json_encoder', 'auto')
+            self._jsonEncoder = getEncoder(name)
+        return self._jsonEncoder
+
     #--------------------------------------------------------------------------
     def returnJsonResponse(self, request, data):
         '''
-        Return JSON/HTML request  
+        Return JSON/HTML request - JSON is UTF-8 str
         '''
         if self._isHtml:
             response  = self._htmlHeader + self._toHtml(request, data) 
         else:
             # @todo Twisted 8.1 backporting - for 10.0 enable this
-            type = 'text/javascript; charset=UTF-8'
-            request.responseHeaders.setRawHeaders('Content-Type', [type,])
+            response = self._jsonResponse(self.getJsonEncoder().encode(data), request)
             
-            dthandler = lambda obj: obj.isoformat() if isinstance(obj, datetime) else None
+        return response
 
-            response = json.dumps(data, ensure_ascii=False, default=dthandler)
-            
+    #--------------------------------------------------------------------------
+    def _jsonResponse(self, response, request):
+        '''
+        Encoded JSON body - stored to response cache if it is on
+        '''
+        request.responseHeaders.setRawHeaders('Content-Type', JSON_CONTENT_TYPE_HEADER)
+        key = getattr(request, 'fastResponseKey', None)
+        if key is not None:
+            response = self._storeResponse(request, key, response)
         return response
 
     
@@ -151,6 +358,8 @@ class FastJsonServerResource(FastServerResource):
     
     #--------------------------------------------------------------------------
     def getJsonError(self, request, type, args):
+        # errors are not cached
+        request.fastResponseKey = None
         msg = self._errorsArray[type] % args
         self._error('JSON Error [%s] [%s]' % (type, msg))
         return self.returnJsonResponse(request, {'errors' : 
@@ -183,35 +392,78 @@ class FastJsonServerResource(FastServerResource):
     
 #==============================================================================   
 class FastJsonMemcacheServerResource(FastJsonServerResource):
+    # blocking client set by initMemcache
     mc = None
     isLeaf = True    
 
     #--------------------------------------------------------------------------
     def initMemcache(self):
-        memserver = self._server.config.get('memcache', 'server')
-        
-        self._log('Try connect to memcache [%s]' % memserver)
-        self.mc = memcache.Client( [ memserver ], debug=1)
+        '''
+        Use shared blocking memcache client of the server
+        '''
+        self.mc = self._server.getBlockingMemcache()
 
-        if not self.mc:
-            raise Exception('Unable to connect to memcache at [%s]' % memserver)
-        
-        self._log('Enabling Memcache [%s]' % self.mc)
+    #--------------------------------------------------------------------------
+    def getMemcache(self):
+        '''
+        Shared non-blocking memcache client of the server - its calls
+        return Deferred
+        '''
+        return self._server.getMemcache()
+
+    #--------------------------------------------------------------------------
+    def finishResponse(self, page, request):
+        '''
+        Write page of request rendered with NOT_DONE_YET
+        '''
+        if not request.finished:
+            request.write(page)
+            request.finish()
         
         
 #==============================================================================   
 class FastJsonServerResourceDeferred(FastJsonServerResource):
     logging = True
+    # _getData execution, None - [http] options:
+    # threaded - blocking _getData in request thread pool (it must not
+    # use reactor), max_concurrent - handlers running at once (0 - no
+    # limit), max_queue - requests waiting for them, over it 503 is sent
+    threaded       = None
+    max_concurrent = None
+    max_queue      = None
+    retry_after    = None
+    # resources with the same limiter_name share one limiter (give them
+    # the same limits), None - own limiter of the resource instance
+    limiter_name   = None
+    _limiter       = None
+    # CPU-bound handler of _getData result run in server process pool
+    # with JSON encoding, staticmethod of module level function, e.g.
+    # process_handler = staticmethod(aggregate)
+    process_handler = None
+
+    #--------------------------------------------------------------------------
+    def bindServer(self, server):
+        FastJsonServerResource.bindServer(self, server)
+        if server is not None and self.process_handler is not None:
+            server.requireProcessPool()
 
     #--------------------------------------------------------------------------
     def render(self, request):
         '''
         Отображаем запрос
         '''
+        self._negotiateEncoding(request)
+        cached = self._renderCached(request)
+        if cached is not None:
+            return self._renderBody(request, cached)
+        limiter = self.getLimiter()
+        if limiter is not None and not limiter.admit():
+            return self.getOverloadedResponse(request)
         try:
             deferred  = defer.Deferred()                                                                                                                        
 
-            args = {'request' : request, 'deferred' : deferred}                                                                                
+            args = {'request' : request, 'deferred' : deferred,
+                    'limiter' : limiter}
             deferred.addCallback(self.successCbk, args)                                                                                                         
             deferred.addErrback(self.errorCbk, args)                                                                                                         
 
@@ -226,21 +478,118 @@ class FastJsonServerResourceDeferred(FastJsonServerResource):
         '''
         Обёртка для вызова deferred 
         '''
-        try:
-            request  = args['request']                                                                                                                              
-            deferred = args['deferred']
+        request  = args['request']                                                                                                                              
+        deferred = args['deferred']
 
-            data = self._getData(request)
-        
-            deferred.callback(self.returnJsonResponse(request, data))
-        except Exception, ex:
-            #deferred.errback(self.exceptionToJson(request, ex))         
-            deferred.errback( ex )         
+        # limiter which admitted request - reload may replace it meanwhile
+        limiter = args['limiter']
+        if limiter is None:
+            result = self._getBody(request)
+        else:
+            result = limiter.run(self._getBody, request)
+        result.addCallback(self._compressBody, request)
+        result.chainDeferred(deferred)
+
+    #--------------------------------------------------------------------------
+    def _getBody(self, request):
+        result = self._runGetData(request)
+        if self.process_handler is None:
+            result.addCallback(self._dataToJson, request)
+        else:
+            result.addCallback(self._processData, request)
+        return result
+
+    #--------------------------------------------------------------------------
+    def _processData(self, data, request):
+        '''
+        Deferred of response body - handler is run in process pool
+        '''
+        pool = self._server.getProcessPool()
+        if self._isHtml:
+            result = pool.run(self.process_handler, data)
+            result.addCallback(self._dataToJson, request)
+        else:
+            result = pool.run(encodeInProcess, self.process_handler, 
+                              self.getJsonEncoder().name, data)
+            result.addCallback(self._jsonResponse, request)
+        result.addErrback(self._processFailed)
+        return result
+
+    #--------------------------------------------------------------------------
+    def _processFailed(self, reason):
+        self._error('Process handler failed: %s\n%s' % (reason.getErrorMessage(),
+                    getattr(reason.value, 'traceback', '')))
+        return reason
+
+    #--------------------------------------------------------------------------
+    def _runGetData(self, request):
+        '''
+        _getData may return data or Deferred (e.g. from server.runQuery),
+        threaded one is run in request thread pool
+        '''
+        if self._getOption('threaded', 0) == 1:
+            return threads.deferToThreadPool(reactor, 
+                        self._server.getRequestThreadPool(), self._getData, request)
+        return defer.maybeDeferred(self._getData, request)
+
+    #--------------------------------------------------------------------------
+    def _getOption(self, name, default):
+        '''
+        Resource attribute or [http] option of the same name
+        '''
+        value = getattr(self, name)
+        if value is None:
+            value = self._server.getConfigOption('http', name, default, int)
+        return int(value)
+
+    #--------------------------------------------------------------------------
+    def getLimiter(self):
+        '''
+        Concurrency limiter of the resource, None - no limit. Limits are
+        re-read when [http] is reloaded
+        '''
+        generation = self._server.httpGeneration
+        if self._limiter is None or self._limiter[0] != generation:
+            limit = self._getOption('max_concurrent', 0)
+            limiter = None
+            if limit > 0:
+                limiter = self._server.getLimiter(self.getLimiterName(), 
+                                    limit, self._getOption('max_queue', 100))
+            self._limiter = generation, limiter
+        return self._limiter[1]
+
+    #--------------------------------------------------------------------------
+    def getLimiterName(self):
+        '''
+        Name of limiter in server stats - unique per instance by default
+        '''
+        if self.limiter_name is not None:
+            return self.limiter_name
+        return '%s.%s-%x' % (self.__class__.__module__, self.__class__.__name__, 
+                             id(self))
+
+    #--------------------------------------------------------------------------
+    def getOverloadedResponse(self, request):
+        '''
+        503 with Retry-After - handlers are busy and queue is full
+        '''
+        retryAfter = self._getOption('retry_after', 1)
+        request.setResponseCode(http.SERVICE_UNAVAILABLE)
+        request.setHeader('Retry-After', str(retryAfter))
+        request.fastResponseKey = None
+        self._logf('Request rejected - %s', self.getLimiter().getStats(), rate=1)
+        type = 'ERROR_OVERLOADED'
+        return self.returnJsonResponse(request, {'errors' : 
+                ({'type' : type, 'text' : self._errorsArray[type] % retryAfter})})
+
+    #--------------------------------------------------------------------------
+    def _dataToJson(self, data, request):
+        return self.returnJsonResponse(request, data)
   
     #--------------------------------------------------------------------------
     def _getData(self, request):
         '''
-        Сохраняем полученные данные
+        Сохраняем полученные данные - данные или Deferred
         '''
         raise Exception('Method _handleRendering should be redefined!')
             
@@ -260,8 +609,137 @@ class FastJsonServerResourceDeferred(FastJsonServerResource):
         '''                                                                                                                                                     
         request  = args['request']                                                                                                                              
         request.write(self.exceptionToJson(request, failure.getErrorMessage()))                                                                                                                                 
-        request.finish()                    
+        request.finish()
 
-        
-        
+
+#==============================================================================
+@implementer(IPushProducer)
+class JsonStreamProducer:
+    '''
+    Writes batches of rows from iterator to request as one JSON array.
+    Next batch is read by runner (e.g. server.runInteraction) only when
+    previous one is written and transport is not paused
+    '''
+    #--------------------------------------------------------------------------
+    def __init__(self, request, batches, encode, runner=defer.maybeDeferred):
+        self.request = request
+        self.batches = batches
+        self.encode  = encode
+        self.runner  = runner
+        self.rows    = 0
+
+        self._paused   = False
+        self._reading  = False
+        self._finished = False
+        self._first    = True
+
+    #--------------------------------------------------------------------------
+    def start(self):
+        self.request.registerProducer(self, True)
+        self.request.notifyFinish().addErrback(lambda reason: self.stopProducing())
+        self.request.write('[')
+        self._readNext()
+
+    #--------------------------------------------------------------------------
+    def _readNext(self):
+        if self._paused or self._reading or self._finished:
+            return
+        self._reading = True
+        deferred = self.runner(next, self.batches, None)
+        deferred.addCallbacks(self._write, self._fail)
+
+    #--------------------------------------------------------------------------
+    def _write(self, rows):
+        self._reading = False
+        if self._finished:
+            self._close()
+            return
+        if rows is None:
+            self.request.write(']')
+            self._finish()
+            return
+
+        chunks = [self.encode(row) for row in rows]
+        if self._first:
+            self._first = False
+        else:
+            chunks.insert(0, '')
+        self.request.write(','.join(chunks))
+        self.rows += len(rows)
+        self._readNext()
+
+    #--------------------------------------------------------------------------
+    def _fail(self, reason):
+        '''
+        Error in the middle of the stream - response stays invalid JSON
+        '''
+        self._reading = False
+        log.err(reason, 'JSON stream failed after %s rows' % self.rows)
+        self._close()
+        self._finish()
+
+    #--------------------------------------------------------------------------
+    def _finish(self):
+        if not self._finished:
+            self._finished = True
+            self.request.unregisterProducer()
+            self.request.finish()
+
+    #--------------------------------------------------------------------------
+    def _close(self):
+        close = getattr(self.batches, 'close', None)
+        if close is not None:
+            self.runner(close)
+
+    #--------------------------------------------------------------------------
+    def pauseProducing(self):
+        self._paused = True
+
+    #--------------------------------------------------------------------------
+    def resumeProducing(self):
+        self._paused = False
+        self._readNext()
+
+    #--------------------------------------------------------------------------
+    def stopProducing(self):
+        '''
+        Client disconnected - close iterator when current read is done
+        '''
+        if self._finished:
+            return
+        self._finished = True
+        if not self._reading:
+            self._close()
+
+
+#==============================================================================   
+class FastJsonStreamServerResource(FastJsonServerResource):
+    '''
+    JSON array streamed to client in chunks - for large exports.
+    _getStream returns iterator of row batches, e.g. server.queryIterate
+    '''
+    logging = True
+
+    #--------------------------------------------------------------------------
+    def render(self, request):
+        try:
+            batches = self._getStream(request)
+        except Exception, ex:
+            return self.exceptionToJson(request, ex)
+
+        request.responseHeaders.setRawHeaders('Content-Type', JSON_CONTENT_TYPE_HEADER)
+        runner = getattr(self._server, 'runInteraction', defer.maybeDeferred)
+        JsonStreamProducer(request, batches, self._encodeRow, runner).start()
+        return server.NOT_DONE_YET
+
+    #--------------------------------------------------------------------------
+    def _getStream(self, request):
+        '''
+        Iterator of lists of rows
+        '''
+        raise Exception('Method _getStream should be redefined!')
+
+    #--------------------------------------------------------------------------
+    def _encodeRow(self, row):
+        return self.getJsonEncoder().encode(row)
 
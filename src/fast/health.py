@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+'''
+Health of external services: circuit breaker and background liveness
+checks
+'''
+import time
+import threading
+
+from twisted.internet import task, threads
+
+CLOSED    = 'closed'
+OPEN      = 'open'
+HALF_OPEN = 'half-open'
+
+#==============================================================================
+class CircuitOpen(Exception):
+    '''
+    Service is down - call is rejected without trying
+    '''
+
+#==============================================================================
+class CircuitBreaker:
+    '''
+    After failureThreshold failures in a row the circuit opens and calls
+    fail fast. After retryTimeout one probe call is let through (half-open):
+    success closes the circuit, failure opens it again with retry timeout
+    multiplied by backoff (up to maxRetryTimeout)
+    '''
+    #--------------------------------------------------------------------------
+    def __init__(self, name, failureThreshold=3, retryTimeout=1.0,
+                 maxRetryTimeout=60.0, backoff=2.0):
+        self.name             = name
+        self.failureThreshold = failureThreshold
+        self.retryTimeout     = retryTimeout
+        self.maxRetryTimeout  = maxRetryTimeout
+        self.backoff          = backoff
+
+        self.state     = CLOSED
+        self.failures  = 0
+        self.rejected  = 0
+        self.opened    = 0
+        self._timeout  = retryTimeout
+        self._retryAt  = 0
+        self._lock     = threading.Lock()
+
+    #--------------------------------------------------------------------------
+    def allow(self):
+        '''
+        May the call be done now
+        '''
+        self._lock.acquire()
+        try:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.time() >= self._retryAt:
+                self.state = HALF_OPEN
+                return True
+            self.rejected += 1
+            return False
+        finally:
+            self._lock.release()
+
+    #--------------------------------------------------------------------------
+    def success(self):
+        if self.state == CLOSED and not self.failures:
+            return
+        self._lock.acquire()
+        self.state    = CLOSED
+        self.failures = 0
+        self._timeout = self.retryTimeout
+        self._lock.release()
+
+    #--------------------------------------------------------------------------
+    def failure(self):
+        self._lock.acquire()
+        try:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failureThreshold:
+                if self.state != OPEN:
+                    self.opened += 1
+                self.state    = OPEN
+                self._retryAt = time.time() + self._timeout
+                self._timeout = min(self._timeout * self.backoff,
+                                    self.maxRetryTimeout)
+        finally:
+            self._lock.release()
+
+    #--------------------------------------------------------------------------
+    def call(self, function, *args, **kwargs):
+        '''
+        Call function through the breaker, any exception is a failure
+        '''
+        if not self.allow():
+            raise CircuitOpen('Service [%s] is down' % self.name)
+        try:
+            result = function(*args, **kwargs)
+        except:
+            self.failure()
+            raise
+        self.success()
+        return result
+
+    #--------------------------------------------------------------------------
+    def getStats(self):
+        return {
+            'state'    : self.state,
+            'failures' : self.failures,
+            'rejected' : self.rejected,
+            'opened'   : self.opened,
+            'retry_in' : max(0, self._retryAt - time.time())
+                         if self.state == OPEN else 0,
+        }
+
+#==============================================================================
+class LivenessChecker:
+    '''
+    Pings service in a thread every interval seconds and keeps the result,
+    so requests check cached state instead of probing. Results are fed to
+    the breaker - while it is open pings follow its backoff
+    '''
+    #--------------------------------------------------------------------------
+    def __init__(self, name, ping, interval=5, breaker=None):
+        self.name     = name
+        self.ping     = ping
+        self.interval = interval
+        self.breaker  = breaker or CircuitBreaker(name)
+
+        self.healthy  = True
+        self.checks   = 0
+        self.lastCheck = 0
+        self.lastError = None
+
+        self._loop     = None
+        self._checking = False
+
+    #--------------------------------------------------------------------------
+    def start(self):
+        if self._loop is None:
+            self._loop = task.LoopingCall(self.check)
+            self._loop.start(self.interval, now=True)
+
+    #--------------------------------------------------------------------------
+    def stop(self):
+        if self._loop is not None:
+            self._loop.stop()
+            self._loop = None
+
+    #--------------------------------------------------------------------------
+    def isRunning(self):
+        return self._loop is not None
+
+    #--------------------------------------------------------------------------
+    def check(self):
+        if self._checking or not self.breaker.allow():
+            return
+        self._checking = True
+        deferred = threads.deferToThread(self.ping)
+        deferred.addCallbacks(self._alive, self._dead)
+
+    #--------------------------------------------------------------------------
+    def _alive(self, result):
+        self._checking = False
+        self.checks   += 1
+        self.lastCheck = time.time()
+        self.healthy   = True
+        self.breaker.success()
+
+    #--------------------------------------------------------------------------
+    def _dead(self, reason):
+        self._checking = False
+        self.checks   += 1
+        self.lastCheck = time.time()
+        self.healthy   = False
+        self.lastError = reason.getErrorMessage()
+        self.breaker.failure()
+
+    #--------------------------------------------------------------------------
+    def getStats(self):
+        stats = self.breaker.getStats()
+        stats.update({
+            'healthy'    : self.healthy,
+            'checks'     : self.checks,
+            'last_check' : self.lastCheck,
+            'last_error' : self.lastError,
+        })
+        return stats
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+'''
+Content-Encoding negotiation and compression of HTTP responses
+'''
+import zlib
+
+# preferred first
+ENCODINGS = ('gzip', 'deflate')
+
+COMPRESS_LEVEL  = 6
+COMPRESS_MIN    = 1024        # bytes, smaller bodies are sent as is
+COMPRESS_THREAD = 64 * 1024   # bytes, larger bodies are compressed in thread
+
+#==============================================================================
+def parseAcceptEncoding(header):
+    '''
+    'gzip;q=0.8, deflate' to {'gzip' : 0.8, 'deflate' : 1.0}
+    '''
+    result = {}
+    for item in header.split(','):
+        parts = item.strip().split(';')
+        coding = parts[0].strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in parts[1:]:
+            name, _, value = param.strip().partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        result[coding] = quality
+    return result
+
+#==============================================================================
+def negotiate(header):
+    '''
+    Best supported encoding of Accept-Encoding header, None - identity
+    '''
+    if not header:
+        return None
+    accepted = parseAcceptEncoding(header)
+    best, bestQuality = None, 0.0
+    for encoding in ENCODINGS:
+        quality = accepted.get(encoding, accepted.get('*', 0.0))
+        if quality > bestQuality:
+            best, bestQuality = encoding, quality
+    return best
+
+#==============================================================================
+def compress(body, encoding, level=COMPRESS_LEVEL):
+    '''
+    Body in gzip or deflate (zlib stream, as HTTP defines it) format.
+    zlib releases GIL - may be called from thread
+    '''
+    if encoding == 'gzip':
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return compressor.compress(body) + compressor.flush()
+    if encoding == 'deflate':
+        return zlib.compress(body, level)
+    raise ValueError('Unknown content encoding [%s]' % encoding)
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+'''
+JSON encoders of responses
+
+Every encoder returns UTF-8 str and encodes datetime/date/time as ISO
+string, Decimal as number and UTF-8 bytearray/buffer as string - other
+bytes raise TypeError. Other unknown objects are null, as with old
+dthandler. Backends:
+    json       - stdlib, non-ASCII characters as is. Python 2 json has
+                 no C encoder of such strings - it is the slowest one
+    json-ascii - stdlib, non-ASCII characters escaped - strings are
+                 encoded by C speedups (4-5 times faster than json),
+                 output of non-latin text is larger, opt-in only
+    simplejson - C accelerated, non-ASCII as is, Decimal is exact
+    auto       - simplejson if its speedups are installed, else json -
+                 output keeps non-ASCII text as is with both
+'''
+import json
+import decimal
+import datetime
+
+AUTO_BACKENDS = ('simplejson', 'json')
+
+_encoders = {}
+
+#==============================================================================
+def encodeDefault(obj):
+    '''
+    Value of object json can not encode
+    '''
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    if isinstance(obj, (bytearray, buffer)):
+        data = str(obj)
+        try:
+            data.decode('utf-8')
+            return data
+        except UnicodeDecodeError:
+            raise TypeError('Bytes of %s are not UTF-8 text' % type(obj).__name__)
+    return None
+
+#==============================================================================
+class JsonEncoder:
+    name = 'json'
+    ensure_ascii = False
+
+    #--------------------------------------------------------------------------
+    def __init__(self):
+        self._encode = json.JSONEncoder(ensure_ascii=self.ensure_ascii,
+                                        default=encodeDefault).encode
+        # json joins str and unicode parts as ascii - UTF-8 str values
+        # mixed with unicode ones are encoded by escaping encoder
+        self._escaped = json.JSONEncoder(ensure_ascii=True,
+                                         default=encodeDefault).encode
+
+    #--------------------------------------------------------------------------
+    def encode(self, data):
+        try:
+            result = self._encode(data)
+        except UnicodeDecodeError:
+            return self._escaped(data)
+        if isinstance(result, unicode):
+            result = result.encode('utf-8')
+        return result
+
+#==============================================================================
+class AsciiJsonEncoder(JsonEncoder):
+    name = 'json-ascii'
+    ensure_ascii = True
+
+#==============================================================================
+class SimpleJsonEncoder(JsonEncoder):
+    name = 'simplejson'
+
+    #--------------------------------------------------------------------------
+    def __init__(self):
+        import simplejson
+        self._encode = simplejson.JSONEncoder(ensure_ascii=False,
+                            default=encodeDefault, use_decimal=True).encode
+        self._escaped = simplejson.JSONEncoder(ensure_ascii=True,
+                            default=encodeDefault, use_decimal=True).encode
+
+    #--------------------------------------------------------------------------
+    @staticmethod
+    def isAccelerated():
+        try:
+            from simplejson import _speedups
+        except ImportError:
+            return False
+        return True
+
+BACKENDS = {
+    'json'       : JsonEncoder,
+    'json-ascii' : AsciiJsonEncoder,
+    'simplejson' : SimpleJsonEncoder,
+}
+
+#==============================================================================
+def getAvailable():
+    '''
+    Names of backends which can be used here
+    '''
+    names = ['json', 'json-ascii']
+    if SimpleJsonEncoder.isAccelerated():
+        names.append('simplejson')
+    return names
+
+#==============================================================================
+def getEncoder(name='auto'):
+    '''
+    Shared encoder of backend - ValueError for unknown or missed one
+    '''
+    encoder = _encoders.get(name)
+    if encoder is None:
+        if name == 'auto':
+            available = getAvailable()
+            encoder = getEncoder([backend for backend in AUTO_BACKENDS
+                                  if backend in available][0])
+        elif name in BACKENDS:
+            try:
+                encoder = BACKENDS[name]()
+            except ImportError, ex:
+                raise ValueError('JSON encoder [%s] is not installed: %s' % (name, ex))
+        else:
+            raise ValueError('Unknown JSON encoder [%s]' % name)
+        _encoders[name] = encoder
+    return encoder
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+'''
+Ketama consistent hashing of cache keys to memcache nodes
+
+Every node is placed on the ring in `points` points, key belongs to the
+first node clockwise from its hash - adding or removing one of N nodes
+moves about 1/N of keys. Keys of ejected (dead) node go to the next
+live node on the ring until it is retried.
+'''
+import time
+import struct
+import hashlib
+from bisect import bisect
+
+DEFAULT_POINTS = 160
+DEFAULT_RETRY  = 30
+
+#==============================================================================
+def parseServers(servers):
+    '''
+    'host1:11211, host2:11211' to list of addresses
+    '''
+    return [server.strip() for server in servers.split(',') if server.strip()]
+
+#==============================================================================
+def _hash(value):
+    return struct.unpack('<I', hashlib.md5(value).digest()[0:4])[0]
+
+#==============================================================================
+class ClusterNode:
+    '''
+    Node of cluster: ejection state and hit/miss/latency counters
+    '''
+    #--------------------------------------------------------------------------
+    def __init__(self, name, retry=DEFAULT_RETRY):
+        self.name  = name
+        self.retry = retry
+
+        self.deadUntil = 0
+
+        self.calls     = 0
+        self.hits      = 0
+        self.misses    = 0
+        self.errors    = 0
+        self.ejections = 0
+        self.time      = 0.0
+        self.maxTime   = 0.0
+
+    #--------------------------------------------------------------------------
+    def isAvailable(self):
+        return self.deadUntil <= time.time()
+
+    #--------------------------------------------------------------------------
+    def eject(self):
+        '''
+        Node is dead - skip it for retry seconds. Values it keeps may be
+        stale on return (keys were written to other nodes meanwhile): they
+        live at most their expire, and tag generation going back is
+        detected by FastMemcachedServer. Node is never flushed - one
+        process error must not wipe data of all processes
+        '''
+        if self.isAvailable():
+            self.ejections += 1
+        self.errors    += 1
+        self.deadUntil  = time.time() + self.retry
+
+    #--------------------------------------------------------------------------
+    def record(self, spent, hits=0, misses=0):
+        self.calls  += 1
+        self.time   += spent
+        self.hits   += hits
+        self.misses += misses
+        if spent > self.maxTime:
+            self.maxTime = spent
+
+    #--------------------------------------------------------------------------
+    def getStats(self):
+        calls = self.calls or 1
+        gets  = (self.hits + self.misses) or 1
+        return {
+            'available' : self.isAvailable(),
+            'calls'     : self.calls,
+            'hits'      : self.hits,
+            'misses'    : self.misses,
+            'hit_rate'  : float(self.hits) / gets,
+            'errors'    : self.errors,
+            'ejections' : self.ejections,
+            'avg_time'  : self.time / calls,
+            'max_time'  : self.maxTime,
+        }
+
+#==============================================================================
+class HashRing:
+    '''
+    Ring of ClusterNode objects
+    '''
+    #--------------------------------------------------------------------------
+    def __init__(self, nodes, points=DEFAULT_POINTS):
+        self.nodes = nodes
+        ring = []
+        for node in nodes:
+            for i in range(points / 4):
+                digest = hashlib.md5('%s-%s' % (node.name, i)).digest()
+                for j in range(4):
+                    point = struct.unpack('<I', digest[j * 4:j * 4 + 4])[0]
+                    ring.append((point, node))
+        ring.sort(key=lambda item: item[0])
+        self._points = [point for point, node in ring]
+        self._nodes  = [node for point, node in ring]
+
+    #--------------------------------------------------------------------------
+    def getNode(self, key):
+        '''
+        Live node of key, None if all nodes are ejected
+        '''
+        if len(self.nodes) == 1:
+            node = self.nodes[0]
+            return node if node.isAvailable() else None
+
+        count = len(self._points)
+        index = bisect(self._points, _hash(key))
+        for i in range(count):
+            node = self._nodes[(index + i) % count]
+            if node.isAvailable():
+                return node
+        return None
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+'''
+Concurrency cap with bounded wait queue for request handlers
+'''
+from twisted.internet import defer
+
+#==============================================================================
+class RequestLimiter:
+    '''
+    At most limit handlers run at once, at most queueSize requests wait
+    for their turn - request over it is rejected at once instead of
+    waiting with growing latency. Reactor thread only
+    '''
+    #--------------------------------------------------------------------------
+    def __init__(self, name, limit, queueSize=100):
+        self.name      = name
+        self.limit     = limit
+        self.queueSize = queueSize
+        self._semaphore = defer.DeferredSemaphore(limit)
+
+        # admitted requests not passed to run yet
+        self._admitted = 0
+        # handlers running over limit lowered by resize
+        self._excess   = 0
+
+        self.accepted  = 0
+        self.rejected  = 0
+        self.maxQueued = 0
+
+    #--------------------------------------------------------------------------
+    def getRunning(self):
+        return self.limit - self._semaphore.tokens + self._excess
+
+    #--------------------------------------------------------------------------
+    def getQueued(self):
+        return len(self._semaphore.waiting) + self._admitted
+
+    #--------------------------------------------------------------------------
+    def admit(self):
+        '''
+        Reserve place for request - False if all handlers are busy and
+        queue is full. Admitted request must be passed to run
+        '''
+        if self.getRunning() + self.getQueued() >= self.limit + self.queueSize:
+            self.rejected += 1
+            return False
+        self._admitted += 1
+        self.accepted  += 1
+        return True
+
+    #--------------------------------------------------------------------------
+    def run(self, function, *args, **kwargs):
+        '''
+        Deferred of function result - function is called when there is
+        free place, it may return Deferred
+        '''
+        self._admitted -= 1
+        deferred = self._semaphore.acquire()
+        deferred.addCallback(lambda semaphore: 
+                             defer.maybeDeferred(function, *args, **kwargs))
+        deferred.addBoth(self._release)
+        queued = len(self._semaphore.waiting)
+        if queued > self.maxQueued:
+            self.maxQueued = queued
+        return deferred
+
+    #--------------------------------------------------------------------------
+    def _release(self, result):
+        if self._excess:
+            self._excess -= 1
+        else:
+            self._semaphore.release()
+        return result
+
+    #--------------------------------------------------------------------------
+    def resize(self, limit, queueSize):
+        '''
+        New limits for config reload - running handlers are not stopped,
+        with lower limit new ones wait until enough of them end
+        '''
+        semaphore = self._semaphore
+        delta = limit - self.limit
+        if delta < 0:
+            # free tokens are taken, the rest is returned by running handlers
+            taken = min(semaphore.tokens, -delta)
+            semaphore.tokens -= taken
+            self._excess     += -delta - taken
+        else:
+            returned = min(self._excess, delta)
+            self._excess     -= returned
+            semaphore.tokens += delta - returned
+        semaphore.limit = limit
+        self.limit      = limit
+        self.queueSize  = queueSize
+        while semaphore.waiting and semaphore.tokens > 0:
+            semaphore.tokens -= 1
+            semaphore.waiting.pop(0).callback(semaphore)
+
+    #--------------------------------------------------------------------------
+    def getStats(self):
+        return {
+            'limit'      : self.limit,
+            'queue_size' : self.queueSize,
+            'running'    : self.getRunning(),
+            'queued'     : self.getQueued(),
+            'max_queued' : self.maxQueued,
+            'accepted'   : self.accepted,
+            'rejected'   : self.rejected,
+        }
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+'''
+Non-blocking log writer
+
+Records are pushed to a bounded in-memory queue and written to disk by
+a background thread, so a slow disk never stalls the reactor thread.
+'''
+import os
+import sys
+import time
+import glob
+import gzip
+import shutil
+import logging
+import threading
+import Queue
+
+ROTATE_WHEN = {
+    'S'        : 1,
+    'M'        : 60,
+    'H'        : 60 * 60,
+    'D'        : 60 * 60 * 24,
+    'midnight' : 60 * 60 * 24,
+}
+
+_STOP = object()
+
+#==============================================================================
+class QueuedLogWriter(logging.Handler):
+    '''
+    logging.Handler with a bounded queue drained by a writer thread
+
+    - records are batched: one write() + flush() per batch
+    - file is rotated by size (maxBytes) and/or by time (when)
+    - rotated files are gzipped by a separate thread
+    - records that do not fit into the queue are dropped and counted
+    '''
+    #--------------------------------------------------------------------------
+    def __init__(self, filename, maxBytes=0, when=None, backupCount=5,
+                 queueSize=10000, batchSize=256, flushInterval=0.5,
+                 compress=True):
+        logging.Handler.__init__(self)
+        self.filename      = os.path.abspath(filename)
+        self.maxBytes      = maxBytes
+        self.when          = when
+        self.backupCount   = backupCount
+        self.queueSize     = queueSize
+        self.batchSize     = batchSize
+        self.flushInterval = flushInterval
+        self.compress      = compress
+
+        self.dropped   = 0
+        self.written   = 0
+        self.rotations = 0
+        self._reported = 0
+
+        self._stream     = None
+        self._rolloverAt = None
+        self._statLock   = threading.Lock()
+        self._pid        = None
+        self._startThreads()
+
+    #--------------------------------------------------------------------------
+    def _startThreads(self):
+        '''
+        Start writer and compressor threads (again after fork)
+        '''
+        self._pid        = os.getpid()
+        self._queue      = Queue.Queue(self.queueSize)
+        self._compressQ  = Queue.Queue()
+
+        self._writer = threading.Thread(target=self._writeLoop,
+                                        name='log-writer')
+        self._writer.setDaemon(True)
+        self._writer.start()
+
+        self._compressor = threading.Thread(target=self._compressLoop,
+                                            name='log-compressor')
+        self._compressor.setDaemon(True)
+        self._compressor.start()
+
+    #--------------------------------------------------------------------------
+    def emit(self, record):
+        '''
+        Put record to the queue - never blocks
+        '''
+        if self._pid != os.getpid():
+            # forked child does not inherit threads
+            self._startThreads()
+        try:
+            self._queue.put_nowait(record)
+        except Queue.Full:
+            self._statLock.acquire()
+            self.dropped += 1
+            self._statLock.release()
+
+    #--------------------------------------------------------------------------
+    def getStats(self):
+        '''
+        Counters of the writer
+        '''
+        return {
+            'queued'    : self._queue.qsize(),
+            'dropped'   : self.dropped,
+            'written'   : self.written,
+            'rotations' : self.rotations,
+        }
+
+    #--------------------------------------------------------------------------
+    def close(self):
+        '''
+        Flush queued records and stop threads. Compression of large rotated
+        file is not waited for - the file is left uncompressed then
+        '''
+        if self._pid == os.getpid() and self._writer.isAlive():
+            self._queue.put(_STOP)
+            self._writer.join(self.flushInterval * 10)
+            self._compressQ.put(_STOP)
+            self._compressor.join(self.flushInterval * 10)
+        logging.Handler.close(self)
+
+    #--------------------------------------------------------------------------
+    def _writeLoop(self):
+        '''
+        Writer thread: take a batch from the queue and write it at once
+        '''
+        stop = False
+        while not stop:
+            try:
+                batch = [self._queue.get(True, self.flushInterval)]
+            except Queue.Empty:
+                batch = []
+
+            while batch and len(batch) < self.batchSize:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except Queue.Empty:
+                    break
+
+            if _STOP in batch:
+                batch.remove(_STOP)
+                stop = True
+
+            try:
+                self._writeBatch(batch)
+            except Exception:
+                self.handleError(None)
+
+        if self._stream:
+            self._stream.close()
+            self._stream = None
+
+    #--------------------------------------------------------------------------
+    def _writeBatch(self, batch):
+        lines = []
+        for record in batch:
+            try:
+                lines.append(self._formatRecord(record))
+            except Exception:
+                self.handleError(record)
+
+        dropped = self.dropped
+        if dropped != self._reported:
+            lines.append('%s WARNING log queue overflow - dropped %s records\n'
+                         % (time.strftime('%Y-%m-%d %H:%M:%S'),
+                            dropped - self._reported))
+            self._reported = dropped
+
+        if not lines:
+            return
+
+        if self._shouldRollover():
+            self._doRollover()
+
+        stream = self._openStream()
+        stream.write(''.join(lines))
+        stream.flush()
+        self.written += len(lines)
+
+    #--------------------------------------------------------------------------
+    def _formatRecord(self, record):
+        msg = self.format(record)
+        if isinstance(msg, unicode):
+            msg = msg.encode('utf-8')
+        return msg + '\n'
+
+    #--------------------------------------------------------------------------
+    def _openStream(self):
+        if self._stream is None:
+            dirname = os.path.dirname(self.filename)
+            if not os.path.exists(dirname):
+                os.makedirs(dirname)
+            self._stream = open(self.filename, 'a')
+            self._rolloverAt = self._computeRollover(time.time())
+        return self._stream
+
+    #--------------------------------------------------------------------------
+    def _computeRollover(self, now):
+        if not self.when:
+            return None
+        if self.when == 'midnight':
+            t = time.localtime(now)
+            passed = t.tm_hour * 3600 + t.tm_min * 60 + t.tm_sec
+            return now - passed + ROTATE_WHEN['midnight']
+        return now + ROTATE_WHEN[self.when]
+
+    #--------------------------------------------------------------------------
+    def _shouldRollover(self):
+        if self._stream is None:
+            return False
+        if self.maxBytes > 0 and self._stream.tell() >= self.maxBytes:
+            return True
+        if self._rolloverAt is not None and time.time() >= self._rolloverAt:
+            return True
+        return False
+
+    #--------------------------------------------------------------------------
+    def _doRollover(self):
+        '''
+        Rename current file to timestamped name - compression is done
+        by the compressor thread
+        '''
+        self._stream.close()
+        self._stream = None
+
+        name = '%s.%s' % (self.filename, time.strftime('%Y%m%d-%H%M%S'))
+        suffix = 0
+        rotated = name
+        while os.path.exists(rotated) or os.path.exists(rotated + '.gz'):
+            suffix += 1
+            rotated = '%s.%s' % (name, suffix)
+
+        if os.path.exists(self.filename):
+            os.rename(self.filename, rotated)
+            self.rotations += 1
+            self._compressQ.put(rotated)
+
+    #--------------------------------------------------------------------------
+    def _compressLoop(self):
+        '''
+        Compressor thread: gzip rotated files and remove the old ones.
+        Archive is renamed when it is complete - thread stopped by exit
+        leaves rotated file as is
+        '''
+        while True:
+            name = self._compressQ.get()
+            if name is _STOP:
+                return
+            try:
+                if self.compress:
+                    src = open(name, 'rb')
+                    dst = gzip.open(name + '.gz.part', 'wb')
+                    shutil.copyfileobj(src, dst)
+                    dst.close()
+                    src.close()
+                    os.rename(name + '.gz.part', name + '.gz')
+                    os.remove(name)
+                self._removeOld()
+            except Exception:
+                self.handleError(None)
+
+    #--------------------------------------------------------------------------
+    def _removeOld(self):
+        if self.backupCount <= 0:
+            return
+        files = glob.glob(self.filename + '.*')
+        files.sort(key=os.path.getmtime)
+        for name in files[:-self.backupCount]:
+            os.remove(name)
+
+    #--------------------------------------------------------------------------
+    def handleError(self, record):
+        if logging.raiseExceptions:
+            sys.stderr.write('Log writer error: %s\n' % (sys.exc_info()[1],))
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+'''
+In-process LRU cache with per entry TTL
+'''
+import time
+import threading
+import cPickle as pickle
+from collections import OrderedDict
+
+#==============================================================================
+def estimateSize(value):
+    '''
+    Approximate memory used by value - length of its pickle
+    '''
+    try:
+        return len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return 1024
+
+#==============================================================================
+class LRUCache:
+    '''
+    Least recently used cache bounded by number of entries and/or total
+    size of values. Values are returned as is (not copied) - do not
+    modify them.
+    '''
+    #--------------------------------------------------------------------------
+    def __init__(self, maxEntries=10000, maxBytes=0, expire=60, sizeof=estimateSize):
+        self.maxEntries = maxEntries
+        self.maxBytes   = maxBytes
+        self.expire     = expire
+        self.sizeof     = sizeof
+
+        self.hits      = 0
+        self.misses    = 0
+        self.evictions = 0
+        self.expired   = 0
+        self.bytes     = 0
+
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    #--------------------------------------------------------------------------
+    def __len__(self):
+        return len(self._data)
+
+    #--------------------------------------------------------------------------
+    def __contains__(self, key):
+        entry = self._data.get(key)
+        return entry is not None and entry[0] > time.time()
+
+    #--------------------------------------------------------------------------
+    def get(self, key, default=None):
+        '''
+        Get value and mark it as recently used
+        '''
+        self._lock.acquire()
+        try:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            if entry[0] <= time.time():
+                self.bytes   -= entry[2]
+                self.expired += 1
+                self.misses  += 1
+                return default
+
+            self._data[key] = entry
+            self.hits += 1
+            return entry[1]
+        finally:
+            self._lock.release()
+
+    #--------------------------------------------------------------------------
+    def set(self, key, value, expire=None):
+        '''
+        Store value for expire seconds (but no longer than cache expire)
+        '''
+        if expire is None or expire <= 0 or expire > self.expire:
+            expire = self.expire
+        if self.maxBytes:
+            size = self.sizeof(value)
+            if size > self.maxBytes:
+                self.delete(key)
+                return False
+        else:
+            size = 0
+
+        self._lock.acquire()
+        try:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.bytes -= old[2]
+            self._data[key] = (time.time() + expire, value, size)
+            self.bytes += size
+            self._evict()
+        finally:
+            self._lock.release()
+        return True
+
+    #--------------------------------------------------------------------------
+    def delete(self, key):
+        self._lock.acquire()
+        try:
+            entry = self._data.pop(key, None)
+            if entry is not None:
+                self.bytes -= entry[2]
+        finally:
+            self._lock.release()
+
+    #--------------------------------------------------------------------------
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._data.clear()
+            self.bytes = 0
+        finally:
+            self._lock.release()
+
+    #--------------------------------------------------------------------------
+    def _evict(self):
+        '''
+        Drop least recently used entries until cache fits its bounds
+        '''
+        data = self._data
+        while data and (len(data) > self.maxEntries or
+                        (self.maxBytes and self.bytes > self.maxBytes)):
+            key, entry = data.popitem(last=False)
+            self.bytes -= entry[2]
+            self.evictions += 1
+
+    #--------------------------------------------------------------------------
+    def getStats(self):
+        '''
+        Counters of the cache
+        '''
+        return {
+            'entries'   : len(self._data),
+            'bytes'     : self.bytes,
+            'hits'      : self.hits,
+            'misses'    : self.misses,
+            'evictions' : self.evictions,
+            'expired'   : self.expired,
+        }
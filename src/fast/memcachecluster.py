@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+'''
+Blocking memcache client over several servers
+'''
+import time
+
+import memcache
+
+from ketama import ClusterNode, HashRing, parseServers, DEFAULT_RETRY
+
+#==============================================================================
+class MemcacheNode(ClusterNode):
+    '''
+    One server with its own python-memcache client
+    '''
+    #--------------------------------------------------------------------------
+    def __init__(self, name, retry=DEFAULT_RETRY, debug=0):
+        ClusterNode.__init__(self, name, retry)
+        # retry is done by the cluster - client tries server on every call
+        self.client = memcache.Client([name], debug=debug, dead_retry=0)
+
+    #--------------------------------------------------------------------------
+    def call(self, method, *args):
+        '''
+        python-memcache does not raise on dead server - it marks it dead
+        and returns empty result
+        '''
+        started = time.time()
+        result  = getattr(self.client, method)(*args)
+        self.record(time.time() - started)
+        server = self.client.servers[0]
+        if server.deaduntil:
+            server.deaduntil = 0
+            self.eject()
+        return result
+
+#==============================================================================
+class MemcacheCluster:
+    '''
+    Interface of memcache.Client (get, get_multi, set, add, replace, incr,
+    delete, get_stats) for comma separated servers with ketama hashing.
+    Dead server is ejected for retry seconds
+    '''
+    #--------------------------------------------------------------------------
+    def __init__(self, servers, retry=DEFAULT_RETRY, debug=0):
+        if isinstance(servers, basestring):
+            servers = parseServers(servers)
+        self.servers = servers
+        self.nodes   = [MemcacheNode(server, retry, debug) for server in servers]
+        self.ring    = HashRing(self.nodes)
+
+    #--------------------------------------------------------------------------
+    def __repr__(self):
+        return '<MemcacheCluster %s>' % ', '.join(self.servers)
+
+    #--------------------------------------------------------------------------
+    def _node(self, key):
+        return self.ring.getNode(key)
+
+    #--------------------------------------------------------------------------
+    def get(self, key):
+        node = self._node(key)
+        if node is None:
+            return None
+        value = node.call('get', key)
+        if value is None:
+            node.misses += 1
+        else:
+            node.hits += 1
+        return value
+
+    #--------------------------------------------------------------------------
+    def get_multi(self, keys):
+        byNode = {}
+        for key in keys:
+            node = self._node(key)
+            if node is not None:
+                byNode.setdefault(node, []).append(key)
+
+        result = {}
+        for node, nodeKeys in byNode.items():
+            found = node.call('get_multi', nodeKeys)
+            node.hits   += len(found)
+            node.misses += len(nodeKeys) - len(found)
+            result.update(found)
+        return result
+
+    #--------------------------------------------------------------------------
+    def _store(self, method, key, *args):
+        node = self._node(key)
+        if node is None:
+            return 0
+        return node.call(method, key, *args)
+
+    #--------------------------------------------------------------------------
+    def set(self, key, value, time=0):
+        return self._store('set', key, value, time)
+
+    #--------------------------------------------------------------------------
+    def add(self, key, value, time=0):
+        return self._store('add', key, value, time)
+
+    #--------------------------------------------------------------------------
+    def replace(self, key, value, time=0):
+        return self._store('replace', key, value, time)
+
+    #--------------------------------------------------------------------------
+    def delete(self, key):
+        return self._store('delete', key)
+
+    #--------------------------------------------------------------------------
+    def incr(self, key, delta=1):
+        node = self._node(key)
+        if node is None:
+            return None
+        return node.call('incr', key, delta)
+
+    #--------------------------------------------------------------------------
+    def get_stats(self):
+        '''
+        Server stats of live nodes
+        '''
+        stats = []
+        for node in self.nodes:
+            if node.isAvailable():
+                stats.extend(node.call('get_stats'))
+        return stats
+
+    #--------------------------------------------------------------------------
+    def getStats(self):
+        '''
+        Hit/miss, latency and ejection counters per node
+        '''
+        return dict((node.name, node.getStats()) for node in self.nodes)
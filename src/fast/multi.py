@@ -3,6 +3,8 @@ import os
 from signal import SIGTERM
 
 from core import FastConfigObject, FastDbObject
+from func import method_exists
+from sharedcache import SharedCache, setSharedCache
 
     
     
@@ -12,6 +14,7 @@ class WorkerMultiprocessServer(FastConfigObject):
     
     name = 'monitord-worker'
     gearman_server = None
+    shared         = None
 
     logging      = True    
     
@@ -19,6 +22,7 @@ class WorkerMultiprocessServer(FastConfigObject):
     def __init__(self):
         FastConfigObject.__init__(self)
         self.loadConfig()
+        self.installReloadHandler()
     
     #--------------------------------------------------------------------------
     def start(self):
@@ -56,6 +60,7 @@ class WorkerMultiprocessServer(FastConfigObject):
             self._log('Apply config...')
             self.config = new_config
             self.gearman_server = self.config.get('main', 'gearman_server') 
+            self.publishShared()
 
         except Exception, ex:
             self._error('Unable to load config: [%s]' % ex)
@@ -65,6 +70,26 @@ class WorkerMultiprocessServer(FastConfigObject):
                 self._error('Unable to validate config - using old one [%s]' % ex)            
             raise
         
+    #--------------------------------------------------------------------------
+    def publishShared(self):
+        '''
+        Publish getSharedData() dict to workers. [shared] size MB of shared
+        memory is allocated on first call - it must be done before workers
+        are forked, size change needs restart. One generation of data takes
+        at most half of size
+        '''
+        if not method_exists(self, 'getSharedData'):
+            return
+        if self.shared is None:
+            size = self.getConfigOption('shared', 'size', 16, int) * 1024 * 1024
+            self.shared = SharedCache(size)
+            setSharedCache(self.shared)
+        try:
+            generation = self.shared.publish(self.getSharedData())
+            self._log('Published shared data [generation %s]' % generation)
+        except Exception, ex:
+            self._error('Unable to publish shared data - workers keep old one [%s]' % ex)
+        
 #==============================================================================    
 class WorkerMultiprocessDbServer(FastDbObject, WorkerMultiprocessServer):
     config_file  = 'monitord'
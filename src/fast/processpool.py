@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+'''
+Pre-started pool of processes for CPU-bound request handlers
+
+Threads do not help pure Python work because of GIL - handler is run in
+one of forked processes and its Deferred fires in reactor thread.
+Function must be module level (it is pickled by name), arguments and
+result must be picklable. Both are pickled with the highest protocol;
+payload of sharedMin bytes or more is passed through a file in tmpfs
+(/dev/shm) instead of the pool pipe, which is read by the single result
+thread of the pool. Files are named by job, so files of job which timed
+out are removed by the server.
+
+Processes are forked on pool creation - create it before reactor
+starts threads and connections (see FastServer.listen). Pool of Python
+2 never reports job of killed process (OOM, segfault) - Deferred of job
+not done in timeout seconds fails with ProcessTimeout.
+'''
+import os
+import glob
+import signal
+import logging
+import cPickle
+import tempfile
+import traceback
+import multiprocessing
+from functools import partial
+
+from twisted.internet import defer
+
+SHARED_MIN = 1024 * 1024   # bytes, larger payload goes through tmpfs
+SHARED_DIR = '/dev/shm'
+TIMEOUT    = 60            # seconds
+
+#==============================================================================
+class ProcessError(Exception):
+    '''
+    Handler failed in pool process - traceback is kept for log, it is
+    not a part of message
+    '''
+    #--------------------------------------------------------------------------
+    def __init__(self, message, traceback=''):
+        Exception.__init__(self, message)
+        self.traceback = traceback
+
+#==============================================================================
+class ProcessTimeout(ProcessError):
+    pass
+
+#==============================================================================
+def _getSharedDir():
+    if os.path.isdir(SHARED_DIR):
+        return SHARED_DIR
+    return tempfile.gettempdir()
+
+#==============================================================================
+def _dump(value, sharedMin, prefix):
+    '''
+    Pickled value, or (path,) of tmpfs file with it for large one
+    '''
+    data = cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL)
+    if sharedMin is None or len(data) < sharedMin:
+        return data
+    fd, path = tempfile.mkstemp(prefix=prefix, dir=_getSharedDir())
+    try:
+        view = buffer(data)
+        while view:
+            view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+    return (path,)
+
+#==============================================================================
+def _load(payload):
+    if isinstance(payload, tuple):
+        path = payload[0]
+        try:
+            with open(path, 'rb') as f:
+                payload = f.read()
+        finally:
+            os.unlink(path)
+    return cPickle.loads(payload)
+
+#==============================================================================
+def _initProcess():
+    '''
+    Signals are handled by the server process only. Logging locks may
+    be held by other thread of the server at fork - they are recreated
+    '''
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    logging._lock = logging.threading.RLock()
+    for handler in logging._handlerList:
+        handler = handler()
+        if handler is not None:
+            handler.createLock()
+
+#==============================================================================
+def _call(payload, sharedMin, prefix):
+    '''
+    Run in pool process - (True, result) or (False, (error, traceback)),
+    so the pool never has to pickle exception
+    '''
+    try:
+        function, args, kwargs = _load(payload)
+        return True, _dump(function(*args, **kwargs), sharedMin, prefix)
+    except Exception, ex:
+        return False, ('%s: %s' % (ex.__class__.__name__, ex),
+                       traceback.format_exc())
+
+#==============================================================================
+class ProcessPool:
+    '''
+    multiprocessing.Pool with Deferred results
+    '''
+    #--------------------------------------------------------------------------
+    def __init__(self, processes=None, sharedMin=SHARED_MIN, timeout=TIMEOUT):
+        self.processes = processes or multiprocessing.cpu_count()
+        self.sharedMin = sharedMin
+        self.timeout   = timeout
+        self._pool = multiprocessing.Pool(self.processes, _initProcess)
+
+        self.running  = 0
+        self.finished = 0
+        self.failed   = 0
+        self.timeouts = 0
+        self.shared   = 0
+        self._jobs    = 0
+
+    #--------------------------------------------------------------------------
+    def run(self, function, *args, **kwargs):
+        '''
+        Deferred of function(*args, **kwargs) called in pool process
+        '''
+        from twisted.internet import reactor
+        self._jobs += 1
+        prefix  = '%s%s-' % (self._getPrefix(), self._jobs)
+        payload = _dump((function, args, kwargs), self.sharedMin, prefix)
+        if isinstance(payload, tuple):
+            self.shared += 1
+        # [Deferred, timeout call, prefix of its tmpfs files]
+        job = [defer.Deferred(), None, prefix]
+        if self.timeout:
+            job[1] = reactor.callLater(self.timeout, self._timedOut, job)
+        self.running += 1
+        self._pool.apply_async(_call, (payload, self.sharedMin, prefix),
+                               callback=partial(self._done, job))
+        return job[0]
+
+    #--------------------------------------------------------------------------
+    def _done(self, job, result):
+        '''
+        Pool result thread - large result is read here, not in reactor
+        '''
+        from twisted.internet import reactor
+        success, value = result
+        shared = success and isinstance(value, tuple)
+        if success:
+            try:
+                value = _load(value)
+            except Exception, ex:
+                success, value = False, ('Unable to load result: %s' % ex, '')
+        reactor.callFromThread(self._fire, job, success, value, shared)
+
+    #--------------------------------------------------------------------------
+    def _fire(self, job, success, value, shared):
+        deferred, timeout = job[:2]
+        if shared:
+            self.shared += 1
+        if deferred.called:
+            # result came after timeout
+            return
+        if timeout is not None and timeout.active():
+            timeout.cancel()
+        self.running -= 1
+        if success:
+            self.finished += 1
+            deferred.callback(value)
+        else:
+            self.failed += 1
+            deferred.errback(ProcessError(*value))
+
+    #--------------------------------------------------------------------------
+    def _timedOut(self, job):
+        '''
+        Process of job died or job runs too long - it is not waited for,
+        its payload files are removed
+        '''
+        self.running  -= 1
+        self.timeouts += 1
+        self._removeFiles(job[2])
+        job[0].errback(ProcessTimeout('Job is not done in [%s] sec' % self.timeout))
+
+    #--------------------------------------------------------------------------
+    def _getPrefix(self):
+        return 'fast-pool-%s-' % os.getpid()
+
+    #--------------------------------------------------------------------------
+    def _removeFiles(self, prefix):
+        for path in glob.glob(os.path.join(_getSharedDir(), prefix + '*')):
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    #--------------------------------------------------------------------------
+    def stop(self):
+        self._pool.terminate()
+        self._pool.join()
+        self._removeFiles(self._getPrefix())
+
+    #--------------------------------------------------------------------------
+    def getStats(self):
+        return {
+            'processes' : self.processes,
+            'running'   : self.running,
+            'finished'  : self.finished,
+            'failed'    : self.failed,
+            'timeouts'  : self.timeouts,
+            'shared'    : self.shared,
+        }
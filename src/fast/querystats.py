@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+'''
+Per-statement timing of SQL queries aggregated by fingerprint
+'''
+import re
+import threading
+from collections import deque
+
+_COMMENTS     = re.compile(r'/\*.*?\*/|--[^\n]*', re.S)
+_STRINGS      = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"", re.S)
+_PLACEHOLDERS = re.compile(r'%\(\w+\)s|%s')
+_NUMBERS      = re.compile(r'\b\d+(?:\.\d+)?\b')
+_SPACES       = re.compile(r'\s+')
+_LISTS        = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_ROWS         = re.compile(r'(\(\?\+\)|\(\?\))(?:\s*,\s*\1)+')
+
+FINGERPRINT_CACHE_SIZE = 10000
+
+_fingerprints = {}
+
+#==============================================================================
+def fingerprint(sql):
+    '''
+    Normalized statement: literals and placeholders are replaced by ?,
+    lists and multi-row VALUES are collapsed, spaces and case unified
+        SELECT * FROM t WHERE id IN (1, 2, 3) -> select * from t where id in (?+)
+    '''
+    result = _fingerprints.get(sql)
+    if result is None:
+        result = _COMMENTS.sub(' ', sql)
+        result = _STRINGS.sub('?', result)
+        result = _PLACEHOLDERS.sub('?', result)
+        result = _NUMBERS.sub('?', result)
+        result = _SPACES.sub(' ', result).strip().lower()
+        result = _LISTS.sub('(?+)', result)
+        result = _ROWS.sub(r'\1+', result)
+        if len(_fingerprints) >= FINGERPRINT_CACHE_SIZE:
+            _fingerprints.clear()
+        _fingerprints[sql] = result
+    return result
+
+#==============================================================================
+def formatArgs(args, limit=1000):
+    '''
+    Bound args for log - long lists (executemany rows) are shortened
+    '''
+    if isinstance(args, list) and len(args) > 10:
+        text = '%r ... (%s rows)' % (args[:10], len(args))
+    else:
+        text = repr(args)
+    if len(text) > limit:
+        text = text[:limit] + '...'
+    return text
+
+#==============================================================================
+class QueryStats:
+    '''
+    Count, total/max time and rows per fingerprint. Percentiles are
+    computed from last maxSamples timings of every fingerprint, at most
+    maxFingerprints fingerprints are kept (new ones are counted as other)
+    '''
+    #--------------------------------------------------------------------------
+    def __init__(self, slowThreshold=1.0, maxSamples=1000, maxFingerprints=1000):
+        self.slowThreshold   = slowThreshold
+        self.maxSamples      = maxSamples
+        self.maxFingerprints = maxFingerprints
+        self._stats = {}
+        self._lock  = threading.Lock()
+
+    #--------------------------------------------------------------------------
+    def record(self, sql, spent, rows=None):
+        '''
+        Add statement timing, return True if statement is slow
+        '''
+        key = fingerprint(sql)
+        self._lock.acquire()
+        try:
+            stats = self._stats.get(key)
+            if stats is None:
+                if len(self._stats) >= self.maxFingerprints:
+                    key = 'other'
+                    stats = self._stats.get(key)
+                if stats is None:
+                    # [count, total, max, rows, slow, samples]
+                    stats = self._stats[key] = [0, 0.0, 0.0, 0, 0,
+                                                deque(maxlen=self.maxSamples)]
+            slow = spent >= self.slowThreshold
+            stats[0] += 1
+            stats[1] += spent
+            if spent > stats[2]:
+                stats[2] = spent
+            stats[3] += rows or 0
+            if slow:
+                stats[4] += 1
+            stats[5].append(spent)
+        finally:
+            self._lock.release()
+        return slow
+
+    #--------------------------------------------------------------------------
+    def getStats(self, top=None, order='total'):
+        '''
+        List of fingerprint stats ordered by order field, descending
+        '''
+        self._lock.acquire()
+        try:
+            items = [(key, list(stats[:5]), sorted(stats[5]))
+                     for key, stats in self._stats.items()]
+        finally:
+            self._lock.release()
+
+        result = []
+        for key, (count, total, longest, rows, slow), samples in items:
+            result.append({
+                'query' : key,
+                'count' : count,
+                'total' : total,
+                'avg'   : total / count,
+                'max'   : longest,
+                'p50'   : _percentile(samples, 0.50),
+                'p99'   : _percentile(samples, 0.99),
+                'rows'  : rows,
+                'slow'  : slow,
+            })
+        result.sort(key=lambda stats: stats[order], reverse=True)
+        if top:
+            result = result[:top]
+        return result
+
+    #--------------------------------------------------------------------------
+    def reset(self):
+        self._lock.acquire()
+        self._stats = {}
+        self._lock.release()
+
+#==============================================================================
+def _percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
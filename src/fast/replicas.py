@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+'''
+Read replicas of the primary database
+'''
+import time
+import threading
+
+#==============================================================================
+class Replica:
+    '''
+    One replica: connection pool plus health and lag state
+    '''
+    #--------------------------------------------------------------------------
+    def __init__(self, host, pool):
+        self.host    = host
+        self.pool    = pool
+        self.healthy = True
+        self.lag     = 0
+        self.checked = 0
+        self.reads   = 0
+        self.errors  = 0
+        self.error   = None
+        self.lock    = threading.Lock()
+
+    #--------------------------------------------------------------------------
+    def getStats(self):
+        return {
+            'healthy' : self.healthy,
+            'lag'     : self.lag,
+            'reads'   : self.reads,
+            'errors'  : self.errors,
+            'error'   : self.error,
+            'pool'    : self.pool.getStats(),
+        }
+
+#==============================================================================
+class ReplicaSet:
+    '''
+    Round robin choice of healthy replica with lag below maxLag seconds.
+    Replica state is re-checked (SHOW SLAVE STATUS) by the thread asking
+    for it once in checkInterval seconds. onError(replica, ex) is called
+    when check fails with new error - e.g. no REPLICATION CLIENT grant
+    '''
+    #--------------------------------------------------------------------------
+    def __init__(self, replicas, maxLag=30, checkInterval=10, onError=None):
+        self.replicas      = replicas
+        self.maxLag        = maxLag
+        self.checkInterval = checkInterval
+        self.onError       = onError
+        self._next = 0
+
+    #--------------------------------------------------------------------------
+    def __len__(self):
+        return len(self.replicas)
+
+    #--------------------------------------------------------------------------
+    def choose(self):
+        '''
+        Replica for the next read or None - read from primary
+        '''
+        count = len(self.replicas)
+        for i in range(count):
+            self._next = (self._next + 1) % count
+            replica = self.replicas[self._next]
+            self._check(replica)
+            if replica.healthy:
+                replica.reads += 1
+                return replica
+        return None
+
+    #--------------------------------------------------------------------------
+    def markFailed(self, replica):
+        '''
+        Read failed - exclude replica until next check
+        '''
+        replica.errors += 1
+        replica.healthy = False
+        replica.checked = time.time()
+
+    #--------------------------------------------------------------------------
+    def _check(self, replica):
+        if time.time() - replica.checked < self.checkInterval:
+            return
+        if not replica.lock.acquire(False):
+            # other thread is checking it
+            return
+        try:
+            replica.checked = time.time()
+            lag = self._getLag(replica)
+            replica.lag     = lag
+            replica.healthy = lag is not None and lag <= self.maxLag
+        finally:
+            replica.lock.release()
+
+    #--------------------------------------------------------------------------
+    def _getLag(self, replica):
+        '''
+        Seconds behind primary, None if replication or replica is broken
+        '''
+        try:
+            with replica.pool.connection(timeout=1) as db:
+                cursor = db.cursor()
+                try:
+                    cursor.execute('SHOW SLAVE STATUS')
+                    row = cursor.fetchone()
+                finally:
+                    cursor.close()
+        except Exception, ex:
+            error = '%s: %s' % (ex.__class__.__name__, ex)
+            if error != replica.error and self.onError is not None:
+                self.onError(replica, ex)
+            replica.error = error
+            return None
+        replica.error = None
+        if not row:
+            # not a replica of anything - up to date by definition
+            return 0
+        return row.get('Seconds_Behind_Master')
+
+    #--------------------------------------------------------------------------
+    def closeAll(self):
+        for replica in self.replicas:
+            replica.pool.closeAll()
+
+    #--------------------------------------------------------------------------
+    def getStats(self):
+        return dict((replica.host, replica.getStats())
+                    for replica in self.replicas)
@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+'''
+Read-mostly cache shared by forked worker processes
+
+Supervisor publishes dict of lookup data into anonymous shared mmap
+created before workers are forked - encoded data is kept once, in the
+same pages for all workers. Each worker decodes value on its first get
+in a generation and keeps decoded value until the next publish, so
+decoding is done once per key per generation per process. Returned
+values are shared by callers of the process - do not modify them.
+
+Map has header and two data slots. Publish writes new generation into
+the inactive slot and then switches slot pointer of header, so readers
+always have the full current generation and never wait for publish to
+finish. Header is guarded by seqlock: writer sets odd sequence, switches
+slot and sets next even one - reader takes slot only if it sees the same
+even sequence before and after. Each slot has own write sequence, odd
+while slot is written - reader which still uses generation of the slot
+which is overwritten by publish after the next one sees it changed and
+reloads current generation.
+
+Slot layout: write sequence, index length, marshal of
+{key : (offset, length)}, values encoded by cachecodec.
+'''
+import time
+import mmap
+import struct
+import marshal
+import threading
+
+import cachecodec
+
+DEFAULT_SIZE = 16 * 1024 * 1024
+READ_RETRIES = 100
+
+_HEADER = struct.Struct('<QQ')   # sequence, active slot
+_FIELD  = struct.Struct('<Q')    # field of header, write sequence of slot
+_INDEX  = struct.Struct('<I')
+
+_MISSING = object()
+_shared = None
+
+#==============================================================================
+class SharedCacheFull(Exception):
+    pass
+
+#==============================================================================
+class SharedCache:
+    '''
+    Fixed size shared memory map - one generation of data takes at most
+    half of size
+    '''
+    #--------------------------------------------------------------------------
+    def __init__(self, size=DEFAULT_SIZE):
+        self.size      = size
+        self.slotSize  = (size - _HEADER.size) // 2
+        self.dataSize  = self.slotSize - _FIELD.size
+        self._map      = mmap.mmap(-1, size)
+        self._lock     = threading.Lock()
+
+        # generation read by this process
+        self._sequence     = 0
+        self._slotStart    = 0
+        self._slotSequence = 0
+        self._dataStart    = 0
+        self._index        = {}
+        self._values       = {}
+        self._used         = 0
+
+        self.retries = 0
+
+    #--------------------------------------------------------------------------
+    def _getHeader(self):
+        return _HEADER.unpack_from(self._map, 0)
+
+    #--------------------------------------------------------------------------
+    def _getSlotStart(self, slot):
+        return _HEADER.size + slot * self.slotSize
+
+    #--------------------------------------------------------------------------
+    def _getSlotSequence(self, start):
+        return _FIELD.unpack_from(self._map, start)[0]
+
+    #--------------------------------------------------------------------------
+    def getGeneration(self):
+        '''
+        Number of completed publishes
+        '''
+        return self._getHeader()[0] // 2
+
+    #--------------------------------------------------------------------------
+    def publish(self, values):
+        '''
+        Write values as new generation - supervisor only. Raises
+        SharedCacheFull if they do not fit, old generation is kept then
+        '''
+        index = {}
+        parts = []
+        offset = 0
+        for key, value in values.items():
+            data = cachecodec.dumps(value)
+            index[key] = (offset, len(data))
+            parts.append(data)
+            offset += len(data)
+        indexData = marshal.dumps(index, 2)
+        data   = _INDEX.pack(len(indexData)) + indexData + ''.join(parts)
+        if len(data) > self.dataSize:
+            raise SharedCacheFull('Shared data [%s bytes] is over data size [%s bytes]' %
+                                  (len(data), self.dataSize))
+
+        self._lock.acquire()
+        try:
+            sequence, slot = self._getHeader()
+            # slot 0 is active before the first publish too - it is empty
+            slot = 1 - slot if sequence else 0
+            self._writeSlot(slot, data)
+            self._switchSlot(slot)
+        finally:
+            self._lock.release()
+        return self.getGeneration()
+
+    #--------------------------------------------------------------------------
+    def _writeSlot(self, slot, data):
+        '''
+        Write data into inactive slot
+        '''
+        start = self._getSlotStart(slot)
+        sequence = self._getSlotSequence(start)
+        _FIELD.pack_into(self._map, start, sequence + 1)
+        begin = start + _FIELD.size
+        self._map[begin:begin + len(data)] = data
+        _FIELD.pack_into(self._map, start, sequence + 2)
+
+    #--------------------------------------------------------------------------
+    def _switchSlot(self, slot):
+        '''
+        Make written slot active under seqlock of header
+        '''
+        sequence = self._getHeader()[0]
+        _FIELD.pack_into(self._map, 0, sequence + 1)
+        _FIELD.pack_into(self._map, _FIELD.size, slot)
+        _FIELD.pack_into(self._map, 0, sequence + 2)
+
+    #--------------------------------------------------------------------------
+    def _wait(self, attempt):
+        '''
+        Writer switches slot in few instructions - yield to it, sleep
+        only if it is descheduled in between
+        '''
+        self.retries += 1
+        time.sleep(0 if attempt < 10 else 0.001)
+
+    #--------------------------------------------------------------------------
+    def _loadGeneration(self, force=False):
+        '''
+        Load index of current generation if it is changed - index and
+        decoded values are kept per process, encoded values stay in
+        shared memory. False if generation can not be read now, loaded
+        one is kept then
+        '''
+        for attempt in range(READ_RETRIES):
+            sequence, slot = self._getHeader()
+            if sequence % 2 == 0 and self._getHeader()[0] == sequence:
+                if sequence == self._sequence and not force:
+                    return True
+                if sequence == 0:
+                    return True
+                if self._loadSlot(sequence, slot):
+                    return True
+            self._wait(attempt)
+        return False
+
+    #--------------------------------------------------------------------------
+    def _loadSlot(self, sequence, slot):
+        start = self._getSlotStart(slot)
+        slotSequence = self._getSlotSequence(start)
+        if slotSequence % 2:
+            # generation is replaced by publish after the next one
+            return False
+        begin  = start + _FIELD.size
+        length = _INDEX.unpack_from(self._map, begin)[0]
+        if length > self.dataSize - _INDEX.size:
+            return False
+        indexData = self._map[begin + _INDEX.size:begin + _INDEX.size + length]
+        if self._getSlotSequence(start) != slotSequence:
+            return False
+        self._sequence     = sequence
+        self._slotStart    = start
+        self._slotSequence = slotSequence
+        self._dataStart    = begin + _INDEX.size + length
+        self._index        = marshal.loads(indexData)
+        self._values       = {}
+        self._used         = length + _INDEX.size + \
+                    sum(size for offset, size in self._index.values())
+        return True
+
+    #--------------------------------------------------------------------------
+    def _readRaw(self, key):
+        '''
+        Encoded value of key in loaded generation, None if it is absent,
+        _MISSING if its slot is overwritten meanwhile
+        '''
+        entry = self._index.get(key)
+        if entry is None:
+            return None
+        start = self._dataStart + entry[0]
+        data = self._map[start:start + entry[1]]
+        if self._getSlotSequence(self._slotStart) != self._slotSequence:
+            return _MISSING
+        return data
+
+    #--------------------------------------------------------------------------
+    def getRaw(self, key):
+        '''
+        Encoded value of key, None if it is absent
+        '''
+        force = False
+        for attempt in range(READ_RETRIES):
+            self._loadGeneration(force)
+            data = self._readRaw(key)
+            if data is not _MISSING:
+                return data
+            force = True
+            self._wait(attempt)
+        return None
+
+    #--------------------------------------------------------------------------
+    def get(self, key, default=None):
+        '''
+        Decoded value - decoded once per generation in the process
+        '''
+        self._loadGeneration()
+        value = self._values.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        data = self.getRaw(key)
+        if data is None:
+            return default
+        value = cachecodec.loads(data)
+        self._values[key] = value
+        return value
+
+    #--------------------------------------------------------------------------
+    def keys(self):
+        self._loadGeneration()
+        return self._index.keys()
+
+    #--------------------------------------------------------------------------
+    def getStats(self):
+        self._loadGeneration()
+        return {
+            'generation' : self._sequence // 2,
+            'keys'       : len(self._index),
+            'decoded'    : len(self._values),
+            'used'       : self._used,
+            'data_size'  : self.dataSize,
+            'retries'    : self.retries,
+        }
+
+#==============================================================================
+def setSharedCache(cache):
+    '''
+    Cache of the process - set by supervisor before fork, inherited by
+    workers
+    '''
+    global _shared
+    _shared = cache
+
+#==============================================================================
+def getSharedCache():
+    return _shared
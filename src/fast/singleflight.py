@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+'''
+Single-flight: concurrent requests for the same key wait for one
+computation instead of running it each
+'''
+import sys
+import threading
+
+from twisted.internet import defer
+from twisted.python import failure
+
+#==============================================================================
+class _Call:
+    '''
+    Computation in progress for threads
+    '''
+    def __init__(self):
+        self.event  = threading.Event()
+        self.result = None
+        self.error  = None
+
+#==============================================================================
+class SingleFlight:
+    '''
+    Coalesce concurrent calls with the same key
+
+    do()         - for threads: waiters block until the first call is done
+    doDeferred() - for reactor: waiters get Deferred fired with the result
+                   of the first call
+
+    All callers get the same result object - do not modify it.
+    '''
+    #--------------------------------------------------------------------------
+    def __init__(self):
+        self.calls     = 0
+        self.coalesced = 0
+
+        self._calls   = {}
+        self._waiters = {}
+        self._lock    = threading.Lock()
+
+    #--------------------------------------------------------------------------
+    def do(self, key, function, *args, **kwargs):
+        '''
+        Run function once for all threads asking the same key
+        '''
+        self._lock.acquire()
+        call = self._calls.get(key)
+        if call is not None:
+            self.coalesced += 1
+            self._lock.release()
+            call.event.wait()
+            if call.error is not None:
+                raise call.error[0], call.error[1], call.error[2]
+            return call.result
+
+        call = self._calls[key] = _Call()
+        self.calls += 1
+        self._lock.release()
+
+        try:
+            call.result = function(*args, **kwargs)
+        except:
+            call.error = sys.exc_info()
+            raise
+        finally:
+            self._lock.acquire()
+            del self._calls[key]
+            self._lock.release()
+            call.event.set()
+
+        return call.result
+
+    #--------------------------------------------------------------------------
+    def doDeferred(self, key, function, *args, **kwargs):
+        '''
+        Run function (may return Deferred) once for all callers inside the
+        reactor asking the same key
+        '''
+        waiters = self._waiters.get(key)
+        if waiters is not None:
+            self.coalesced += 1
+            deferred = defer.Deferred()
+            waiters.append(deferred)
+            return deferred
+
+        waiters = self._waiters[key] = []
+        self.calls += 1
+
+        def fire(result):
+            del self._waiters[key]
+            for waiter in waiters:
+                if isinstance(result, failure.Failure):
+                    waiter.errback(result)
+                else:
+                    waiter.callback(result)
+            return result
+
+        deferred = defer.maybeDeferred(function, *args, **kwargs)
+        deferred.addBoth(fire)
+        return deferred
+
+    #--------------------------------------------------------------------------
+    def getStats(self):
+        return {
+            'calls'     : self.calls,
+            'coalesced' : self.coalesced,
+            'inflight'  : len(self._calls) + len(self._waiters),
+        }
@@ -3,18 +3,27 @@ import pickle
 import gearman
 from copy import deepcopy
 
+from twisted.internet import defer
+from twisted.web.server import NOT_DONE_YET
+
 from src.libs.fast.core import getMD5Hash
+from src.libs.fast.cachekey import serializeArgs
+from src.libs.fast import cachecodec
 from src.libs.fast.fasttwisted import FastJsonServerResource, FastJsonMemcacheServerResource, FastJsonServerResourceDeferred
 from src.libs.fast.fastgearman import PickleJobClient, get_time_now, check_request_status
 
+GEARMAN_ERRORS = (gearman.errors.ServerUnavailable, gearman.errors.ConnectionError)
+
 #==============================================================================   
 class FastStartGearmanJsonServerResourceDeferred(FastJsonServerResourceDeferred):
     allowedMethods = ('POST',)
     
     #--------------------------------------------------------------------------
+    @defer.inlineCallbacks
     def setUpGearmanJob(self, request, function, param_names, type=None):
         '''
-        Setup job to gearman server
+        Setup job to gearman server - returns Deferred, DB queries run
+        in server DB threads
         '''
         for name in param_names:
             if not name in request.args:
@@ -23,7 +32,9 @@ class FastStartGearmanJsonServerResourceDeferred(FastJsonServerResourceDeferred)
 
         #self.logger.ExtInfo('POST PARAMS [%s]' % request.args)
         self.checkHtmlMode(request)
-        self._server.checkDbConnection()
+        # cached health state - fail fast instead of probing per request
+        yield self._server.checkDbConnectionDeferred()
+        self._server.checkGearman()
          
         data = {
             'params': self.getParamsSet(request, param_names)
@@ -43,9 +54,8 @@ class FastStartGearmanJsonServerResourceDeferred(FastJsonServerResourceDeferred)
 
         args = (type, server, ', '.join(nodes_list) )                                                                                                                
 
-        self._server._query(sql, args)                                                                                                                          
-
-        packet_id = int(self._server._cursor.lastrowid)
+        packet_id = yield self._server.runInsert(sql, args)
+        packet_id = int(packet_id)
         self._log('New task packet ID=[#%s]' % packet_id)                                                                                                  
         
         new_client = PickleJobClient([self._server.gearman_server])
@@ -53,6 +63,14 @@ class FastStartGearmanJsonServerResourceDeferred(FastJsonServerResourceDeferred)
         data['params']['job_packet_id'] = packet_id 
         data['params']['nodes'] = nodes_list 
          
+        sql  = '''
+        INSERT INTO monitord_log 
+            (job_packet_id, job_uid, type, server, node, setup_time, 
+            start_time, end_time, run_time, result, processed) 
+        VALUES 
+            (%s, %s, %s, %s, %s, NOW(), 0, 0, 0, '', 0)'''                                                          
+        log_rows = []
+
         data['job'] = {}
         for node_id in nodes_list:
             '''
@@ -67,21 +85,12 @@ class FastStartGearmanJsonServerResourceDeferred(FastJsonServerResourceDeferred)
             self._log('set job for node=[#%s]' % node_id)
             
             #uids[node_id] = getMD5Hash(pickle.dumps(data))
-            current_request = new_client.submit_job(function % node_id, node_params, 
+            with self._server.guarded('gearman', GEARMAN_ERRORS):
+                current_request = new_client.submit_job(function % node_id, node_params, 
                                             #unique=uids[node_id], 
                                             background=True, wait_until_complete=False)
-            
-            sql  = '''
-            INSERT INTO monitord_log 
-                (job_packet_id, job_uid, type, server, node, setup_time, 
-                start_time, end_time, run_time, result, processed) 
-            VALUES 
-                (%s, %s, %s, %s, %s, NOW(), 0, 0, 0, '', 0)'''                                                          
-            args = (packet_id, current_request.job.unique, type, server, node_id)                                                                                                                  
 
-            self._server._query(sql, args)                                                                                                                          
-            #id = int(self._server._cursor.lastrowid)                                                                                                   
-            
+            log_rows.append((packet_id, current_request.job.unique, type, server, node_id))
             
             #if current_request.job.unique != uids[node_id]:
             #    raise Exception('Different uid')
@@ -95,9 +104,12 @@ class FastStartGearmanJsonServerResourceDeferred(FastJsonServerResourceDeferred)
                 }
         
             self._log('Job [%s]' % check_request_status(current_request))
+
+        # one multi-row INSERT and one commit for all nodes
+        yield self._server.runInteraction(self._server.executeMany, sql, log_rows)
             
         data['result'] = True
-        return data 
+        defer.returnValue(data)
         
 
 #==============================================================================   
@@ -126,10 +138,13 @@ class FastStartGearmanJsonMemcacheServerResource(FastJsonMemcacheServerResource)
 
             data['params']['setup_time'] = get_time_now()
 
+            self._server.checkGearman()
             new_client = PickleJobClient([self._server.gearman_server])
             
-            uid = getMD5Hash(pickle.dumps(data))
-            current_request = new_client.submit_job(function, data['params'], 
+            # 32 hex chars - stored in monitord_log.job_uid
+            uid = getMD5Hash(serializeArgs(data))
+            with self._server.guarded('gearman', GEARMAN_ERRORS):
+                current_request = new_client.submit_job(function, data['params'], 
                                             unique=uid, background=True, wait_until_complete=False)
             
             if current_request.job.unique != uid:
@@ -146,13 +161,17 @@ class FastStartGearmanJsonMemcacheServerResource(FastJsonMemcacheServerResource)
             
             data['job'] = job_data
             
-            self.initMemcache()
-            timeout = self._server.config.getint('main', 'job_delete_timeout')
-            self.mc.set('task-%s' % current_request.job.unique, pickle.dumps(job_data), timeout)
-            
             self._log('Job [%s]' % check_request_status(current_request))
-                
-            return self.returnJsonResponse(request, data) 
+
+            # response is written when task data is stored
+            timeout = self._server.config.getint('main', 'job_delete_timeout')
+            deferred = self.getMemcache().set('task-%s' % current_request.job.unique, 
+                                   cachecodec.dumps(job_data), timeout)
+            deferred.addCallback(lambda stored: self.returnJsonResponse(request, data))
+            deferred.addErrback(lambda reason: 
+                                self.exceptionToJson(request, reason.getErrorMessage()))
+            deferred.addCallback(self.finishResponse, request)
+            return NOT_DONE_YET
         
         except Exception, ex:                                                                                                                                   
             return self.exceptionToJson(request, ex)
@@ -172,23 +191,28 @@ class FastStateGearmanJsonResource(FastJsonMemcacheServerResource):
     def render(self, request):
         try:
             self.checkHtmlMode(request)  
-            data = {}
             
             uid = self.getParam(request, 'uid')
             
-            self.initMemcache()
-            taks_data = pickle.loads(self.mc.get('task-%s' % uid))
-            
-#            gm_admin_client = gearman.GearmanClient([self._server.gearman_server])
-            data['job_data'] = taks_data
-            data['params'] = {
-                'uid' : uid
-            }
-                
-            return self.returnJsonResponse(request, data) 
+            deferred = self.getMemcache().get('task-%s' % uid)
+            deferred.addCallback(self._taskLoaded, request, uid)
+            deferred.addErrback(lambda reason: 
+                                self.exceptionToJson(request, reason.getErrorMessage()))
+            deferred.addCallback(self.finishResponse, request)
+            return NOT_DONE_YET
         
         except Exception, ex:                                                                                                                                   
             return self.exceptionToJson(request, ex)    
+
+    #--------------------------------------------------------------------------
+    def _taskLoaded(self, task_data, request, uid):
+        data = {}
+#            gm_admin_client = gearman.GearmanClient([self._server.gearman_server])
+        data['job_data'] = cachecodec.loads(task_data, legacy=pickle.loads)
+        data['params'] = {
+            'uid' : uid
+        }
+        return self.returnJsonResponse(request, data) 
     
 #==============================================================================   
 class FastStatusGearmanJsonResource(FastJsonServerResource):
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+'''
+Write-behind buffer for FastDbServer
+'''
+import time
+
+from twisted.internet import defer, task
+
+#==============================================================================
+class WriteBehindBuffer:
+    '''
+    Rows of one INSERT statement collected in memory and written with
+    server.executeMany (one multi-row INSERT, one commit) in DB thread when
+    maxRows rows are collected or every interval seconds.
+
+    Use from reactor thread only. Rows of a failed flush are returned to
+    the buffer while it holds less than maxPending rows, then dropped.
+    '''
+    #--------------------------------------------------------------------------
+    def __init__(self, server, sql, maxRows=500, interval=1.0,
+                 maxPending=50000, tags=None):
+        self.server     = server
+        self.sql        = sql
+        self.maxRows    = maxRows
+        self.interval   = interval
+        self.maxPending = maxPending
+        self.tags       = tags
+
+        self.flushes   = 0
+        self.rows      = 0
+        self.failures  = 0
+        self.dropped   = 0
+        self.flushTime = 0.0
+        self.lastFlushTime = 0.0
+        self.maxFlushTime  = 0.0
+
+        self._rows = []
+        self._loop = None
+
+    #--------------------------------------------------------------------------
+    def start(self):
+        '''
+        Start periodic flush
+        '''
+        if self._loop is None:
+            self._loop = task.LoopingCall(self.flush)
+            self._loop.start(self.interval, now=False)
+
+    #--------------------------------------------------------------------------
+    def stop(self):
+        '''
+        Stop periodic flush and write what is left
+        '''
+        if self._loop is not None:
+            self._loop.stop()
+            self._loop = None
+        return self.flush()
+
+    #--------------------------------------------------------------------------
+    def add(self, row):
+        self._rows.append(row)
+        if len(self._rows) >= self.maxRows:
+            self.flush()
+
+    #--------------------------------------------------------------------------
+    def flush(self):
+        '''
+        Write collected rows - returns Deferred fired with rows count
+        '''
+        if not self._rows:
+            return defer.succeed(0)
+
+        rows, self._rows = self._rows, []
+        started = time.time()
+
+        deferred = self.server.runInteraction(self.server.executeMany,
+                                              self.sql, rows, self.tags)
+        deferred.addCallbacks(self._flushed, self._failed,
+                              callbackArgs=(rows, started),
+                              errbackArgs=(rows,))
+        return deferred
+
+    #--------------------------------------------------------------------------
+    def _flushed(self, result, rows, started):
+        spent = time.time() - started
+        self.flushes   += 1
+        self.rows      += len(rows)
+        self.flushTime += spent
+        self.lastFlushTime = spent
+        if spent > self.maxFlushTime:
+            self.maxFlushTime = spent
+        return len(rows)
+
+    #--------------------------------------------------------------------------
+    def _failed(self, reason, rows):
+        self.failures += 1
+        if len(self._rows) + len(rows) <= self.maxPending:
+            self._rows[0:0] = rows
+        else:
+            self.dropped += len(rows)
+        self.server._error('Write-behind flush of [%s] rows failed' % len(rows),
+                           reason.getErrorMessage())
+        return 0
+
+    #--------------------------------------------------------------------------
+    def getStats(self):
+        flushes = self.flushes or 1
+        return {
+            'pending'         : len(self._rows),
+            'flushes'         : self.flushes,
+            'rows'            : self.rows,
+            'failures'        : self.failures,
+            'dropped'         : self.dropped,
+            'rows_per_flush'  : float(self.rows) / flushes,
+            'avg_flush_time'  : self.flushTime / flushes,
+            'last_flush_time' : self.lastFlushTime,
+            'max_flush_time'  : self.maxFlushTime,
+        }
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+'''
+Wire format of cached values: header, compression, chunks and values
+written before the codec
+
+Usage: python -m unittest discover tests
+'''
+import os
+import sys
+import zlib
+import pickle
+import decimal
+import datetime
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src', 'fast'))
+
+import cachecodec
+from cachecodec import dumps, loads, split, join, chunkKeys, isChunked, isEncoded
+from cachekey import KEY_MAX_LENGTH
+
+#==============================================================================
+class CodecTest(unittest.TestCase):
+    #--------------------------------------------------------------------------
+    def testHeader(self):
+        data = dumps({'a' : 1})
+        self.assertEqual(data[:4], '\xfa\x01m\x00')
+        self.assertTrue(isEncoded(data))
+        self.assertFalse(isChunked(data))
+
+    #--------------------------------------------------------------------------
+    def testRoundTrip(self):
+        for value in (None, 0, -1, 2 ** 70, 1.5, '', 'abc', u'я',
+                      [], [1, [2, 3]], (1, 'a'), {'a' : {'b' : None}},
+                      set([1, 2]), True):
+            self.assertEqual(loads(dumps(value)), value)
+            self.assertEqual(type(loads(dumps(value))), type(value))
+
+    #--------------------------------------------------------------------------
+    def testPickledValues(self):
+        value = {'time' : datetime.datetime(2020, 1, 2, 3, 4, 5),
+                 'sum'  : decimal.Decimal('10.25')}
+        data = dumps(value)
+        self.assertEqual(data[2], cachecodec.CODEC_PICKLE)
+        self.assertEqual(loads(data), value)
+
+    #--------------------------------------------------------------------------
+    def testCompressThreshold(self):
+        threshold = 100
+        # marshal of str is 5 bytes of type and length plus the str
+        small = dumps('x' * (threshold - 5), threshold)
+        self.assertEqual(ord(small[3]) & cachecodec.FLAG_ZLIB, 0)
+        large = dumps('x' * (threshold - 4), threshold)
+        self.assertEqual(ord(large[3]) & cachecodec.FLAG_ZLIB, cachecodec.FLAG_ZLIB)
+        self.assertEqual(loads(large), 'x' * (threshold - 4))
+        self.assertEqual(ord(dumps('x' * 1000, 0)[3]), 0)
+
+    #--------------------------------------------------------------------------
+    def testIncompressible(self):
+        value = os.urandom(4096)
+        data = dumps(value)
+        self.assertEqual(ord(data[3]) & cachecodec.FLAG_ZLIB, 0)
+        self.assertEqual(loads(data), value)
+
+    #--------------------------------------------------------------------------
+    def testLegacy(self):
+        self.assertEqual(loads(None), None)
+        self.assertEqual(loads('plain'), 'plain')
+        self.assertEqual(loads(5), 5)
+        old = pickle.dumps({'a' : 1})
+        self.assertEqual(loads(old, legacy=pickle.loads), {'a' : 1})
+        self.assertEqual(loads(None, legacy=pickle.loads), None)
+
+    #--------------------------------------------------------------------------
+    def testUnknownFormat(self):
+        data = dumps(1)
+        self.assertRaises(ValueError, loads, data[:1] + '\x09' + data[2:])
+        self.assertRaises(ValueError, loads, data[:2] + 'z' + data[3:])
+        # flag of compression set on uncompressed payload
+        self.assertRaises(zlib.error, loads, data[:2] + 'm' +
+                          chr(cachecodec.FLAG_ZLIB) + data[4:])
+
+#==============================================================================
+class ChunkTest(unittest.TestCase):
+    #--------------------------------------------------------------------------
+    def testFits(self):
+        data = dumps('x' * 50, 0)
+        head, chunks = split('key', data, len(data))
+        self.assertEqual(head, data)
+        self.assertEqual(chunks, {})
+
+    #--------------------------------------------------------------------------
+    def testSplitJoin(self):
+        value = os.urandom(1000)
+        data = dumps(value)
+        head, chunks = split('key', data, len(data) - 1)
+        self.assertTrue(isChunked(head))
+        self.assertEqual(len(chunks), 2)
+        self.assertEqual(sorted(chunkKeys('key', head)), sorted(chunks))
+        self.assertEqual(loads(join('key', head, chunks)), value)
+        self.assertRaises(ValueError, loads, head)
+
+        head, chunks = split('key', data, 100)
+        self.assertEqual(len(chunks), (len(data) + 99) / 100)
+        self.assertEqual(join('key', head, chunks), data)
+
+    #--------------------------------------------------------------------------
+    def testMissedChunk(self):
+        data = dumps(os.urandom(1000))
+        head, chunks = split('key', data, 300)
+        del chunks[chunkKeys('key', head)[-1]]
+        self.assertEqual(join('key', head, chunks), None)
+
+    #--------------------------------------------------------------------------
+    def testChunkOfOtherWrite(self):
+        data = dumps(os.urandom(1000))
+        head, chunks = split('key', data, 300)
+        other, otherChunks = split('key', dumps(os.urandom(1000)), 300)
+        self.assertEqual(join('key', head, otherChunks), None)
+        # chunk of right key but wrong length
+        key = chunkKeys('key', head)[0]
+        chunks[key] = chunks[key][:-1]
+        self.assertEqual(join('key', head, chunks), None)
+
+    #--------------------------------------------------------------------------
+    def testLongKey(self):
+        key = 'k' * KEY_MAX_LENGTH
+        head, chunks = split(key, dumps(os.urandom(1000)), 300)
+        for chunkKey in chunks:
+            self.assertTrue(len(chunkKey) <= KEY_MAX_LENGTH)
+        self.assertEqual(sorted(chunkKeys(key, head)), sorted(chunks))
+
+if __name__ == '__main__':
+    unittest.main()
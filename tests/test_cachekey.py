@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+'''
+Cache keys of equal arguments must be equal
+
+Usage: python -m unittest discover tests
+'''
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src', 'fast'))
+
+from cachekey import makeKey, hashArgs
+
+#==============================================================================
+class CacheKeyTest(unittest.TestCase):
+    #--------------------------------------------------------------------------
+    def testInternedString(self):
+        built = ''.join(['ab', 'c'])
+        self.assertFalse(built is 'abc')
+        self.assertEqual(makeKey('ns', 'abc'), makeKey('ns', built))
+        self.assertEqual(hashArgs(['abc', 1]), hashArgs([built, 1]))
+
+    #--------------------------------------------------------------------------
+    def testInternedDictKey(self):
+        built = dict([(''.join(['ser', 'ver']), 'srv1')])
+        self.assertEqual(makeKey('ns', {'server' : 'srv1'}), makeKey('ns', built))
+
+    #--------------------------------------------------------------------------
+    def testDifferentArgs(self):
+        self.assertNotEqual(makeKey('ns', 'abc'), makeKey('ns', u'abc'))
+        self.assertNotEqual(makeKey('ns', 1), makeKey('ns', True))
+        self.assertNotEqual(makeKey('ns', ('a', 'b')), makeKey('ns', ('ab',)))
+
+if __name__ == '__main__':
+    unittest.main()
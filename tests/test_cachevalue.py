@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+'''
+Wrapped cached values of version 2 and 1
+
+Usage: python -m unittest discover tests
+'''
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src', 'fast'))
+
+from cachevalue import MISS, isEmpty, wrapValue, unwrapValue, getRefreshAt
+
+#==============================================================================
+class CachedValueTest(unittest.TestCase):
+    #--------------------------------------------------------------------------
+    def testWrap(self):
+        self.assertEqual(wrapValue({'a' : 1}), (2, False, {'a' : 1}, 0))
+        self.assertEqual(wrapValue([], 10.5), (2, True, [], 10.5))
+
+    #--------------------------------------------------------------------------
+    def testRoundTrip(self):
+        for value in (None, [], {}, '', 0, False, [0], 'a'):
+            raw = wrapValue(value, 5)
+            self.assertEqual(unwrapValue(raw), value)
+            self.assertEqual(getRefreshAt(raw), 5)
+
+    #--------------------------------------------------------------------------
+    def testVersion1(self):
+        self.assertEqual(unwrapValue((1, False, [1])), [1])
+        self.assertEqual(unwrapValue((1, True, None)), None)
+        self.assertEqual(getRefreshAt((1, False, [1])), 0)
+
+    #--------------------------------------------------------------------------
+    def testUnknown(self):
+        for raw in (None, [2, False, 1, 0], (3, False, 1, 0), (2, False, 1),
+                    (1, False, 1, 0), 'value', ()):
+            self.assertTrue(unwrapValue(raw) is MISS)
+        self.assertEqual(getRefreshAt(None), 0)
+
+    #--------------------------------------------------------------------------
+    def testMiss(self):
+        self.assertFalse(MISS)
+        self.assertEqual(repr(MISS), 'MISS')
+
+    #--------------------------------------------------------------------------
+    def testEmpty(self):
+        for value in (None, [], (), {}, set(), frozenset(), '', u''):
+            self.assertTrue(isEmpty(value))
+        for value in (0, False, 0.0, [None], ' ', {'a' : None}):
+            self.assertFalse(isEmpty(value))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+'''
+Accept-Encoding negotiation and response compression
+
+Usage: python -m unittest discover tests
+'''
+import os
+import sys
+import zlib
+import gzip
+import unittest
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src', 'fast'))
+
+from httpcompress import negotiate, parseAcceptEncoding, compress
+
+#==============================================================================
+class NegotiateTest(unittest.TestCase):
+    #--------------------------------------------------------------------------
+    def testNone(self):
+        for header in (None, '', 'identity', 'br', 'gzip;q=0', ' , '):
+            self.assertEqual(negotiate(header), None, header)
+
+    #--------------------------------------------------------------------------
+    def testPreferred(self):
+        self.assertEqual(negotiate('gzip, deflate'), 'gzip')
+        self.assertEqual(negotiate('deflate, gzip'), 'gzip')
+        self.assertEqual(negotiate('deflate'), 'deflate')
+        self.assertEqual(negotiate('GZIP'), 'gzip')
+
+    #--------------------------------------------------------------------------
+    def testQuality(self):
+        self.assertEqual(negotiate('gzip;q=0.5, deflate'), 'deflate')
+        self.assertEqual(negotiate('gzip; q=0.5, deflate; q=0.5'), 'gzip')
+        self.assertEqual(negotiate('gzip;q=0, deflate;q=0'), None)
+        self.assertEqual(negotiate('gzip;q=bad, deflate'), 'deflate')
+
+    #--------------------------------------------------------------------------
+    def testWildcard(self):
+        self.assertEqual(negotiate('*'), 'gzip')
+        self.assertEqual(negotiate('gzip;q=0, *'), 'deflate')
+        self.assertEqual(negotiate('*;q=0'), None)
+
+    #--------------------------------------------------------------------------
+    def testParse(self):
+        self.assertEqual(parseAcceptEncoding('gzip;q=0.8, deflate,br;level=1'),
+                         {'gzip' : 0.8, 'deflate' : 1.0, 'br' : 1.0})
+
+#==============================================================================
+class CompressTest(unittest.TestCase):
+    #--------------------------------------------------------------------------
+    def testGzip(self):
+        body = '{"rows": [%s]}' % ', '.join(['1'] * 1000)
+        data = compress(body, 'gzip')
+        self.assertEqual(data[:2], '\x1f\x8b')
+        self.assertEqual(gzip.GzipFile(fileobj=StringIO(data)).read(), body)
+
+    #--------------------------------------------------------------------------
+    def testDeflate(self):
+        body = 'x' * 1000
+        self.assertEqual(zlib.decompress(compress(body, 'deflate', 1)), body)
+        self.assertEqual(zlib.decompress(compress('', 'deflate')), '')
+
+    #--------------------------------------------------------------------------
+    def testUnknown(self):
+        self.assertRaises(ValueError, compress, 'x', 'br')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+'''
+Consistent hashing of keys to nodes
+
+Usage: python -m unittest discover tests
+'''
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src', 'fast'))
+
+from ketama import ClusterNode, HashRing, parseServers
+
+KEYS = ['key-%s' % i for i in range(3000)]
+
+#==============================================================================
+class KetamaTest(unittest.TestCase):
+    #--------------------------------------------------------------------------
+    def _ring(self, count):
+        return HashRing([ClusterNode('10.0.0.%s:11211' % i) for i in range(count)])
+
+    #--------------------------------------------------------------------------
+    def _names(self, ring):
+        return dict((key, ring.getNode(key).name) for key in KEYS)
+
+    #--------------------------------------------------------------------------
+    def testParseServers(self):
+        self.assertEqual(parseServers(' a:1, b:2 ,,'), ['a:1', 'b:2'])
+        self.assertEqual(parseServers(''), [])
+
+    #--------------------------------------------------------------------------
+    def testStable(self):
+        self.assertEqual(self._names(self._ring(3)), self._names(self._ring(3)))
+
+    #--------------------------------------------------------------------------
+    def testBalance(self):
+        counts = {}
+        for name in self._names(self._ring(4)).values():
+            counts[name] = counts.get(name, 0) + 1
+        self.assertEqual(len(counts), 4)
+        for count in counts.values():
+            self.assertTrue(len(KEYS) / 8 < count < len(KEYS) / 2, counts)
+
+    #--------------------------------------------------------------------------
+    def testAddNode(self):
+        before = self._names(self._ring(4))
+        after  = self._names(self._ring(5))
+        moved  = [key for key in KEYS if before[key] != after[key]]
+        # about 1/5 of keys, all of them to the new node
+        self.assertTrue(len(KEYS) / 10 < len(moved) < len(KEYS) * 3 / 10, len(moved))
+        for key in moved:
+            self.assertEqual(after[key], '10.0.0.4:11211')
+
+    #--------------------------------------------------------------------------
+    def testEjected(self):
+        ring = self._ring(3)
+        before = self._names(ring)
+        dead = ring.nodes[0]
+        dead.eject()
+        self.assertFalse(dead.isAvailable())
+        after = self._names(ring)
+        for key in KEYS:
+            if before[key] == dead.name:
+                self.assertNotEqual(after[key], dead.name)
+            else:
+                self.assertEqual(after[key], before[key])
+        dead.deadUntil = 0
+        self.assertEqual(self._names(ring), before)
+
+    #--------------------------------------------------------------------------
+    def testAllEjected(self):
+        for count in (1, 2):
+            ring = self._ring(count)
+            for node in ring.nodes:
+                node.eject()
+            self.assertEqual(ring.getNode('key'), None)
+
+    #--------------------------------------------------------------------------
+    def testEjectionStats(self):
+        node = ClusterNode('a', retry=30)
+        node.eject()
+        node.eject()
+        stats = node.getStats()
+        self.assertEqual((stats['ejections'], stats['errors']), (1, 2))
+        self.assertFalse(stats['available'])
+
+if __name__ == '__main__':
+    unittest.main()
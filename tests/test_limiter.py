@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+'''
+Concurrency cap and wait queue of request handlers
+
+Usage: python -m unittest discover tests
+'''
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src', 'fast'))
+
+from twisted.internet import defer
+
+from limiter import RequestLimiter
+
+#==============================================================================
+class RequestLimiterTest(unittest.TestCase):
+    #--------------------------------------------------------------------------
+    def _start(self, limiter, count):
+        '''
+        Admit and run count handlers which wait for their Deferred
+        '''
+        handlers = []
+        for i in range(count):
+            self.assertTrue(limiter.admit())
+            pending = defer.Deferred()
+            handlers.append(pending)
+            limiter.run(lambda pending=pending: pending)
+        return handlers
+
+    #--------------------------------------------------------------------------
+    def testLimit(self):
+        limiter = RequestLimiter('r', 2, 1)
+        handlers = self._start(limiter, 3)
+        self.assertEqual((limiter.getRunning(), limiter.getQueued()), (2, 1))
+        self.assertFalse(limiter.admit())
+        handlers[0].callback(None)
+        self.assertEqual((limiter.getRunning(), limiter.getQueued()), (2, 0))
+        self.assertTrue(limiter.admit())
+        stats = limiter.getStats()
+        self.assertEqual((stats['accepted'], stats['rejected'], stats['max_queued']),
+                         (4, 1, 1))
+
+    #--------------------------------------------------------------------------
+    def testAdmittedCounted(self):
+        limiter = RequestLimiter('r', 1, 1)
+        self.assertTrue(limiter.admit())
+        self.assertTrue(limiter.admit())
+        # admitted requests not run yet take places too
+        self.assertFalse(limiter.admit())
+
+    #--------------------------------------------------------------------------
+    def testResult(self):
+        limiter = RequestLimiter('r', 1, 0)
+        results = []
+        limiter.admit()
+        limiter.run(lambda a, b: a + b, 1, b=2).addCallback(results.append)
+        limiter.admit()
+        failed = limiter.run(lambda: 1 / 0)
+        failed.addErrback(lambda reason: results.append(reason.type))
+        self.assertEqual(results, [3, ZeroDivisionError])
+        self.assertEqual(limiter.getRunning(), 0)
+
+    #--------------------------------------------------------------------------
+    def testShrink(self):
+        limiter = RequestLimiter('r', 3, 10)
+        handlers = self._start(limiter, 5)
+        limiter.resize(1, 10)
+        self.assertEqual((limiter.getRunning(), limiter.getQueued()), (3, 2))
+        handlers[0].callback(None)
+        handlers[1].callback(None)
+        # still at the old limit - waiting handlers are not started
+        self.assertEqual((limiter.getRunning(), limiter.getQueued()), (1, 2))
+        handlers[2].callback(None)
+        self.assertEqual((limiter.getRunning(), limiter.getQueued()), (1, 1))
+
+    #--------------------------------------------------------------------------
+    def testGrow(self):
+        limiter = RequestLimiter('r', 1, 10)
+        handlers = self._start(limiter, 4)
+        limiter.resize(3, 10)
+        self.assertEqual((limiter.getRunning(), limiter.getQueued()), (3, 1))
+        for pending in handlers:
+            pending.callback(None)
+        self.assertEqual((limiter.getRunning(), limiter.getQueued()), (0, 0))
+        self.assertEqual(limiter._semaphore.tokens, 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+'''
+LRU cache bounds and expiration
+
+Usage: python -m unittest discover tests
+'''
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src', 'fast'))
+
+import lrucache
+from lrucache import LRUCache
+
+#==============================================================================
+class _Clock:
+    '''
+    Replaces time module of lrucache
+    '''
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+#==============================================================================
+class LRUCacheTest(unittest.TestCase):
+    #--------------------------------------------------------------------------
+    def setUp(self):
+        self.clock = _Clock()
+        self._time = lrucache.time
+        lrucache.time = self.clock
+
+    #--------------------------------------------------------------------------
+    def tearDown(self):
+        lrucache.time = self._time
+
+    #--------------------------------------------------------------------------
+    def testEntries(self):
+        cache = LRUCache(maxEntries=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        # b is least recently used
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.getStats()['evictions'], 1)
+
+    #--------------------------------------------------------------------------
+    def testBytes(self):
+        cache = LRUCache(maxBytes=10, sizeof=len)
+        cache.set('a', 'x' * 4)
+        cache.set('b', 'x' * 4)
+        cache.set('c', 'x' * 4)
+        self.assertFalse('a' in cache)
+        self.assertEqual(cache.bytes, 8)
+        cache.set('b', 'x' * 6)
+        self.assertEqual(cache.bytes, 10)
+        self.assertTrue('b' in cache)
+        self.assertTrue('c' in cache)
+
+    #--------------------------------------------------------------------------
+    def testOversize(self):
+        cache = LRUCache(maxBytes=10, sizeof=len)
+        cache.set('a', 'x')
+        self.assertFalse(cache.set('a', 'x' * 11))
+        # old value is not served instead of the new one
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.bytes, 0)
+        self.assertTrue(cache.set('b', 'x' * 10))
+
+    #--------------------------------------------------------------------------
+    def testExpire(self):
+        cache = LRUCache(expire=60)
+        cache.set('a', 1)
+        cache.set('b', 2, 10)
+        cache.set('c', 3, 600)
+        cache.set('d', 4, 0)
+        self.clock.now += 10
+        self.assertEqual(cache.get('b', 'gone'), 'gone')
+        self.assertEqual(cache.get('a'), 1)
+        self.clock.now += 50
+        # expire is capped by cache expire, 0 - cache expire
+        for key in 'acd':
+            self.assertEqual(cache.get(key), None)
+        self.assertEqual(cache.getStats()['expired'], 4)
+
+    #--------------------------------------------------------------------------
+    def testStoredNone(self):
+        cache = LRUCache()
+        cache.set('a', None)
+        self.assertEqual(cache.get('a', 'default'), None)
+        self.assertEqual(cache.getStats()['hits'], 1)
+
+    #--------------------------------------------------------------------------
+    def testDeleteClear(self):
+        cache = LRUCache(maxBytes=100, sizeof=len)
+        cache.set('a', 'xx')
+        cache.set('b', 'xxx')
+        cache.delete('a')
+        cache.delete('missed')
+        self.assertEqual(cache.bytes, 3)
+        cache.clear()
+        self.assertEqual(cache.bytes, 0)
+        self.assertEqual(len(cache), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+'''
+Shared cache publish and read
+
+Usage: python -m unittest discover tests
+'''
+import os
+import sys
+import copy
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src', 'fast'))
+
+from sharedcache import SharedCache, SharedCacheFull, _MISSING
+
+#==============================================================================
+class SharedCacheTest(unittest.TestCase):
+    #--------------------------------------------------------------------------
+    def testEmpty(self):
+        cache = SharedCache(64 * 1024)
+        self.assertEqual(cache.getGeneration(), 0)
+        self.assertEqual(cache.get('a', 'default'), 'default')
+        self.assertEqual(cache.keys(), [])
+
+    #--------------------------------------------------------------------------
+    def testPublish(self):
+        cache = SharedCache(64 * 1024)
+        self.assertEqual(cache.publish({'a' : 1, 'b' : [1, 2]}), 1)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('b'), [1, 2])
+        self.assertEqual(cache.get('c'), None)
+        self.assertEqual(cache.publish({'a' : 2}), 2)
+        self.assertEqual(cache.get('a'), 2)
+        self.assertEqual(cache.get('b'), None)
+
+    #--------------------------------------------------------------------------
+    def testDecodedOncePerGeneration(self):
+        cache = SharedCache(64 * 1024)
+        cache.publish({'a' : [1, 2]})
+        self.assertTrue(cache.get('a') is cache.get('a'))
+        first = cache.get('a')
+        cache.publish({'a' : [1, 2]})
+        self.assertFalse(cache.get('a') is first)
+        self.assertEqual(cache.getStats()['decoded'], 1)
+
+    #--------------------------------------------------------------------------
+    def testReadDuringPublish(self):
+        cache = SharedCache(64 * 1024)
+        cache.publish({'a' : 1})
+        # new generation is written but not switched yet
+        cache._writeSlot(1, 'garbage' * 10)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.retries, 0)
+
+    #--------------------------------------------------------------------------
+    def testSlotOverwrittenUnderReader(self):
+        cache = SharedCache(64 * 1024)
+        cache.publish({'a' : 'first', 'b' : 'first'})
+        self.assertEqual(cache.get('a'), 'first')
+        # the other process publishes twice - slot of loaded index is reused
+        writer = copy.copy(cache)
+        writer.publish({'b' : 'second'})
+        writer.publish({'x' : 'third', 'b' : 'third'})
+        self.assertEqual(cache._slotStart, writer._getSlotStart(0))
+        self.assertTrue(cache._readRaw('b') is _MISSING)
+        self.assertEqual(cache.get('b'), 'third')
+
+    #--------------------------------------------------------------------------
+    def testFull(self):
+        cache = SharedCache(4 * 1024)
+        cache.publish({'a' : 1})
+        self.assertRaises(SharedCacheFull, cache.publish,
+                          {'a' : os.urandom(cache.dataSize)})
+        self.assertEqual(cache.getGeneration(), 1)
+        self.assertEqual(cache.get('a'), 1)
+        # data of half of size fits
+        cache.publish({'a' : 'x' * (cache.dataSize // 2)})
+        self.assertEqual(cache.getGeneration(), 2)
+
+    #--------------------------------------------------------------------------
+    def testConcurrentReader(self):
+        cache = SharedCache(1024 * 1024)
+        cache.publish({'value' : [0] * 1000})
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                deadline = time.time() + 10
+                while time.time() < deadline:
+                    value = cache.get('value')
+                    if value is None or len(set(value)) != 1:
+                        code = 1
+                        break
+                    if value[0] == -1:
+                        break
+            finally:
+                os._exit(code)
+        for generation in range(1, 300):
+            cache.publish({'value' : [generation] * 1000})
+        cache.publish({'value' : [-1] * 1000})
+        self.assertEqual(os.waitpid(pid, 0)[1], 0)
+
+if __name__ == '__main__':
+    unittest.main()
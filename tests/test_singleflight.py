@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+'''
+Coalescing of concurrent calls
+
+Usage: python -m unittest discover tests
+'''
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src', 'fast'))
+
+from twisted.internet import defer
+
+from singleflight import SingleFlight
+
+#==============================================================================
+class SingleFlightTest(unittest.TestCase):
+    #--------------------------------------------------------------------------
+    def _runThreads(self, flight, function, count=5):
+        '''
+        Results of count threads calling function under one key - the
+        first call is held until all threads are waiting
+        '''
+        results = []
+        threads = [threading.Thread(target=self._call,
+                                    args=(flight, function, results))
+                   for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        return results
+
+    #--------------------------------------------------------------------------
+    def _call(self, flight, function, results):
+        try:
+            results.append(flight.do('key', function))
+        except Exception, ex:
+            results.append(ex)
+
+    #--------------------------------------------------------------------------
+    def testThreads(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+        def function():
+            calls.append(1)
+            release.wait(5)
+            return [1]
+        waiter = threading.Timer(0.2, release.set)
+        waiter.start()
+        results = self._runThreads(flight, function)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [[1]] * 5)
+        self.assertTrue(results[0] is results[1])
+        self.assertEqual(flight.getStats(),
+                         {'calls' : 1, 'coalesced' : 4, 'inflight' : 0})
+
+    #--------------------------------------------------------------------------
+    def testThreadsError(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        def function():
+            release.wait(5)
+            raise ValueError('failed')
+        threading.Timer(0.2, release.set).start()
+        results = self._runThreads(flight, function)
+        self.assertEqual(len(results), 5)
+        for result in results:
+            self.assertTrue(isinstance(result, ValueError))
+        # key is free after error
+        self.assertEqual(flight.do('key', lambda: 2), 2)
+
+    #--------------------------------------------------------------------------
+    def testDeferred(self):
+        flight = SingleFlight()
+        pending = defer.Deferred()
+        calls = []
+        def function(value):
+            calls.append(value)
+            return pending
+        results = []
+        for i in range(3):
+            flight.doDeferred('key', function, i).addCallback(results.append)
+        self.assertEqual(flight.getStats()['inflight'], 1)
+        pending.callback('done')
+        self.assertEqual(calls, [0])
+        self.assertEqual(results, ['done'] * 3)
+        self.assertEqual(flight.getStats()['inflight'], 0)
+        flight.doDeferred('key', lambda: 'again').addCallback(results.append)
+        self.assertEqual(results[-1], 'again')
+
+    #--------------------------------------------------------------------------
+    def testDeferredError(self):
+        flight = SingleFlight()
+        pending = defer.Deferred()
+        errors = []
+        for i in range(3):
+            deferred = flight.doDeferred('key', lambda: pending)
+            deferred.addErrback(lambda reason: errors.append(reason.value))
+        pending.errback(ValueError('failed'))
+        self.assertEqual(len(errors), 3)
+        self.assertTrue(isinstance(errors[0], ValueError))
+        # synchronous exception of function is a failure too
+        deferred = flight.doDeferred('other', lambda: 1 / 0)
+        deferred.addErrback(lambda reason: errors.append(reason.value))
+        self.assertTrue(isinstance(errors[-1], ZeroDivisionError))
+
+if __name__ == '__main__':
+    unittest.main()